@@ -1,19 +1,444 @@
-from web_scraper import Scraper
+'''Command line interface of the pipeline.
+
+Each subcommand imports only the modules it needs, so status and upload
+start without loading selenium, aiohttp or pandas, and Chrome is started
+with a local chromedriver rather than one looked up on the network.
+
+Usage:
+
+    python scraper/__main__.py scrape [--resume] [--backend http]
+        [--concurrency 8] [--pool-size 4] [--batch-size 50]
+        [--queue raw_data/queue.db] [--dedup raw_data/dedup.json]
+    python scraper/__main__.py upload [--ids ID ...]
+    python scraper/__main__.py reparse [--reload-rds]
+    python scraper/__main__.py status
+    python scraper/__main__.py horses [--ttl DAYS]
+    python scraper/__main__.py daemon [--port 8080]
+    python scraper/__main__.py migrate
+
+Running without a subcommand scrapes, as before.
+'''
+
 import configparser
+import argparse
+import sys
 import os
 
-if __name__ == '__main__':
-    config = configparser.ConfigParser()
-    f = os.path.join(
-            os.path.dirname(os.path.abspath(__file__)), '../config.ini')
-    config.read(f)
+RAW_DATA_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '../raw_data/')
+CONFIG_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '../config.ini')
+COMMANDS = ('scrape', 'upload', 'reparse', 'status', 'horses', 'daemon',
+            'migrate')
+
+
+def build_scraper(args, config: configparser.ConfigParser):
+    '''Create a Scraper from the options shared by scrape and daemon.
+
+    Races are written to the sinks of the [STORAGE] section if there is
+    one, and otherwise straight to the RDS and bucket, in batches of
+    --batch-size, which overrides the BATCH_SIZE of the sinks. With a
+    --queue the races are written by the upload workers instead.
+    '''
+    from web_scraper import Scraper
+    from rate_limiter import RateLimiter
+    scr = Scraper(backend=args.backend, cache_path=args.cache,
+                  pool_size=args.pool_size, batch_size=args.batch_size or 1,
+                  queue_path=args.queue, upload_workers=args.upload_workers,
+                  limiter=RateLimiter(rate=args.rate, max_rate=args.max_rate))
+    scr.raw_data_path = args.raw_data
+    scr.dedup_path = args.dedup
+    if config.has_section('STORAGE'):
+        from storage import storage_from_config
+        scr.storage = storage_from_config(
+            config, scr.raw_data_path, args.batch_size)
+    if args.horses:
+        from horse_crawler import HorseCrawler
+        scr.horses = HorseCrawler(
+            config['RDS'], limiter=scr.limiter, ttl=args.horse_ttl * 86400)
+    return scr
+
+
+def close_scraper(scr) -> None:
+    '''Flush the sinks of a Scraper, and stop its threads and drivers.'''
+    try:
+        if scr.storage is not None:
+            scr.storage.close()
+    finally:
+        scr.images.close()
+        if scr.pool is not None:
+            scr.pool.close()
+        scr.driver.quit()
+        if scr.cache is not None:
+            scr.cache.close()
+
+
+def planner_from_args(args):
+    '''A CalendarPlanner knowing the meetings of the fixture lists.'''
+    from calendar_planner import CalendarPlanner
+    planner = CalendarPlanner()
+    for path in args.fixtures:
+        with open(path, 'rb') as f:
+            planner.add_fixtures(f.read())
+    return planner
+
+
+def scrape_command(args, config: configparser.ConfigParser) -> None:
+    '''Scrape the results of the last HISTORIC_DATES days.'''
+    from metrics import MetricsDumper, MetricsServer
     try:
         num_dates = int(os.getenv('HISTORIC_DATES', default=1))
     except TypeError:
         num_dates = 1
-    scr = Scraper()
-    scr.scrape_dates(
-            scr.create_date_links(days=num_dates),
-            config['RDS'],
-            config['S3']['bucket']
-            )
+    scr = build_scraper(args, config)
+    if args.checkpoint or args.resume:
+        scr.checkpoint_path = args.checkpoint or os.path.join(
+            scr.raw_data_path, 'checkpoint.db')
+    scr.parquet_path = args.parquet
+    if args.plan or args.fixtures:
+        scr.planner = planner_from_args(args)
+    server = dumper = None
+    try:
+        if args.metrics_port is not None:
+            server = MetricsServer(
+                host=args.metrics_host, port=args.metrics_port).start()
+        if args.metrics_file is not None:
+            dumper = MetricsDumper(
+                args.metrics_file, args.metrics_interval).start()
+        if args.coordinate:
+            from sharding import create_shards
+            create_shards(
+                config['RDS'],
+                scr.create_date_links(days=num_dates),
+                args.shard_days
+                )
+        elif args.worker:
+            from sharding import ShardWorker
+            ShardWorker(config['RDS']).run(
+                scr,
+                config['RDS'],
+                config['S3']['bucket'],
+                concurrency=args.concurrency
+                )
+        else:
+            scr.scrape_dates(
+                    scr.create_date_links(days=num_dates),
+                    config['RDS'],
+                    config['S3']['bucket'],
+                    concurrency=args.concurrency,
+                    resume=args.resume
+                    )
+    finally:
+        close_scraper(scr)
+        if dumper is not None:
+            dumper.stop()
+        if server is not None:
+            server.stop()
+
+
+def upload_command(args, config: configparser.ConfigParser) -> None:
+    '''Write saved races to the sinks of the [STORAGE] section.'''
+    from storage import load_race, storage_from_config
+    ids = args.ids or saved_races(args.raw_data)
+    storage = storage_from_config(config, args.raw_data)
+    for id in ids:
+        storage.add(load_race(args.raw_data, id))
+    storage.close()
+    print(f'Uploaded {len(ids)} races')
+
+
+def reparse_command(args, config: configparser.ConfigParser) -> None:
+    '''Rebuild the saved races from the page cache.'''
+    from reparse import reparse
+    reparse(
+        args.cache or os.path.join(args.raw_data, 'page_cache'),
+        args.raw_data,
+        db=config['RDS'] if args.reload_rds else None,
+        workers=args.workers,
+        parquet_path=args.parquet
+        )
+
+
+def status_command(args, config: configparser.ConfigParser) -> None:
+    '''Print the saved races and the progress of the last run.'''
+    print(f'Saved races: {len(saved_races(args.raw_data))}')
+    checkpoint = args.checkpoint or os.path.join(
+        args.raw_data, 'checkpoint.db')
+    if os.path.exists(checkpoint):
+        from checkpoint import RunState
+        state = RunState(checkpoint)
+        print(f'Run state: {state.counts()}')
+        state.close()
+    else:
+        print('Run state: no checkpoint')
+    cache = args.cache or os.path.join(args.raw_data, 'page_cache')
+    if os.path.exists(cache):
+        from page_cache import PageCache
+        pages = PageCache(cache)
+        print(f'Page cache: {len(pages.urls())} pages, '
+              f'{pages.size() / 1024 ** 2:.1f} MB')
+        pages.close()
+
+
+def horses_command(args, config: configparser.ConfigParser) -> None:
+    '''Fetch the profiles of the horses in the runner table.'''
+    from horse_crawler import HorseCrawler
+    from rate_limiter import RateLimiter
+    crawler = HorseCrawler(
+        config['RDS'],
+        limiter=RateLimiter(rate=args.rate, max_rate=args.max_rate),
+        ttl=args.ttl * 86400,
+        workers=args.workers
+        )
+    crawler.crawl()
+
+
+def daemon_command(args, config: configparser.ConfigParser) -> None:
+    '''Keep polling the results of recent meetings until stopped.'''
+    from daemon import Daemon
+    from metrics import MetricsServer
+    import signal
+    scr = build_scraper(args, config)
+    daemon = Daemon(
+        scr,
+        config['RDS'],
+        config['S3']['bucket'],
+        planner=planner_from_args(args),
+        delay=args.delay * 60,
+        poll=args.poll * 60,
+        give_up=args.give_up * 3600,
+        lookback=args.lookback
+        )
+    server = MetricsServer(host=args.host, port=args.port)
+    server.routes['/health'] = daemon.health
+    server.start()
+    signal.signal(signal.SIGTERM, lambda *x: daemon.stop())
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        daemon.stop()
+    finally:
+        server.stop()
+        close_scraper(scr)
+
+
+def migrate_command(args, config: configparser.ConfigParser) -> None:
+    '''Upgrade tables created by earlier versions to the current schema.'''
+    from migrate import migrate_runner_table
+    migrate_runner_table(config['RDS'])
+
+
+def saved_races(raw_data_path: str) -> list:
+    '''Ids of the races saved in the data folder.'''
+    if not os.path.isdir(raw_data_path):
+        return []
+    return sorted(
+        x for x in os.listdir(raw_data_path)
+        if os.path.exists(os.path.join(raw_data_path, x, f'{x}.json')))
+
+
+def parse_args(argv: list) -> argparse.Namespace:
+    '''Parse the command line, scraping when no subcommand is given.'''
+    if not argv or (argv[0] not in COMMANDS
+                    and argv[0] not in ('-h', '--help')):
+        argv = ['scrape'] + list(argv)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        '--config', default=CONFIG_PATH,
+        help='config file (default: config.ini)')
+    common.add_argument(
+        '--raw-data', default=RAW_DATA_PATH,
+        help='data folder races are saved in (default: raw_data)')
+    tuning = argparse.ArgumentParser(add_help=False)
+    tuning.add_argument(
+        '--pool-size', type=int, default=1,
+        help='drivers scraping the races of a day at once (default: 1)')
+    tuning.add_argument(
+        '--batch-size', type=int, default=None,
+        help='races written per transaction, overriding the BATCH_SIZE '
+             'of [STORAGE] (default: 1)')
+    tuning.add_argument(
+        '--queue', default=None,
+        help='upload queue file, to upload races in the background')
+    tuning.add_argument(
+        '--upload-workers', type=int, default=4,
+        help='threads uploading from the queue (default: 4)')
+    tuning.add_argument(
+        '--dedup', default=None,
+        help='JSON file to keep the index of scraped urls in between runs')
+    parser = argparse.ArgumentParser(
+        description='Scrape HKJC race results to S3 and the RDS.')
+    commands = parser.add_subparsers(dest='command')
+
+    scrape = commands.add_parser(
+        'scrape', parents=[common, tuning], help='scrape race results')
+    scrape.add_argument(
+        '--backend', choices=('selenium', 'http'), default='selenium',
+        help='load pages in Chrome, or over plain HTTP (default: selenium)')
+    scrape.add_argument(
+        '--concurrency', type=int, default=1,
+        help='pages fetched at once by the async crawler (default: 1)')
+    scrape.add_argument(
+        '--resume', action='store_true',
+        help='continue the last run from its checkpoint')
+    scrape.add_argument(
+        '--checkpoint', default=None,
+        help='run state file, kept at raw_data/checkpoint.db with --resume')
+    scrape.add_argument(
+        '--cache', default=None,
+        help='folder to keep a compressed copy of every results page in')
+    scrape.add_argument(
+        '--parquet', default=None,
+        help='folder of Parquet datasets to also append races to')
+    scrape.add_argument(
+        '--coordinate', action='store_true',
+        help='split the dates into shards for workers, then exit')
+    scrape.add_argument(
+        '--worker', action='store_true',
+        help='scrape shards leased from the RDS until all are done')
+    scrape.add_argument(
+        '--shard-days', type=int, default=30,
+        help='number of dates in each shard (default: 30)')
+    scrape.add_argument(
+        '--plan', action='store_true',
+        help='scrape likely meeting days first and probe the rest together')
+    scrape.add_argument(
+        '--fixtures', nargs='*', default=[],
+        help='saved fixture list pages to learn meeting days from')
+    scrape.add_argument(
+        '--horses', action='store_true',
+        help='fetch the profiles of new horses while scraping')
+    scrape.add_argument(
+        '--horse-ttl', type=float, default=7,
+        help='days before a horse profile is fetched again (default: 7)')
+    scrape.add_argument(
+        '--rate', type=float, default=1,
+        help='starting requests per second to the site (default: 1)')
+    scrape.add_argument(
+        '--max-rate', type=float, default=4,
+        help='highest requests per second to the site (default: 4)')
+    scrape.add_argument(
+        '--metrics-port', type=int, default=None,
+        help='serve Prometheus metrics at /metrics on this port')
+    scrape.add_argument(
+        '--metrics-host', default='127.0.0.1',
+        help='address of the metrics server (default: 127.0.0.1)')
+    scrape.add_argument(
+        '--metrics-file', default=None,
+        help='write a JSON snapshot of the metrics to this file')
+    scrape.add_argument(
+        '--metrics-interval', type=float, default=60,
+        help='seconds between metrics snapshots (default: 60)')
+
+    upload = commands.add_parser(
+        'upload', parents=[common],
+        help='write saved races to the configured storage')
+    upload.add_argument(
+        '--ids', nargs='*', default=None,
+        help='races to upload (default: every saved race)')
+
+    reparse = commands.add_parser(
+        'reparse', parents=[common],
+        help='rebuild saved races from the page cache')
+    reparse.add_argument(
+        '--cache', default=None,
+        help='folder of the page cache (default: raw_data/page_cache)')
+    reparse.add_argument(
+        '--reload-rds', action='store_true',
+        help='replace the reparsed races in the RDS')
+    reparse.add_argument(
+        '--parquet', default=None,
+        help='folder of Parquet datasets to also write the races to')
+    reparse.add_argument(
+        '--workers', type=int, default=None,
+        help='number of processes (default: one per core)')
+
+    status = commands.add_parser(
+        'status', parents=[common],
+        help='show saved races and the last run state')
+    status.add_argument(
+        '--checkpoint', default=None,
+        help='run state file (default: raw_data/checkpoint.db)')
+    status.add_argument(
+        '--cache', default=None,
+        help='folder of the page cache (default: raw_data/page_cache)')
+
+    horses = commands.add_parser(
+        'horses', parents=[common],
+        help='fetch the profiles of the horses in the runner table')
+    horses.add_argument(
+        '--ttl', type=float, default=7,
+        help='days before a profile is fetched again (default: 7)')
+    horses.add_argument(
+        '--workers', type=int, default=4,
+        help='number of profiles requested at once (default: 4)')
+    horses.add_argument(
+        '--rate', type=float, default=1,
+        help='starting requests per second to the site (default: 1)')
+    horses.add_argument(
+        '--max-rate', type=float, default=4,
+        help='highest requests per second to the site (default: 4)')
+
+    daemon = commands.add_parser(
+        'daemon', parents=[common, tuning],
+        help='keep polling the results of recent meetings')
+    daemon.add_argument(
+        '--backend', choices=('selenium', 'http'), default='selenium',
+        help='load pages in Chrome, or over plain HTTP (default: selenium)')
+    daemon.add_argument(
+        '--cache', default=None,
+        help='folder to keep a compressed copy of every results page in')
+    daemon.add_argument(
+        '--fixtures', nargs='*', default=[],
+        help='saved fixture list pages to learn meeting days from')
+    daemon.add_argument(
+        '--delay', type=float, default=10,
+        help='minutes after the last race before polling (default: 10)')
+    daemon.add_argument(
+        '--poll', type=float, default=5,
+        help='minutes between polls of a meeting (default: 5)')
+    daemon.add_argument(
+        '--give-up', type=float, default=6,
+        help='hours a meeting is polled for (default: 6)')
+    daemon.add_argument(
+        '--lookback', type=int, default=3,
+        help='days before today to keep polled (default: 3)')
+    daemon.add_argument(
+        '--horses', action='store_true',
+        help='fetch the profiles of new horses while scraping')
+    daemon.add_argument(
+        '--horse-ttl', type=float, default=7,
+        help='days before a horse profile is fetched again (default: 7)')
+    daemon.add_argument(
+        '--rate', type=float, default=1,
+        help='starting requests per second to the site (default: 1)')
+    daemon.add_argument(
+        '--max-rate', type=float, default=4,
+        help='highest requests per second to the site (default: 4)')
+    daemon.add_argument(
+        '--host', default='127.0.0.1',
+        help='address of the health and metrics server '
+        '(default: 127.0.0.1)')
+    daemon.add_argument(
+        '--port', type=int, default=8080,
+        help='serve /health and /metrics on this port (default: 8080)')
+
+    commands.add_parser(
+        'migrate', parents=[common],
+        help='upgrade tables created by earlier versions')
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None) -> None:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    {'scrape': scrape_command, 'upload': upload_command,
+     'reparse': reparse_command, 'status': status_command,
+     'horses': horses_command, 'daemon': daemon_command,
+     'migrate': migrate_command
+     }[args.command](args, config)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,398 @@
+'''Async Crawler Module
+
+This module contains an asyncio crawler that fetches many results pages
+at once over HTTP, while producing the same JSON, images, RDS rows and
+S3 objects as Scraper.scrape_dates.
+'''
+
+from http_driver import HtmlPage, USER_AGENT
+from metrics import (
+                    FETCH_SECONDS, PAGES, RACES, RETRIES, NO_EVENTS,
+                    SLEEP_SECONDS
+                    )
+from page_parser import PageParser
+from uploader import (
+                    no_event_insert,
+                    upload_to_bucket_by_id,
+                    upload_to_rds_by_id
+                    )
+from rate_limiter import CircuitOpenError, RETRY_STATUS
+from concurrent.futures import Future
+import aiohttp
+import asyncio
+import functools
+import time
+
+
+class RetryableError(Exception):
+    '''Raised for responses that are worth requesting again.'''
+
+
+# Errors that leave a page unfetched, skipping it rather than the crawl.
+FETCH_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, RetryableError,
+                CircuitOpenError)
+# Errors raised by a page that does not parse as a race, skipping the race.
+PARSE_ERRORS = (LookupError, ValueError)
+
+
+class AsyncCrawler(object):
+    '''AsyncCrawler Class
+
+    Crawls a list of dates concurrently. Each date page is fetched, then
+    every race on its card is fetched as a separate task, bounded by a
+    shared concurrency limit and the scraper's RateLimiter. Saving and
+    uploading run in worker threads so they do not block the event loop.
+
+    Example usage:
+
+        crawler = AsyncCrawler(scraper, concurrency=16)
+        crawler.run(scraper.create_date_links(days=365), db, bucket)
+        print(crawler.pages_per_second)
+    '''
+
+    def __init__(self, scraper, concurrency: int = 8, retries: int = 3,
+                 timeout: float = 30):
+        '''Initialises AsyncCrawler
+
+        Args:
+            scraper (Scraper): Provides the data folder, page parsing,
+                JSON saving and the RateLimiter requests wait on.
+            concurrency (int): Maximum number of requests in flight.
+            retries (int): Attempts after the first for a failed request
+                or a race page that did not load. Each is held back by
+                the backoff of the RateLimiter.
+            timeout (float): Seconds to wait for a response.
+
+        Parameters:
+            pages (int): Number of pages fetched in the last run.
+            elapsed (float): Duration of the last run in seconds.
+        '''
+        self.scraper = scraper
+        self.limiter = scraper.limiter
+        self.concurrency = concurrency
+        self.retries = retries
+        self.timeout = timeout
+        self.pages = 0
+        self.elapsed = 0.0
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.pages / self.elapsed if self.elapsed else 0.0
+
+    def run(self, links: list, db: dict, bucket: str) -> None:
+        '''Crawl a list of dates, blocking until finished.
+
+        Args:
+            links (list): a list of urls to the first race of a day.
+            db (dict): Dict containing parameters used in building an
+                SQLAlchemy Engine.
+            bucket (str): The name of the S3 bucket.
+        '''
+        asyncio.run(self.crawl(links, db, bucket))
+
+    async def crawl(self, links: list, db: dict, bucket: str) -> None:
+        '''Crawl a list of dates.
+
+        Args:
+            links (list): a list of urls to the first race of a day.
+            db (dict): Dict containing parameters used in building an
+                SQLAlchemy Engine.
+            bucket (str): The name of the S3 bucket.
+        '''
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.pages = 0
+        start = time.monotonic()
+        index = await self._in_thread(self.scraper._load_index, db, links)
+        retrieved_urls = index.retrieved
+        no_event_urls = index.no_event
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(
+                connector=connector,
+                headers={'User-Agent': USER_AGENT},
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+                ) as session:
+            self.session = session
+            tasks = []
+            for link in links:
+                if link in no_event_urls:
+                    print(f'No Event on {link}')
+                    continue
+                tasks.append(self._crawl_checked(
+                    link, retrieved_urls, db, bucket))
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                await self._in_thread(index.save)
+        self.elapsed = time.monotonic() - start
+        print(f'Fetched {self.pages} pages in {self.elapsed:.1f}s '
+              f'({self.pages_per_second:.2f} pages/sec)')
+
+    async def _crawl_checked(self, link: str, retrieved_urls: set,
+                             db: dict, bucket: str) -> None:
+        '''Crawl a date if the scraper's before_date allows it.
+
+        With the scraper's failed_dates set, a date that raises is
+        recorded and skipped, as in scrape_dates.
+
+        Args:
+            link (str): URL to the first race of the day.
+            retrieved_urls (set): URLs that have already been scraped.
+            db (dict): Parameters used in building an SQLAlchemy Engine.
+            bucket (str): The name of the S3 bucket.
+        '''
+        scraper = self.scraper
+        if scraper.before_date is not None and not await self._in_thread(
+                scraper.before_date, link):
+            print(f'Stopped before {link}')
+            return
+        try:
+            await self._crawl_date(link, retrieved_urls, db, bucket)
+        except Exception as e:
+            if scraper.failed_dates is None:
+                raise
+            print(f'Failed to scrape {link}: {e!r}')
+            scraper.failed_dates.append(link)
+
+    async def _crawl_date(self, link: str, retrieved_urls: set,
+                          db: dict, bucket: str) -> None:
+        '''Fetch the first race of a day, then every other race on the card.
+
+        With a run state, finished dates are skipped and the races of a
+        parsed date are taken from its recorded card. A date whose page
+        can not be fetched is reported and skipped, as in scrape_dates.
+
+        Args:
+            link (str): URL to the first race of the day.
+            retrieved_urls (set): URLs that have already been scraped.
+            db (dict): Parameters used in building an SQLAlchemy Engine.
+            bucket (str): The name of the S3 bucket.
+        '''
+        state = self.scraper.state
+        status = state.date_status(link) if state is not None else None
+        if status == 'done':
+            print(f'Date Already Completed: {link}')
+            return
+        tasks = []
+        if status == 'parsed':
+            race_links = state.card(link)
+        else:
+            try:
+                page = await self._fetch_page(link)
+            except FETCH_ERRORS as e:
+                print(f'Unable to load {link}: {e!r}')
+                return
+            if state is not None:
+                state.set_date(link, 'fetched')
+            parser = PageParser(page)
+            if parser.if_event(link):
+                print(f'No Event on {link}')
+                NO_EVENTS.inc()
+                await self._in_thread(no_event_insert, db, link)
+                self.scraper.index.add_no_event(link)
+                if state is not None:
+                    state.set_date(link, 'done')
+                return
+            race_links = parser.card_races()
+            self.scraper.cards[link] = [link] + race_links
+            if state is not None:
+                state.set_card(link, [link] + race_links)
+            if not self.scraper._race_done(link, retrieved_urls):
+                tasks.append(self._store(parser, db, bucket, link))
+        for race_link in race_links:
+            if self.scraper._race_done(race_link, retrieved_urls):
+                continue
+            tasks.append(self._crawl_race(race_link, db, bucket))
+        await asyncio.gather(*tasks)
+        if state is not None:
+            state.finish_date(link)
+
+    async def _crawl_race(self, race_link: str, db: dict,
+                          bucket: str) -> None:
+        '''Fetch a race page, retrying while it has no results to scrape.
+
+        A page without results is not a failure of the host, and is
+        fetched again after the RateLimiter's retry delay.
+
+        Args:
+            race_link (str): URL of the race.
+            db (dict): Parameters used in building an SQLAlchemy Engine.
+            bucket (str): The name of the S3 bucket.
+        '''
+        for tries in range(self.retries + 1):
+            try:
+                page = await self._fetch_page(race_link)
+            except FETCH_ERRORS as e:
+                print(f'Unable to load race {race_link}: {e!r}')
+                return
+            print(f'Accessed {race_link}')
+            if self.scraper.state is not None:
+                self.scraper.state.set_race(race_link, 'fetched')
+            parser = PageParser(page)
+            if not parser.if_event(race_link):
+                await self._store(parser, db, bucket, race_link)
+                return
+            print(f'No Event loaded {race_link}')
+            if tries < self.retries:
+                RETRIES.inc()
+                delay = self.limiter.retry_delay(tries)
+                SLEEP_SECONDS.inc(delay)
+                await asyncio.sleep(delay)
+        print(f'Unable to load race: {race_link}')
+
+    async def _store(self, parser: PageParser, db: dict, bucket: str,
+                     link: str = None) -> None:
+        '''Save a parsed race and its image, then upload or enqueue them.
+
+        A page that does not parse as a race is reported and skipped, so
+        it is left unsaved in the run state and fetched again on resume.
+
+        Args:
+            parser (PageParser): Parser for the page holding the race.
+            db (dict): Parameters used in building an SQLAlchemy Engine.
+            bucket (str): The name of the S3 bucket.
+            link (str): URL the page was requested from, used to record
+                its progress in the run state.
+        '''
+        state = self.scraper.state
+        try:
+            scraped_json = self.scraper._parse_page(parser)
+        except PARSE_ERRORS as e:
+            print(f'Unable to parse race {link}: {e!r}')
+            return
+        id = scraped_json['race_id']
+        link = link or scraped_json['url']
+        if state is not None:
+            state.set_race(link, 'parsed', id)
+        image = self.scraper.images.submit(
+            scraped_json['image_link'], self.scraper._image_path(id))
+        await self._in_thread(self.scraper._save_data, scraped_json)
+        await self._save_image(image, id)
+        RACES.inc()
+        if self.scraper.parquet is not None:
+            await self._in_thread(self.scraper.parquet.add, scraped_json)
+        if state is not None:
+            state.set_race(link, 'saved', id)
+        if self.scraper.queue is not None:
+            await self._in_thread(self.scraper.queue.put, id)
+        elif self.scraper.storage is not None:
+            await self._in_thread(self.scraper.storage.add, scraped_json)
+        else:
+            path = self.scraper.raw_data_path
+            await self._in_thread(upload_to_rds_by_id, id, db, path)
+            await self._in_thread(upload_to_bucket_by_id, id, bucket, path)
+        if state is not None and (self.scraper.storage is None
+                                  or self.scraper.queue is not None):
+            state.set_race(link, 'uploaded', id)
+        self.scraper.index.add_retrieved(scraped_json['url'])
+
+    async def _save_image(self, image: Future, id: str) -> bool:
+        '''Wait for the photo finish to be saved next to the race JSON.
+
+        Args:
+            image (Future): Download started with the scraper's
+                ImageFetcher.
+            id (str): id of the race.
+
+        Returns:
+            bool: True if the image has been saved.
+        '''
+        if not await asyncio.wrap_future(image):
+            print(f'Unable to retrieve picture: {id}')
+            return False
+        return True
+
+    async def _fetch_page(self, url: str) -> HtmlPage:
+        '''Fetch a page, revalidating it against the scraper's page cache.
+
+        Args:
+            url (str): URL of the page.
+        '''
+        cache = self.scraper.cache
+        if cache is None:
+            final_url, content = await self._fetch(url)
+            return HtmlPage(final_url, content)
+        cached = await self._in_thread(cache.get, url)
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+        status, final_url, response_headers, content = \
+            await self._request(url, headers)
+        if status == 304 and cached is not None:
+            await self._in_thread(cache.touch, url)
+            return HtmlPage(cached.final_url, cached.content)
+        await self._in_thread(
+            cache.put, url, final_url, content, response_headers)
+        return HtmlPage(final_url, content)
+
+    async def _fetch(self, url: str) -> tuple:
+        '''Request a URL, retrying with exponential backoff.
+
+        Args:
+            url (str): URL to request.
+
+        Returns:
+            tuple: The URL after redirects, and the response body.
+        '''
+        _, final_url, _, content = await self._request(url)
+        return final_url, content
+
+    async def _request(self, url: str, headers: dict = None) -> tuple:
+        '''Request a URL, retrying with exponential backoff.
+
+        Every attempt waits for the RateLimiter, and reports its outcome
+        to it. Connection errors, timeouts and RETRY_STATUS responses
+        are retried; the last failure is raised once the retries are
+        used up. Other error responses, such as 404, are raised at once
+        without counting as a failure of the host, and release the
+        request in the RateLimiter. The time taken by the
+        successful request is added to the scraper's page_latency.
+
+        Args:
+            url (str): URL to request.
+            headers (dict): Extra request headers.
+
+        Returns:
+            tuple: The status, the URL after redirects, the response
+            headers and the response body.
+        '''
+        for tries in range(self.retries + 1):
+            try:
+                async with self.semaphore:
+                    await self.limiter.wait_async(url)
+                    start = time.monotonic()
+                    async with self.session.get(
+                            url, headers=headers) as response:
+                        if response.status in RETRY_STATUS:
+                            raise RetryableError(
+                                f'{response.status} from {url}')
+                        response.raise_for_status()
+                        content = await response.read()
+                        self.pages += 1
+                        latency = time.monotonic() - start
+                        self.scraper.page_latency.append((url, latency))
+                        self.limiter.success(url, latency)
+                        FETCH_SECONDS.observe(latency)
+                        PAGES.inc()
+                        return (response.status, str(response.url),
+                                response.headers, content)
+            except aiohttp.ClientResponseError:
+                self.limiter.release(url)
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError,
+                    RetryableError) as e:
+                self.limiter.failure(url)
+                if tries == self.retries:
+                    raise
+                print(f'Request failed ({e}): {tries+1} attempts')
+                RETRIES.inc()
+            except BaseException:
+                self.limiter.release(url)
+                raise
+
+    async def _in_thread(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(func, *args))
@@ -0,0 +1,158 @@
+'''Bulk Loader Module
+
+This module contains a buffered loader that collects scraped races and
+writes them to the race and runner tables in batches, each batch in a
+single transaction.
+'''
+
+from sqlalchemy import select, delete
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine.base import Connection
+from uploader import (
+                    _connect_to_rds,
+                    no_event_table,
+                    race_table,
+                    runner_table
+                    )
+from records import runners_from_json
+from metrics import DB_SECONDS
+import threading
+
+INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+class BulkLoader(object):
+    '''BulkLoader Class
+
+    Buffers races until batch_size have been added, then inserts them
+    and their runners with one executemany per table. Rows that already
+    exist are skipped with ON CONFLICT DO NOTHING, so a re-scraped race
+    does not abort the run with an IntegrityError. With psycopg2 the
+    executemany is sent as multi-row VALUES pages.
+
+    With replace=True the existing rows of each race are deleted first,
+    in the same transaction, so re-parsed races overwrite the old ones.
+
+    Example usage:
+
+        with BulkLoader(db, batch_size=100) as loader:
+            for race in races:
+                loader.add(race)
+    '''
+
+    def __init__(self, db: dict, batch_size: int = 50,
+                 replace: bool = False):
+        '''Initialises BulkLoader
+
+        Args:
+            db (dict): Dict containing parameters used in building an
+                SQLAlchemy Engine.
+            batch_size (int): Number of races written per transaction.
+            replace (bool): Overwrite races that are already in the RDS.
+
+        Parameters:
+            races (list): Races waiting to be written.
+            inserted (int): Races written by this loader.
+            skipped (int): Races that were already in the race table.
+        '''
+        self.engine = _connect_to_rds(db)
+        self.batch_size = batch_size
+        self.replace = replace
+        self.races = []
+        self.inserted = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> 'BulkLoader':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.flush()
+
+    def add(self, race: dict) -> None:
+        '''Add a race to the buffer, writing the buffer once it is full.
+
+        Args:
+            race (dict): A scraped race, with its runners under 'runners'.
+        '''
+        with self.lock:
+            self.races.append(race)
+            full = len(self.races) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        '''Write every buffered race in a single transaction.
+
+        Returns:
+            int: The number of new races written.
+        '''
+        with self.lock:
+            races, self.races = self.races, []
+        if not races:
+            return 0
+        race_rows = [{i: x[i] for i in x if i != 'runners'} for x in races]
+        runner_rows = []
+        for race in races:
+            runner_rows.extend(
+                x.row() for x in runners_from_json(race['runners']))
+        with DB_SECONDS.time(), self.engine.begin() as conn:
+            if self.replace:
+                ids = [x['race_id'] for x in race_rows]
+                conn.execute(delete(runner_table).where(
+                    runner_table.c.race_id.in_(ids)))
+                conn.execute(delete(race_table).where(
+                    race_table.c.race_id.in_(ids)))
+            inserted = self._insert(conn, race_table, race_rows)
+            self._insert(conn, runner_table, runner_rows)
+        with self.lock:
+            self.inserted += inserted
+            self.skipped += len(races) - inserted
+        print(f'Loaded {inserted} races, skipped {len(races) - inserted}')
+        return inserted
+
+    def add_no_events(self, urls: list) -> int:
+        '''Write dates with no event in a single transaction.
+
+        Args:
+            urls (list): URLs of the dates, which may already be in the
+                no_event table.
+
+        Returns:
+            int: The number of new dates written.
+        '''
+        rows = [{'url': x} for x in dict.fromkeys(urls)]
+        with DB_SECONDS.time(), self.engine.begin() as conn:
+            return self._insert(conn, no_event_table, rows)
+
+    def _insert(self, conn: Connection, table, rows: list) -> int:
+        '''Insert rows with a single executemany, ignoring duplicates.
+
+        Args:
+            conn (Connection): SQLAlchemy connection to the RDS.
+            table (Table): Table to insert into.
+            rows (list): Dicts of column values.
+
+        Returns:
+            int: The number of rows inserted.
+        '''
+        if not rows:
+            return 0
+        insert = INSERTS.get(conn.dialect.name)
+        if insert is None:
+            conn.execute(table.insert(), rows)
+            return len(rows)
+        keys = [x.name for x in table.primary_key]
+        existing = self._existing(conn, table, keys, rows)
+        stmt = insert(table).on_conflict_do_nothing()
+        conn.execute(stmt, rows)
+        return len({tuple(x[k] for k in keys) for x in rows} - existing)
+
+    def _existing(self, conn: Connection, table, keys: list,
+                  rows: list) -> set:
+        '''Primary keys of the batch that are already in the table.'''
+        column = table.c[keys[0]]
+        values = {x[keys[0]] for x in rows}
+        result = conn.execute(
+            select(*[table.c[k] for k in keys]).where(column.in_(values)))
+        return {tuple(x) for x in result}
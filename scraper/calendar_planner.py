@@ -0,0 +1,332 @@
+'''Calendar Planner Module
+
+This module contains the date planning stage of a backfill. HKJC races
+on about two days a week, so rather than loading every calendar day in
+turn, the planner predicts which days hold a meeting from the race and
+no_event tables and from fixture lists parsed offline. Likely race days
+are scraped first, days known to have no meeting are skipped, and the
+unlikely days are probed together with plain HTTP requests, so only
+the few holding a meeting are scraped.
+
+Example usage:
+
+    planner = CalendarPlanner()
+    planner.learn(db)
+    plan = planner.plan(scraper.create_date_links(days=365))
+    meetings = planner.probe(plan.unlikely)
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select
+from uploader import _connect_to_rds, race_table, no_event_table
+from dedup_index import race_date
+from http_driver import HtmlPage, USER_AGENT
+from page_parser import PageParser
+from urllib.parse import urlsplit, parse_qs
+from lxml import html
+import collections
+import datetime
+import requests
+import re
+
+DATE_PATTERN = re.compile(r'(?<!\d)(\d{2})/(\d{2})/(\d{4})(?!\d)')
+
+
+class Plan(object):
+    '''Plan Class
+
+    The dates of a backfill, split by how likely they are to hold a
+    meeting.
+
+    Example usage:
+
+        plan = planner.plan(links)
+        meetings = planner.probe(plan.unlikely)
+        links = plan.likely + plan.uncertain + [
+            x for x in plan.unlikely if x in meetings]
+    '''
+
+    def __init__(self, likely: list, uncertain: list, unlikely: list,
+                 skipped: list):
+        '''Initialises Plan
+
+        Each list is ordered most likely first.
+
+        Args:
+            likely (list): Links to scrape first.
+            uncertain (list): Links to scrape after the likely ones.
+            unlikely (list): Links to probe before scraping.
+            skipped (list): Links known to have no meeting.
+        '''
+        self.likely = likely
+        self.uncertain = uncertain
+        self.unlikely = unlikely
+        self.skipped = skipped
+
+
+class CalendarPlanner(object):
+    '''CalendarPlanner Class
+
+    Predicts the meeting days of a range of dates. A day found in the
+    race table or a fixture list holds a meeting, and a day in the
+    no_event table, or between the first and last dates of a fixture
+    list without being on it, does not. Any other day is given the share
+    of known days with a meeting on the same weekday, scaled by how the
+    share in its month compares with the overall share, which picks up
+    the summer break.
+
+    Example usage:
+
+        planner = CalendarPlanner(likely=0.6, probe=0.3)
+        planner.learn(db)
+        with open('fixture.html', 'rb') as f:
+            planner.add_fixtures(f.read())
+        plan = planner.plan(links)
+    '''
+
+    def __init__(self, likely: float = 0.6, probe: float = 0.3,
+                 workers: int = 8):
+        '''Initialises CalendarPlanner
+
+        With nothing learned every day has a probability of a half, and
+        is scraped as it would be without a planner.
+
+        Args:
+            likely (float): Probability from which a day is scraped
+                first.
+            probe (float): Probability below which a day is probed
+                before being scraped.
+            workers (int): Number of probes requested at once.
+
+        Parameters:
+            meetings (set): Dates known to hold a meeting.
+            no_events (set): Dates known to have no meeting.
+            fixture_spans (list): (first, last) dates covered by each
+                fixture list added.
+        '''
+        self.likely = likely
+        self.probe_below = probe
+        self.workers = workers
+        self.meetings = set()
+        self.no_events = set()
+        self.fixture_spans = []
+
+    def learn(self, db: dict) -> None:
+        '''Learn the meeting days recorded in the RDS.
+
+        Args:
+            db (dict): Dict containing parameters used in building an
+                SQLAlchemy Engine.
+        '''
+        engine = _connect_to_rds(db)
+        with engine.connect() as con:
+            race_dates = con.execute(
+                select(race_table.c.date).distinct()).scalars().all()
+            no_event_urls = con.execute(
+                select(no_event_table.c.url)).scalars().all()
+        self.meetings.update(_parse_date(x) for x in race_dates)
+        for url in no_event_urls:
+            try:
+                self.no_events.add(_parse_date(race_date(url)))
+            except (KeyError, ValueError):
+                continue
+        self.no_events -= self.meetings
+
+    def add_fixtures(self, content: bytes) -> set:
+        '''Learn the meeting days listed on a page.
+
+        A page listing at least two dates in its table cells is taken to
+        be a complete fixture list, so the days it spans that are not on
+        it are planned as having no meeting. Dates that are only linked
+        to, as on a results page, are meetings but span nothing.
+
+        Args:
+            content (bytes): A saved fixture list, or results page.
+
+        Returns:
+            set: The dates found.
+        '''
+        root = html.fromstring(content)
+        listed = _listed_dates(root)
+        dates = _linked_dates(root) | listed
+        self.meetings.update(dates)
+        self.no_events -= dates
+        if len(listed) > 1:
+            self.fixture_spans.append((min(listed), max(listed)))
+        return dates
+
+    def probability(self, day: datetime.date, stats: tuple = None) -> float:
+        '''Probability that a day holds a meeting.
+
+        Args:
+            day (datetime.date): The day.
+            stats (tuple): Counts from stats, to reuse across days.
+        '''
+        if day in self.meetings:
+            return 1.0
+        if day in self.no_events:
+            return 0.0
+        for first, last in self.fixture_spans:
+            if first <= day <= last:
+                return 0.0
+        weekdays, months, overall = stats or self.stats()
+        weekday = _share(weekdays[day.weekday(), True],
+                         weekdays[day.weekday(), True]
+                         + weekdays[day.weekday(), False])
+        month = _share(months[day.month, True],
+                       months[day.month, True] + months[day.month, False])
+        return min(weekday * month / overall, 1.0)
+
+    def stats(self) -> tuple:
+        '''Known days with and without a meeting.
+
+        Returns:
+            tuple: Counters keyed by (weekday, meeting) and by (month,
+            meeting), and the overall share of days with a meeting.
+        '''
+        weekdays = collections.Counter()
+        months = collections.Counter()
+        for days, meeting in ((self.meetings, True),
+                              (self.no_events, False)):
+            for x in days:
+                weekdays[x.weekday(), meeting] += 1
+                months[x.month, meeting] += 1
+        overall = _share(len(self.meetings),
+                         len(self.meetings) + len(self.no_events))
+        return weekdays, months, overall
+
+    def plan(self, links: list) -> Plan:
+        '''Split and order the date links of a backfill.
+
+        Args:
+            links (list): URLs to the first race of a day.
+
+        Returns:
+            Plan: The links to scrape, to probe and to skip.
+        '''
+        likely, uncertain, unlikely, skipped = [], [], [], []
+        stats = self.stats()
+        scored = [(self.probability(_link_date(x), stats), x)
+                  for x in links]
+        for p, link in sorted(scored, key=lambda x: -x[0]):
+            if p >= self.likely:
+                likely.append(link)
+            elif p >= self.probe_below:
+                uncertain.append(link)
+            elif p > 0:
+                unlikely.append(link)
+            else:
+                skipped.append(link)
+        return Plan(likely, uncertain, unlikely, skipped)
+
+    def probe(self, links: list, limiter=None, learn: bool = True) -> set:
+        '''Find which days hold a meeting with plain HTTP requests.
+
+        The pages are requested at once by the worker threads and only
+        checked for results, without being parsed. A day whose page
+        cannot be loaded is returned, to be scraped as usual, and is not
+        learned.
+
+        Args:
+            links (list): URLs to the first race of a day.
+            limiter (RateLimiter): Optional scheduler the requests wait
+                on.
+            learn (bool): Record the days as holding a meeting or not.
+
+        Returns:
+            set: The links holding a meeting.
+        '''
+        if not links:
+            return set()
+        with requests.Session() as session, \
+                ThreadPoolExecutor(max_workers=self.workers) as executor:
+            session.headers['User-Agent'] = USER_AGENT
+            results = dict(zip(links, executor.map(
+                lambda x: self._probe(session, x, limiter), links)))
+        meetings = {x for x in links if results[x] is not False}
+        if not learn:
+            return meetings
+        for link, meeting in results.items():
+            if meeting is None:
+                continue
+            day = _link_date(link)
+            if meeting:
+                self.meetings.add(day)
+            else:
+                self.no_events.add(day)
+        return meetings
+
+    def _probe(self, session: requests.Session, link: str,
+               limiter) -> bool:
+        '''Whether a day holds a meeting, or None if its page could not
+        be loaded.'''
+        try:
+            if limiter is None:
+                response = session.get(link, timeout=30)
+            else:
+                response = limiter.send(session, link, timeout=30)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f'Unable to probe {link}: {e!r}')
+            return None
+        page = HtmlPage(response.url, response.content)
+        return not PageParser(page).if_event(link)
+
+
+def fixture_dates(content: bytes) -> set:
+    '''Meeting dates on a page.
+
+    Dates are read from links to results pages, by their RaceDate, and
+    from the table cells of a fixture list, in the DD/MM/YYYY format
+    used across the site. Dates elsewhere in the text of a page, such as
+    the date it was printed, are not meetings and are ignored.
+
+    Args:
+        content (bytes): HTML of the page.
+
+    Returns:
+        set: The dates, as datetime.date.
+    '''
+    root = html.fromstring(content)
+    return _linked_dates(root) | _listed_dates(root)
+
+
+def _linked_dates(root) -> set:
+    '''RaceDate of every link to a results page.'''
+    dates = set()
+    for href in root.xpath('//a/@href'):
+        for value in parse_qs(urlsplit(href).query).get('RaceDate', []):
+            try:
+                dates.add(datetime.datetime.strptime(
+                    value, '%Y/%m/%d').date())
+            except ValueError:
+                continue
+    return dates
+
+
+def _listed_dates(root) -> set:
+    '''Dates that make up the whole of a table cell.'''
+    dates = set()
+    for cell in root.xpath('//td'):
+        match = DATE_PATTERN.fullmatch(cell.text_content().strip())
+        if match is None:
+            continue
+        day, month, year = match.groups()
+        try:
+            dates.add(datetime.date(int(year), int(month), int(day)))
+        except ValueError:
+            continue
+    return dates
+
+
+def _parse_date(date: str) -> datetime.date:
+    return datetime.datetime.strptime(date, '%d/%m/%Y').date()
+
+
+def _link_date(link: str) -> datetime.date:
+    return _parse_date(race_date(link))
+
+
+def _share(meetings: int, total: int) -> float:
+    '''Share of days with a meeting, smoothed towards a half.'''
+    return (meetings + 1) / (total + 2)
@@ -0,0 +1,202 @@
+'''Checkpoint Module
+
+This module contains the run state of a backfill, stored in SQLite next to
+the raw data. Every date and race of a run is recorded with how far it
+got, so an interrupted run can be resumed without fetching the pages that
+were already finished.
+'''
+
+import threading
+import sqlite3
+import os
+
+DATE_STATUSES = ('pending', 'fetched', 'parsed', 'done')
+RACE_STATUSES = ('pending', 'fetched', 'parsed', 'saved', 'uploaded')
+
+
+class RunState(object):
+    '''RunState Class
+
+    Records the links of a run, and the status of each date and race.
+
+    A date is fetched once its page has loaded, parsed once the races on
+    its card are known, and done once every race has been saved. A race
+    is fetched, parsed, saved to the data folder, and finally uploaded to
+    the RDS and S3. Statuses only move forwards, so a slower thread can
+    not undo the progress recorded by another.
+
+    Example usage:
+
+        state = RunState('raw_data/checkpoint.db')
+        links = state.start(links, resume=True)
+        state.set_card(link, [link] + card_races)
+        state.set_race(link, 'saved', race_id)
+        state.finish_date(link)
+    '''
+
+    def __init__(self, path: str):
+        '''Initialises RunState
+
+        Args:
+            path (str): Location of the SQLite database.
+        '''
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS run ('
+            'position INTEGER PRIMARY KEY, url TEXT NOT NULL)'
+            )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS dates ('
+            'url TEXT PRIMARY KEY, status INTEGER NOT NULL DEFAULT 0)'
+            )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS races ('
+            'url TEXT PRIMARY KEY, date_url TEXT, race_id TEXT, '
+            'status INTEGER NOT NULL DEFAULT 0)'
+            )
+
+    def start(self, links: list, resume: bool = False) -> list:
+        '''Begin a run, or continue the last one.
+
+        Args:
+            links (list): a list of urls to the first race of a day.
+            resume (bool): Continue the recorded run instead of starting
+                a new one. The recorded links are used if there are any.
+
+        Returns:
+            list: The links of the run.
+        '''
+        with self.lock:
+            if resume:
+                stored = [x[0] for x in self.conn.execute(
+                    'SELECT url FROM run ORDER BY position')]
+                if stored:
+                    return stored
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                for table in ('run', 'dates', 'races'):
+                    self.conn.execute(f'DELETE FROM {table}')
+                self.conn.executemany(
+                    'INSERT INTO run (position, url) VALUES (?, ?)',
+                    enumerate(links))
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        return list(links)
+
+    def date_status(self, url: str) -> str:
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT status FROM dates WHERE url = ?', (url,)).fetchone()
+        return DATE_STATUSES[row[0] if row else 0]
+
+    def set_date(self, url: str, status: str) -> None:
+        '''Move a date forwards to a status.
+
+        Args:
+            url (str): URL of the date.
+            status (str): One of DATE_STATUSES.
+        '''
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO dates (url, status) VALUES (?, ?) '
+                'ON CONFLICT (url) DO UPDATE SET status = excluded.status '
+                'WHERE excluded.status > status',
+                (url, DATE_STATUSES.index(status)))
+
+    def set_card(self, url: str, race_links: list) -> None:
+        '''Record the races on the card of a date, and mark it parsed.
+
+        Args:
+            url (str): URL of the date.
+            race_links (list): URLs of every race on the card.
+        '''
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO races (url, date_url) VALUES (?, ?)',
+                [(x, url) for x in race_links])
+        self.set_date(url, 'parsed')
+
+    def card(self, url: str) -> list:
+        '''URLs of the races recorded for a date.'''
+        with self.lock:
+            return [x[0] for x in self.conn.execute(
+                'SELECT url FROM races WHERE date_url = ? ORDER BY rowid',
+                (url,))]
+
+    def race_status(self, url: str) -> str:
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT status FROM races WHERE url = ?', (url,)).fetchone()
+        return RACE_STATUSES[row[0] if row else 0]
+
+    def set_race(self, url: str, status: str, race_id: str = None) -> None:
+        '''Move a race forwards to a status.
+
+        Args:
+            url (str): URL of the race.
+            status (str): One of RACE_STATUSES.
+            race_id (str): id of the race, once it has been parsed.
+        '''
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO races (url, race_id, status) VALUES (?, ?, ?) '
+                'ON CONFLICT (url) DO UPDATE SET '
+                'race_id = coalesce(excluded.race_id, race_id), '
+                'status = max(status, excluded.status)',
+                (url, race_id, RACE_STATUSES.index(status)))
+
+    def races(self, status: str) -> list:
+        '''(url, race_id) of every race with a status.'''
+        with self.lock:
+            return self.conn.execute(
+                'SELECT url, race_id FROM races WHERE status = ? '
+                'ORDER BY rowid', (RACE_STATUSES.index(status),)).fetchall()
+
+    def promote(self, status: str, to: str) -> None:
+        '''Move every race with a status forwards to another.'''
+        with self.lock:
+            self.conn.execute(
+                'UPDATE races SET status = ? WHERE status = ?',
+                (RACE_STATUSES.index(to), RACE_STATUSES.index(status)))
+
+    def finish_date(self, url: str) -> bool:
+        '''Mark a date done, if every race on its card has been saved.
+
+        Args:
+            url (str): URL of the date.
+
+        Returns:
+            bool: True if the date is done.
+        '''
+        with self.lock:
+            unsaved = self.conn.execute(
+                'SELECT count(*) FROM races WHERE date_url = ? '
+                'AND status < ?', (url, RACE_STATUSES.index('saved'))
+                ).fetchone()[0]
+        if unsaved:
+            return False
+        self.set_date(url, 'done')
+        return True
+
+    def counts(self) -> dict:
+        '''Number of dates and races in each status.'''
+        with self.lock:
+            dates = self.conn.execute(
+                'SELECT status, count(*) FROM dates GROUP BY status'
+                ).fetchall()
+            races = self.conn.execute(
+                'SELECT status, count(*) FROM races GROUP BY status'
+                ).fetchall()
+        return {'dates': {DATE_STATUSES[x]: n for x, n in dates},
+                'races': {RACE_STATUSES[x]: n for x, n in races}}
+
+    def close(self) -> None:
+        self.conn.close()
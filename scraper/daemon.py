@@ -0,0 +1,282 @@
+'''Daemon Module
+
+This module contains the long running mode of the scraper. Rather than
+starting a browser, downloading a driver and reloading the dedup lists
+for every batch job, one Scraper is kept running with its driver, the
+pooled RDS engines and its dedup index held in memory. The daemon
+schedules each meeting itself, polling shortly after the expected time
+of its last race until every race on the card has been saved, so new
+results are stored within minutes of being published.
+
+Example usage:
+
+    daemon = Daemon(scraper, db, bucket)
+    server = MetricsServer(port=8080).start()
+    server.routes['/health'] = daemon.health
+    daemon.run()
+'''
+
+from calendar_planner import CalendarPlanner
+import datetime
+import threading
+import json
+import time
+
+# Hong Kong does not observe daylight saving time.
+HKT = datetime.timezone(datetime.timedelta(hours=8), 'HKT')
+# Expected start time of the last race, by weekday. Wednesday meetings
+# are run at night.
+LAST_RACE = {2: datetime.time(22, 50)}
+DEFAULT_LAST_RACE = datetime.time(17, 40)
+
+
+class Daemon(object):
+    '''Daemon Class
+
+    Polls the results of recent meetings. Every tick the days of the
+    lookback window that the planner expects to hold a meeting are
+    scheduled from delay seconds after their last race. Until a day's
+    deadline, give_up seconds later, it is first probed with a single
+    request, and only scraped once results are published, so a day
+    whose results are not up yet is never recorded as having no event.
+    A day is polled again every poll seconds until it is final, with
+    every race on its card saved, or its deadline passes. Days before
+    today are scraped as soon as the daemon starts, to fill any gaps.
+
+    Example usage:
+
+        daemon = Daemon(scraper, db, bucket, poll=300)
+        threading.Thread(target=daemon.run).start()
+        ...
+        daemon.stop()
+    '''
+
+    def __init__(self, scraper, db: dict, bucket: str,
+                 planner: CalendarPlanner = None, delay: float = 600,
+                 poll: float = 300, give_up: float = 6 * 3600,
+                 lookback: int = 3, tick: float = 60,
+                 stall: float = 1800):
+        '''Initialises Daemon
+
+        Args:
+            scraper (Scraper): Scraper kept running between polls.
+            db (dict): Dict containing parameters used in building an
+                SQLAlchemy Engine.
+            bucket (str): The name of the S3 bucket.
+            planner (CalendarPlanner): Predicts the meeting days,
+                defaulting to one learned from the RDS.
+            delay (float): Seconds after the last race before the first
+                poll.
+            poll (float): Seconds between polls of a day.
+            give_up (float): Seconds after the first poll before a day
+                is scraped without a probe, and then stops being polled.
+            lookback (int): Number of days before today to keep polled.
+            tick (float): Seconds between checks of the schedule.
+            stall (float): Seconds without a tick or poll before the
+                daemon reports itself stalled.
+
+        Parameters:
+            pending (dict): Time of the next poll of each scheduled link.
+            deadlines (dict): Time each scheduled link stops being
+                polled.
+            final (set): Links that are no longer polled.
+            runs (int): Number of scrapes run.
+        '''
+        self.scraper = scraper
+        self.db = db
+        self.bucket = bucket
+        self.planner = planner or CalendarPlanner()
+        self.delay = delay
+        self.poll = poll
+        self.give_up = give_up
+        self.lookback = lookback
+        self.tick = tick
+        self.stall = stall
+        self.pending = {}
+        self.deadlines = {}
+        self.final = set()
+        self.runs = 0
+        self.today = None
+        self.started = time.time()
+        self.last_tick = None
+        self.last_success = None
+        self.last_error = None
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def run(self) -> None:
+        '''Poll on schedule until stopped.'''
+        print('Daemon started')
+        while not self.stopping.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f'Daemon tick failed: {e!r}')
+                self.last_error = (time.time(), repr(e))
+            self.stopping.wait(self.tick)
+        print('Daemon stopped')
+
+    def stop(self) -> None:
+        self.stopping.set()
+
+    def run_once(self, now: float = None) -> list:
+        '''Poll every link that is due.
+
+        Args:
+            now (float): Current time, defaulting to the clock.
+
+        Returns:
+            list: The links polled.
+        '''
+        now = time.time() if now is None else now
+        self.last_tick = now
+        due = self.schedule(now)
+        for link in due:
+            if self.stopping.is_set():
+                break
+            self._poll(link, now)
+            self.last_tick = time.time()
+        return due
+
+    def schedule(self, now: float) -> list:
+        '''Schedule the days of the lookback window.
+
+        The planner learns the meeting days from the RDS again each day.
+        Cards and dedup index entries of days that have left the window
+        are forgotten.
+
+        Args:
+            now (float): Current time.
+
+        Returns:
+            list: The scheduled links due to be polled, earliest first.
+        '''
+        today = datetime.datetime.fromtimestamp(now, HKT).date()
+        if today != self.today:
+            self.planner.learn(self.db)
+            self.today = today
+        stats = self.planner.stats()
+        window = [today - datetime.timedelta(days=x)
+                  for x in range(self.lookback, -1, -1)]
+        links = {self.link(x) for x in window}
+        with self.lock:
+            self.final &= links
+            for link in list(self.scraper.cards):
+                if link not in links and link not in self.pending:
+                    del self.scraper.cards[link]
+            if self.scraper.index is not None:
+                self.scraper.index.prune(links | set(self.pending))
+            for day in window:
+                link = self.link(day)
+                if link in self.final or link in self.pending:
+                    continue
+                if (self.planner.probability(day, stats)
+                        < self.planner.probe_below):
+                    continue
+                first = last_race(day).timestamp() + self.delay
+                self.pending[link] = first
+                self.deadlines[link] = first + self.give_up
+            return sorted((x for x, t in self.pending.items() if t <= now),
+                          key=lambda x: self.pending[x])
+
+    def link(self, day: datetime.date) -> str:
+        '''URL of the first race of a day.'''
+        return f"{self.scraper.base_url}{day.strftime('%Y/%m/%d')}"
+
+    def is_final(self, link: str) -> bool:
+        '''Whether every race of a day has been saved.
+
+        Args:
+            link (str): URL of the first race of the day.
+        '''
+        index = self.scraper.index
+        if index is None:
+            return False
+        if link in index.no_event:
+            return True
+        card = self.scraper.cards.get(link)
+        return bool(card) and all(x in index.retrieved for x in card)
+
+    def health(self) -> tuple:
+        '''Health of the daemon, as a route of a MetricsServer.
+
+        The daemon is unhealthy once it has neither ticked nor polled
+        for stall seconds, or when its last scrape failed.
+
+        Returns:
+            tuple: The status code, content type and JSON body.
+        '''
+        now = time.time()
+        stalled = now - (self.last_tick or self.started) > self.stall
+        failing = self.last_error is not None and (
+            self.last_success is None
+            or self.last_error[0] > self.last_success)
+        with self.lock:
+            pending = {x: _isoformat(t) for x, t in self.pending.items()}
+        body = {
+            'status': 'stalled' if stalled else
+            'failing' if failing else 'ok',
+            'started': _isoformat(self.started),
+            'last_tick': _isoformat(self.last_tick),
+            'last_success': _isoformat(self.last_success),
+            'last_error': self.last_error[1] if self.last_error else None,
+            'runs': self.runs,
+            'pending': pending,
+            'final': len(self.final)
+            }
+        return (503 if stalled or failing else 200, 'application/json',
+                json.dumps(body, indent=4))
+
+    def _poll(self, link: str, now: float) -> None:
+        '''Probe a day, and scrape it once its results are published.
+
+        Args:
+            link (str): URL of the first race of the day.
+            now (float): Current time.
+        '''
+        deadline = self.deadlines[link]
+        if now < deadline and not self.planner.probe(
+                [link], self.scraper.limiter, learn=False):
+            print(f'Results not yet published: {link}')
+            self._reschedule(link, now)
+            return
+        try:
+            self.scraper.scrape_dates([link], self.db, self.bucket)
+        except Exception as e:
+            print(f'Scrape failed for {link}: {e!r}')
+            self.last_error = (time.time(), repr(e))
+        else:
+            self.runs += 1
+            self.last_success = time.time()
+            if self.is_final(link):
+                print(f'Results final: {link}')
+                self._finish(link)
+                return
+        if now >= deadline:
+            print(f'Stopped polling: {link}')
+            self._finish(link)
+            return
+        self._reschedule(link, now)
+
+    def _reschedule(self, link: str, now: float) -> None:
+        with self.lock:
+            self.pending[link] = now + self.poll
+
+    def _finish(self, link: str) -> None:
+        with self.lock:
+            del self.pending[link]
+            del self.deadlines[link]
+            self.final.add(link)
+            self.scraper.cards.pop(link, None)
+
+
+def last_race(day: datetime.date) -> datetime.datetime:
+    '''Expected start time of the last race of a day, in Hong Kong.'''
+    return datetime.datetime.combine(
+        day, LAST_RACE.get(day.weekday(), DEFAULT_LAST_RACE), tzinfo=HKT)
+
+
+def _isoformat(value: float) -> str:
+    if value is None:
+        return None
+    return datetime.datetime.fromtimestamp(value, HKT).isoformat()
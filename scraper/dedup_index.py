@@ -0,0 +1,145 @@
+'''Dedup Index Module
+
+This module contains an index of scraped and no event URLs, loaded only
+for the dates being scraped, so membership checks stay O(1) and startup
+does not grow with the size of the race table.
+'''
+
+from sqlalchemy import select
+from uploader import _connect_to_rds, race_table, no_event_table
+from urllib.parse import urlsplit, parse_qs
+import threading
+import json
+import os
+
+CHUNK_SIZE = 500
+
+
+class DedupIndex(object):
+    '''DedupIndex Class
+
+    Holds sets of URLs already in the race and no_event tables. load()
+    only queries the rows for the dates of the links about to be scraped,
+    and dates already held in the local file at path are not queried
+    again after a restart.
+
+    Example usage:
+
+        index = DedupIndex(db, path='raw_data/dedup_index.json')
+        index.load(links)
+        if link not in index.retrieved:
+            ...
+            index.add_retrieved(link)
+        index.save()
+    '''
+
+    def __init__(self, db: dict, path: str = None):
+        '''Initialises DedupIndex
+
+        Args:
+            db (dict): Dict containing parameters used in building an
+                SQLAlchemy Engine.
+            path (str): Optional JSON file the index is persisted to.
+
+        Parameters:
+            retrieved (set): URLs of races that have been scraped.
+            no_event (set): URLs of dates with no event.
+            dates (set): Race dates, as DD/MM/YYYY, loaded so far.
+        '''
+        self.db = db
+        self.path = path
+        self.retrieved = set()
+        self.no_event = set()
+        self.dates = set()
+        self.lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path, 'r') as f:
+                data = json.load(f)
+            self.retrieved.update(data['retrieved'])
+            self.no_event.update(data['no_event'])
+            self.dates.update(data['dates'])
+
+    def load(self, links: list) -> None:
+        '''Load the index entries for the dates of a list of links.
+
+        Args:
+            links (list): URLs of results pages, each with a RaceDate.
+        '''
+        dates = {race_date(x) for x in links} - self.dates
+        engine = _connect_to_rds(self.db)
+        with engine.connect() as con:
+            for chunk in _chunks(sorted(dates)):
+                self.retrieved.update(con.execute(
+                    select(race_table.c.url).where(
+                        race_table.c.date.in_(chunk))).scalars())
+            for chunk in _chunks(sorted(set(links) - self.no_event)):
+                self.no_event.update(con.execute(
+                    select(no_event_table.c.url).where(
+                        no_event_table.c.url.in_(chunk))).scalars())
+        self.dates.update(dates)
+
+    def prune(self, links: list) -> None:
+        '''Forget every entry outside the dates of a list of links.
+
+        Keeps a long running index bounded. Entries that are dropped are
+        loaded from the RDS again if their dates are loaded later.
+
+        Args:
+            links (list): URLs of results pages, each with a RaceDate.
+        '''
+        dates = {race_date(x) for x in links}
+        with self.lock:
+            self.retrieved -= {x for x in self.retrieved
+                               if _url_date(x) not in dates}
+            self.no_event -= {x for x in self.no_event
+                              if _url_date(x) not in dates}
+            self.dates &= dates
+
+    def add_retrieved(self, url: str) -> None:
+        with self.lock:
+            self.retrieved.add(url)
+
+    def add_no_event(self, url: str) -> None:
+        with self.lock:
+            self.no_event.add(url)
+
+    def save(self) -> None:
+        '''Write the index to its local file, if it has one.'''
+        if self.path is None:
+            return
+        with self.lock:
+            data = {'retrieved': sorted(self.retrieved),
+                    'no_event': sorted(self.no_event),
+                    'dates': sorted(self.dates)}
+        folder = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(f'{self.path}.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(f'{self.path}.tmp', self.path)
+
+
+def race_date(link: str) -> str:
+    '''Date of a results page URL, in the format of the race table.
+
+    Args:
+        link (str): URL with a RaceDate=YYYY/MM/DD query parameter.
+
+    Returns:
+        str: The date as DD/MM/YYYY.
+    '''
+    date = parse_qs(urlsplit(link).query)['RaceDate'][0]
+    return '/'.join(reversed(date.split('/')))
+
+
+def _url_date(url: str) -> str:
+    '''race_date of a URL, or None if it has no RaceDate.'''
+    try:
+        return race_date(url)
+    except KeyError:
+        return None
+
+
+def _chunks(values: list) -> list:
+    return [values[x:x + CHUNK_SIZE]
+            for x in range(0, len(values), CHUNK_SIZE)]
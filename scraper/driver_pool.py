@@ -0,0 +1,225 @@
+'''Driver Pool Module
+
+This module contains a pool of reusable page drivers, and the factory
+for the headless Chrome webdriver used by the scraper. Drivers are
+started once, checked out by worker threads for each page, and replaced
+when they crash or have served too many pages.
+'''
+
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from contextlib import contextmanager
+import functools
+import threading
+import shutil
+import queue
+import os
+
+LOCAL_CHROMEDRIVER = '/usr/local/bin/chromedriver'
+
+
+@functools.lru_cache(maxsize=None)
+def chromedriver_path() -> str:
+    '''Location of the chromedriver executable.
+
+    Looks for a local chromedriver, without going to the network, in the
+    CHROMEDRIVER_PATH environment variable, then on the PATH, then in
+    /usr/local/bin where the Dockerfile installs it. ChromeDriverManager
+    is only imported and consulted, once per process, if none is found.
+    '''
+    path = os.environ.get('CHROMEDRIVER_PATH')
+    if path:
+        return path
+    path = shutil.which('chromedriver') or LOCAL_CHROMEDRIVER
+    if os.access(path, os.X_OK):
+        return path
+    from webdriver_manager.chrome import ChromeDriverManager
+    return ChromeDriverManager().install()
+
+
+def chrome_driver() -> webdriver.Chrome:
+    '''Start a headless Google Chrome webdriver.'''
+    s = Service(chromedriver_path())
+    chrome_options = Options()
+    chrome_options.headless = True
+    chrome_options.add_argument('--no-sandbox')
+    chrome_options.add_argument('--disable-dev-shm-usage')
+    return webdriver.Chrome(service=s, options=chrome_options)
+
+
+class DriverPool(object):
+    '''DriverPool Class
+
+    Holds a fixed number of drivers shared between worker threads. A
+    driver is health checked each time it is checked out, and is quit and
+    replaced if it fails the check, raises while in use, or reaches
+    max_uses pages, which bounds the memory a long lived browser can leak.
+    A slot whose replacement fails to start is kept as an empty
+    placeholder, and a new driver is started for it on its next checkout.
+
+    Example usage:
+
+        pool = DriverPool(size=4)
+        pool.start()
+        pool.map(scrape_race, race_links)
+        pool.close()
+    '''
+
+    def __init__(self, size: int = 4, factory=chrome_driver,
+                 max_uses: int = 100, timeout: float = 300):
+        '''Initialises DriverPool
+
+        Args:
+            size (int): Number of drivers in the pool.
+            factory (callable): Returns a new driver.
+            max_uses (int): Pages a driver serves before it is replaced.
+            timeout (float): Seconds to wait for a driver to be free.
+
+        Parameters:
+            idle (Queue): Drivers that are not checked out, or None for
+                a slot without a driver.
+            uses (dict): Pages served by each driver, keyed by id.
+            recycled (int): Number of drivers that have been replaced.
+        '''
+        self.size = size
+        self.factory = factory
+        self.max_uses = max_uses
+        self.timeout = timeout
+        self.idle = queue.Queue()
+        self.uses = {}
+        self.recycled = 0
+        self.lock = threading.Lock()
+
+    def start(self) -> 'DriverPool':
+        '''Start every driver in the pool.'''
+        for x in range(self.size - len(self.uses)):
+            self.idle.put(self._new_driver())
+        return self
+
+    @contextmanager
+    def driver(self):
+        '''Check out a healthy driver for the duration of a with block.
+
+        A driver that raises inside the block is replaced rather than
+        returned to the pool. The slot is always returned, so a driver
+        that fails to start can not leave other threads waiting.
+
+        Raises:
+            TimeoutError: No driver was free within the timeout.
+        '''
+        try:
+            driver = self.idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(
+                f'No driver free after {self.timeout} seconds') from None
+        try:
+            if driver is None:
+                driver = self._new_driver()
+            elif not self._healthy(driver):
+                driver = self._recycle(driver)
+        except Exception:
+            self.idle.put(None)
+            raise
+        try:
+            yield driver
+        except Exception:
+            self._replace(driver)
+            raise
+        with self.lock:
+            self.uses[id(driver)] += 1
+            worn = self.uses[id(driver)] >= self.max_uses
+        if worn:
+            self._replace(driver)
+        else:
+            self.idle.put(driver)
+
+    def map(self, func, items: list, workers: int = None) -> list:
+        '''Spread a list of work items across the drivers.
+
+        Items are placed on a work queue and consumed by one thread per
+        driver. Each call receives a checked out driver and an item.
+        Failures are reported and do not stop the remaining items.
+
+        Args:
+            func (callable): Called as func(driver, item).
+            items (list): Work items, such as race URLs.
+            workers (int): Number of threads, defaulting to the pool size.
+
+        Returns:
+            list: The result for each item, or the exception it raised.
+        '''
+        work = queue.Queue()
+        for index, item in enumerate(items):
+            work.put((index, item))
+        results = [None] * len(items)
+
+        def worker():
+            while True:
+                try:
+                    index, item = work.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    with self.driver() as driver:
+                        results[index] = func(driver, item)
+                except Exception as e:
+                    print(f'Failed {item}: {e}')
+                    results[index] = e
+
+        threads = [threading.Thread(target=worker, daemon=True)
+                   for x in range(min(workers or self.size, len(items)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def close(self) -> None:
+        '''Quit every idle driver.'''
+        while True:
+            try:
+                driver = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            if driver is not None:
+                self._quit(driver)
+
+    def _new_driver(self):
+        driver = self.factory()
+        with self.lock:
+            self.uses[id(driver)] = 0
+        return driver
+
+    def _recycle(self, driver):
+        self._quit(driver)
+        with self.lock:
+            self.recycled += 1
+        return self._new_driver()
+
+    def _replace(self, driver) -> None:
+        '''Return a new driver to the pool in place of one, or an empty
+        slot if the new driver fails to start.'''
+        new = None
+        try:
+            new = self._recycle(driver)
+        except Exception as e:
+            print(f'Unable to replace driver: {e}')
+        finally:
+            self.idle.put(new)
+
+    def _quit(self, driver) -> None:
+        with self.lock:
+            self.uses.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def _healthy(self, driver) -> bool:
+        '''Check that a driver still responds.'''
+        try:
+            driver.current_url
+            return True
+        except Exception:
+            return False
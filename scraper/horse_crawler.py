@@ -0,0 +1,233 @@
+'''Horse Crawler Module
+
+This module contains the horse profile stage of the pipeline. Every
+runner saved links to the profile page of its horse, and the same horse
+runs in dozens of races, so profiles are crawled by horse rather than by
+runner: each horse in the runner table is fetched once, and again only
+after its profile is older than a time to live. Profiles are written to
+the horse table of the RDS.
+
+Example usage:
+
+    crawler = HorseCrawler(db, limiter=scraper.limiter)
+    crawler.crawl()
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select, func, or_
+from uploader import _connect_to_rds, horse_table, runner_table
+from metrics import DB_SECONDS, HORSES
+from http_driver import USER_AGENT
+from rate_limiter import CircuitOpenError
+from lxml import html
+import threading
+import requests
+import json
+import time
+
+
+class HorseCrawler(object):
+    '''HorseCrawler Class
+
+    Fetches the profile of every horse in the runner table that has not
+    been fetched within the time to live. Requests wait on a RateLimiter,
+    so a crawl sharing the scraper's limiter keeps to the same request
+    rate per host, backoff and circuit breaker as the race pages. A
+    profile that fails to load is tried again once the time to live has
+    passed, while one skipped because the circuit is open is tried again
+    on the next crawl.
+
+    Started in the background, the crawler checks for new horses every
+    interval seconds while races are scraped, and once more when stopped.
+
+    Example usage:
+
+        crawler = HorseCrawler(db, limiter=scraper.limiter).start()
+        scraper.scrape_dates(links, db, bucket)
+        crawler.stop()
+    '''
+
+    def __init__(self, db: dict, limiter=None, ttl: float = 7 * 86400,
+                 workers: int = 4, interval: float = 30):
+        '''Initialises HorseCrawler
+
+        Args:
+            db (dict): Dict containing parameters used in building an
+                SQLAlchemy Engine.
+            limiter (RateLimiter): Optional scheduler the requests wait
+                on.
+            ttl (float): Seconds before a profile is fetched again.
+            workers (int): Number of profiles requested at once.
+            interval (float): Seconds between checks for new horses while
+                running in the background.
+
+        Parameters:
+            fetched (int): Number of profiles fetched.
+            failed (dict): Time the profile of a horse last failed to
+                load, keyed by horse_id. The horse is not requested again
+                until the time to live has passed.
+        '''
+        self.db = db
+        self.limiter = limiter
+        self.ttl = ttl
+        self.workers = workers
+        self.interval = interval
+        self.fetched = 0
+        self.failed = {}
+        self.stopping = threading.Event()
+        self.draining = False
+        self.thread = None
+
+    def pending(self, now: float = None) -> list:
+        '''Horses without a profile younger than the time to live.
+
+        Horses whose profile failed to load within the time to live are
+        left out.
+
+        Args:
+            now (float): Time to compare the profiles against, defaulting
+                to the current time.
+
+        Returns:
+            list: (horse_id, url) for each horse, once each.
+        '''
+        now = time.time() if now is None else now
+        self.failed = {k: v for k, v in self.failed.items()
+                       if v >= now - self.ttl}
+        query = select(
+            runner_table.c.horse_id, func.max(runner_table.c.url)
+            ).select_from(runner_table.outerjoin(
+                horse_table,
+                runner_table.c.horse_id == horse_table.c.horse_id)
+            ).where(or_(
+                horse_table.c.horse_id.is_(None),
+                horse_table.c.fetched_at < now - self.ttl)
+            ).group_by(runner_table.c.horse_id)
+        with _connect_to_rds(self.db).connect() as conn:
+            rows = conn.execute(query).all()
+        return [tuple(x) for x in rows
+                if x[1] and x[0] not in self.failed]
+
+    def crawl(self) -> int:
+        '''Fetch and save every pending profile.
+
+        Returns:
+            int: The number of profiles saved.
+        '''
+        pending = self.pending()
+        if not pending:
+            return 0
+        saved = 0
+        with requests.Session() as session, \
+                ThreadPoolExecutor(max_workers=self.workers) as executor:
+            session.headers['User-Agent'] = USER_AGENT
+            profiles = executor.map(
+                lambda x: self.fetch(session, *x), pending)
+            for profile in profiles:
+                if profile is None:
+                    continue
+                self._save(profile)
+                saved += 1
+        self.fetched += saved
+        print(f'Fetched {saved} of {len(pending)} horse profiles')
+        return saved
+
+    def fetch(self, session: requests.Session, horse_id: str,
+              url: str) -> dict:
+        '''Fetch and parse the profile of a horse.
+
+        Args:
+            session (requests.Session): Session to request the page on.
+            horse_id (str): ID of the horse.
+            url (str): URL of its profile page.
+
+        Returns:
+            dict: A row of the horse table, or None if the page could
+            not be loaded or the circuit of the host is open. Only the
+            first is recorded in failed.
+        '''
+        try:
+            if self.limiter is None:
+                response = session.get(url, timeout=30)
+            else:
+                response = self.limiter.send(session, url, timeout=30)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f'Unable to fetch horse {horse_id}: {e!r}')
+            self.failed[horse_id] = time.time()
+            return None
+        except CircuitOpenError as e:
+            print(f'Skipped horse {horse_id}: {e}')
+            return None
+        HORSES.inc()
+        name, profile = parse_profile(response.content)
+        return {'horse_id': horse_id, 'name': name, 'url': url,
+                'profile': json.dumps(profile), 'fetched_at': time.time()}
+
+    def start(self) -> 'HorseCrawler':
+        '''Crawl in a background thread until stopped.'''
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, drain: bool = True) -> None:
+        '''Stop the background thread.
+
+        Args:
+            drain (bool): Crawl the horses of the last races first.
+        '''
+        self.draining = drain
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self) -> None:
+        while True:
+            self._crawl_safely()
+            if self.stopping.wait(self.interval):
+                break
+        if self.draining:
+            self._crawl_safely()
+
+    def _crawl_safely(self) -> None:
+        try:
+            self.crawl()
+        except Exception as e:
+            print(f'Horse crawl failed: {e!r}')
+
+    def _save(self, profile: dict) -> None:
+        '''Replace the row of a horse in the horse table.'''
+        engine = _connect_to_rds(self.db)
+        with DB_SECONDS.time(), engine.begin() as conn:
+            conn.execute(horse_table.delete().where(
+                horse_table.c.horse_id == profile['horse_id']))
+            conn.execute(horse_table.insert(), profile)
+
+
+def parse_profile(content: bytes) -> tuple:
+    '''Read the name and details of a horse from its profile page.
+
+    Details are the rows of the page laid out as label, colon, value,
+    such as "Country of Origin / Age : AUS / 8".
+
+    Args:
+        content (bytes): HTML of the page.
+
+    Returns:
+        tuple: The name, or None if not found, and a dict of details
+        keyed by label.
+    '''
+    root = html.fromstring(content)
+    titles = root.xpath('//*[contains(@class, "title_text")]')
+    name = None
+    if titles:
+        name = titles[0].text_content().partition('(')[0].strip() or None
+    profile = {}
+    for row in root.xpath('//tr'):
+        cells = [' '.join(x.text_content().split())
+                 for x in row.iterchildren('td')]
+        if len(cells) == 3 and cells[1] == ':' and cells[0]:
+            profile[cells[0]] = cells[2]
+    return name, profile
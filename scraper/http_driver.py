@@ -0,0 +1,301 @@
+'''HTTP Driver Module
+
+This module contains a driver-free alternative to the Chrome webdriver.
+Pages are fetched over a pooled HTTP session and parsed with lxml, and
+elements are exposed through the subset of the WebDriver interface used
+by the scraper (get, current_url, find_element, find_elements).
+'''
+
+from lxml import html
+from requests.adapters import HTTPAdapter
+from urllib.parse import urljoin
+from urllib3.util.retry import Retry
+import re
+import requests
+import time
+
+BLOCK_TAGS = {'div', 'p', 'br', 'tr', 'li', 'table', 'tbody', 'thead'}
+WHITESPACE = re.compile(r'[ \t\n\r\f\v]+')
+USER_AGENT = ('Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+              '(KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36')
+
+
+class NoSuchElementException(LookupError):
+    '''Raised when an XPath matches no element on the current page.'''
+
+
+class PageLoadError(IOError):
+    '''Raised when a page cannot be fetched or the site answers an error.'''
+
+
+class HtmlElement(object):
+    '''HtmlElement Class
+
+    Wraps an lxml element to mirror the WebElement attributes used
+    by the scraper.
+    '''
+
+    def __init__(self, element, base_url: str):
+        '''Initialises HtmlElement
+
+        Parameters:
+            element (lxml.html.HtmlElement): Element to wrap.
+            base_url (str): URL of the page, used to resolve links.
+        '''
+        self.element = element
+        self.base_url = base_url
+
+    @property
+    def text(self) -> str:
+        '''Rendered text of the element.
+
+        Approximates WebElement.text: block level elements are split onto
+        new lines, runs of whitespace are collapsed and non-breaking spaces
+        are preserved as plain spaces.
+        '''
+        lines = _collect_text(self.element).split('\n')
+        lines = [WHITESPACE.sub(' ', x).strip(' ') for x in lines]
+        return '\n'.join(x for x in lines if x).replace('\xa0', ' ')
+
+    def get_attribute(self, name: str) -> str:
+        '''Get an attribute of the element.
+
+        href and src attributes are resolved against the page URL, as
+        they would be by a browser.
+
+        Args:
+            name (str): Name of the attribute.
+
+        Returns:
+            str: Value of the attribute, or None if it is not set.
+        '''
+        value = self.element.get(name)
+        if value is not None and name in ('href', 'src'):
+            value = urljoin(self.base_url, value)
+        return value
+
+    def find_element(self, by: str, value: str) -> 'HtmlElement':
+        return _find_element(self.element, value, self.base_url)
+
+    def find_elements(self, by: str, value: str) -> list:
+        return _find_elements(self.element, value, self.base_url)
+
+
+class HtmlPage(object):
+    '''HtmlPage Class
+
+    A parsed HTML document, queried with the same XPaths as a webdriver.
+
+    Example usage:
+
+        page = HtmlPage(url, html_text)
+        page.find_element(By.XPATH, '/html/body/img').get_attribute('src')
+    '''
+
+    def __init__(self, url: str, content):
+        '''Initialises HtmlPage
+
+        Parameters:
+            current_url (str): URL the document was loaded from.
+            tree (lxml.html.HtmlElement): Root of the parsed document.
+        '''
+        self.current_url = url
+        self.tree = html.document_fromstring(content or '<html></html>')
+
+    def find_element(self, by: str, value: str) -> HtmlElement:
+        return _find_element(self.tree, value, self.current_url)
+
+    def find_elements(self, by: str, value: str) -> list:
+        return _find_elements(self.tree, value, self.current_url)
+
+    def table_rows(self, xpath: str) -> list:
+        '''Read every cell of a table in one pass over the document.
+
+        Args:
+            xpath (str): XPath of the table rows.
+
+        Returns:
+            list: A list of (text, href) pairs for each row, one pair per
+            cell. href is the first link in the cell, or None.
+        '''
+        return _table_rows(self.tree, xpath, self.current_url)
+
+
+class HttpDriver(object):
+    '''HttpDriver Class
+
+    Drop in replacement for the Chrome webdriver, for pages that do not
+    require javascript to render. Connections are pooled and reused
+    across requests.
+
+    With a PageCache, cached pages are revalidated with a conditional
+    request and reused when the site answers 304 Not Modified, or served
+    without a request at all while younger than max_age. In offline mode
+    every page comes from the cache.
+
+    Example usage:
+
+        driver = HttpDriver()
+        driver.get(url)
+        driver.find_elements(By.XPATH, xpath)
+    '''
+
+    def __init__(self, pool_size: int = 10, retries: int = 3,
+                 timeout: float = 30, cache=None, max_age: float = None,
+                 offline: bool = False, limiter=None):
+        '''Initialises HttpDriver
+
+        Args:
+            pool_size (int): Number of pooled connections per host.
+            retries (int): Attempts after the first for server errors.
+            timeout (float): Seconds to wait for a response.
+            cache (PageCache): Optional cache of fetched pages.
+            max_age (float): Seconds a cached page is used without being
+                revalidated. None revalidates every time.
+            offline (bool): Only load pages from the cache.
+            limiter (RateLimiter): Optional scheduler every request waits
+                on, which then also retries failed requests in place of
+                the session.
+
+        Parameters:
+            session (requests.Session): Pooled HTTP session.
+            timeout (float): Seconds to wait for a response.
+            page (HtmlPage): The currently loaded page.
+        '''
+        retry = 0
+        if limiter is None:
+            retry = Retry(total=retries, backoff_factor=0.5,
+                          status_forcelist=(500, 502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = USER_AGENT
+        self.retries = retries
+        self.timeout = timeout
+        self.limiter = limiter
+        self.cache = cache
+        self.max_age = max_age
+        self.offline = offline
+        self.page = HtmlPage('about:blank', None)
+
+    @property
+    def current_url(self) -> str:
+        return self.page.current_url
+
+    def get(self, url: str) -> None:
+        '''Load a page.
+
+        Follows redirects, so current_url reflects the final location
+        as it would in a browser.
+
+        Args:
+            url (str): URL of the page to load.
+
+        Raises:
+            PageNotCached: In offline mode, if the page is not cached.
+            PageLoadError: If the request fails once retries are spent,
+                or the site answers with an error status.
+        '''
+        if self.cache is None:
+            response = self._get(url)
+            self.page = HtmlPage(response.url, response.content)
+            return
+        if self.offline:
+            self.page = self.cache.page(url)
+            return
+        cached = self.cache.get(url)
+        headers = {}
+        if cached is not None:
+            age = time.time() - cached.fetched_at
+            if self.max_age is not None and age < self.max_age:
+                self.page = HtmlPage(cached.final_url, cached.content)
+                return
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+        response = self._get(url, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            self.cache.touch(url)
+            self.page = HtmlPage(cached.final_url, cached.content)
+            return
+        self.cache.put(url, response.url, response.content,
+                       response.headers)
+        self.page = HtmlPage(response.url, response.content)
+
+    def _get(self, url: str, **kwargs) -> requests.Response:
+        try:
+            if self.limiter is None:
+                response = self.session.get(url, timeout=self.timeout,
+                                            **kwargs)
+            else:
+                response = self.limiter.send(self.session, url, self.retries,
+                                             timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise PageLoadError(f'Failed to load {url}: {e}') from e
+        if not response.ok:
+            raise PageLoadError(
+                f'Failed to load {url}: HTTP {response.status_code}')
+        return response
+
+    def find_element(self, by: str, value: str) -> HtmlElement:
+        return self.page.find_element(by, value)
+
+    def find_elements(self, by: str, value: str) -> list:
+        return self.page.find_elements(by, value)
+
+    def table_rows(self, xpath: str) -> list:
+        return self.page.table_rows(xpath)
+
+    def quit(self) -> None:
+        self.session.close()
+
+
+def _find_elements(root, xpath: str, base_url: str) -> list:
+    return [HtmlElement(x, base_url) for x in root.xpath(xpath)
+            if isinstance(x, html.HtmlElement)]
+
+
+def _find_element(root, xpath: str, base_url: str) -> HtmlElement:
+    elements = _find_elements(root, xpath, base_url)
+    if not elements:
+        raise NoSuchElementException(f'Unable to locate element: {xpath}')
+    return elements[0]
+
+
+def _table_rows(root, xpath: str, base_url: str) -> list:
+    rows = []
+    for row in root.xpath(xpath):
+        cells = []
+        for cell in row.iterchildren('td'):
+            link = next(cell.iter('a'), None)
+            cells.append((HtmlElement(cell, base_url).text,
+                          None if link is None or link.get('href') is None
+                          else urljoin(base_url, link.get('href'))))
+        rows.append(cells)
+    return rows
+
+
+def _collect_text(element) -> str:
+    '''Join the text of an element and its descendants.
+
+    Args:
+        element (lxml.html.HtmlElement): Element to extract text from.
+
+    Returns:
+        str: Raw text, with new lines inserted around block elements.
+    '''
+    if not isinstance(element.tag, str) or element.tag in ('script', 'style'):
+        return ''
+    block = ''
+    if element.tag in BLOCK_TAGS:
+        inline = 'inline' in (element.get('style') or '')
+        block = ' ' if inline else '\n'
+    parts = [block, element.text or '']
+    for child in element:
+        parts.append(_collect_text(child))
+        parts.append(child.tail or '')
+    parts.append(block)
+    return ''.join(parts)
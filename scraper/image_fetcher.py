@@ -0,0 +1,248 @@
+'''Image Fetcher Module
+
+This module contains the download stage for photo finish images. Images
+are fetched directly from their URL on a pooled HTTP session, in worker
+threads so they download while pages are still being scraped, and are
+streamed to disk rather than held in memory.
+'''
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from http_driver import USER_AGENT
+from metrics import IMAGE_SECONDS
+from rate_limiter import CircuitOpenError, RETRY_STATUS
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import threading
+import requests
+import hashlib
+import sqlite3
+import time
+import os
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ImageFetcher(object):
+    '''ImageFetcher Class
+
+    Downloads images in a thread pool. An image already on disk is not
+    requested again. With revalidate, it is requested conditionally with
+    the ETag kept in the optional index, and a download with the same
+    SHA-256 as the file on disk leaves the file untouched.
+
+    With a thumbnail size, a reduced copy named <name>_thumb.jpg is kept
+    next to each image. Thumbnails require Pillow.
+
+    Example usage:
+
+        images = ImageFetcher(workers=4)
+        future = images.submit(race['image_link'], 'raw_data/id/id.jpg')
+        ...
+        future.result()
+        images.close()
+    '''
+
+    def __init__(self, workers: int = 4, retries: int = 3,
+                 backoff: float = 0.5, timeout: float = 30,
+                 index_path: str = None, thumbnail: int = None,
+                 revalidate: bool = False, limiter=None):
+        '''Initialises ImageFetcher
+
+        Args:
+            workers (int): Number of download threads, and of pooled
+                connections per host.
+            retries (int): Attempts after the first for a failed request.
+            backoff (float): Seconds before the first retry, doubling
+                with each further attempt.
+            timeout (float): Seconds to wait for a response.
+            index_path (str): Optional SQLite file recording the URL, ETag
+                and SHA-256 of each saved image.
+            thumbnail (int): Optional longest side of a thumbnail, in
+                pixels.
+            revalidate (bool): Request images already on disk again.
+            limiter (RateLimiter): Optional scheduler every request waits
+                on, which then also retries failed requests and applies
+                its backoff in place of the session.
+
+        Parameters:
+            downloaded (int): Images written to disk.
+            skipped (int): Images already on disk or unchanged.
+        '''
+        retry = 0
+        if limiter is None:
+            retry = Retry(total=retries, backoff_factor=backoff,
+                          status_forcelist=RETRY_STATUS)
+        adapter = HTTPAdapter(pool_connections=workers,
+                              pool_maxsize=workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = USER_AGENT
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='image')
+        self.retries = retries
+        self.timeout = timeout
+        self.limiter = limiter
+        self.thumbnail = thumbnail
+        self.revalidate = revalidate
+        self.downloaded = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+        self.conn = None
+        if index_path is not None:
+            self.conn = sqlite3.connect(
+                index_path, isolation_level=None, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS images ('
+                'path TEXT PRIMARY KEY, url TEXT NOT NULL, etag TEXT, '
+                'digest TEXT NOT NULL, size INTEGER NOT NULL, '
+                'fetched_at REAL NOT NULL)'
+                )
+
+    def __enter__(self) -> 'ImageFetcher':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def submit(self, url: str, path: str) -> Future:
+        '''Download an image in the background.
+
+        Args:
+            url (str): URL of the image.
+            path (str): File the image is saved to.
+
+        Returns:
+            Future: Resolves to the result of fetch.
+        '''
+        return self.executor.submit(self.fetch, url, path)
+
+    def fetch(self, url: str, path: str) -> bool:
+        '''Download an image, unless it is already on disk.
+
+        Args:
+            url (str): URL of the image.
+            path (str): File the image is saved to.
+
+        Returns:
+            bool: True if the image is on disk.
+        '''
+        if os.path.exists(path) and not self.revalidate:
+            self._count('skipped')
+            self._thumbnail(path)
+            return True
+        headers = {}
+        etag = self._etag(path)
+        if etag is not None and os.path.exists(path):
+            headers['If-None-Match'] = etag
+        try:
+            with IMAGE_SECONDS.time(), self._get(
+                    url, headers=headers, stream=True) as response:
+                if response.status_code == 304:
+                    self._count('skipped')
+                    self._thumbnail(path)
+                    return True
+                response.raise_for_status()
+                digest, size = self._stream(response, f'{path}.tmp')
+                etag = response.headers.get('ETag')
+        except (requests.RequestException, CircuitOpenError) as e:
+            print(f'Unable to retrieve picture {url}: {e!r}')
+            if os.path.exists(f'{path}.tmp'):
+                os.remove(f'{path}.tmp')
+            return False
+        unchanged = os.path.exists(path) and _digest(path) == digest
+        if unchanged:
+            os.remove(f'{path}.tmp')
+            self._count('skipped')
+        else:
+            os.replace(f'{path}.tmp', path)
+            self._count('downloaded')
+        self._record(path, url, etag, digest, size)
+        self._thumbnail(path, replace=not unchanged)
+        return True
+
+    def close(self) -> None:
+        '''Wait for every download, then close the session.'''
+        self.executor.shutdown(wait=True)
+        self.session.close()
+        if self.conn is not None:
+            self.conn.close()
+
+    def _get(self, url: str, **kwargs) -> requests.Response:
+        if self.limiter is None:
+            return self.session.get(url, timeout=self.timeout, **kwargs)
+        return self.limiter.send(self.session, url, self.retries,
+                                 timeout=self.timeout, **kwargs)
+
+    def _stream(self, response, path: str) -> tuple:
+        '''Write a response to a file in chunks.
+
+        Returns:
+            tuple: SHA-256 of the content, and its size in bytes.
+        '''
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        with open(path, 'wb') as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        return digest.hexdigest(), size
+
+    def _count(self, name: str) -> None:
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _etag(self, path: str) -> str:
+        if self.conn is None:
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT etag FROM images WHERE path = ?', (path,)).fetchone()
+        return row[0] if row else None
+
+    def _record(self, path: str, url: str, etag: str, digest: str,
+                size: int) -> None:
+        if self.conn is None:
+            return
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO images '
+                '(path, url, etag, digest, size, fetched_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (path, url, etag, digest, size, time.time()))
+
+    def _thumbnail(self, path: str, replace: bool = False) -> None:
+        '''Save a reduced copy of an image, if thumbnails are enabled.'''
+        if self.thumbnail is None:
+            return
+        thumb = f'{os.path.splitext(path)[0]}_thumb.jpg'
+        if os.path.exists(thumb) and not replace:
+            return
+        try:
+            from PIL import Image
+        except ImportError:
+            print('Pillow is not installed, thumbnails are disabled.')
+            self.thumbnail = None
+            return
+        try:
+            with Image.open(path) as image:
+                image.thumbnail((self.thumbnail, self.thumbnail))
+                image.convert('RGB').save(f'{thumb}.tmp', 'JPEG')
+        except OSError as e:
+            print(f'Unable to make thumbnail of {path}: {e!r}')
+            return
+        os.replace(f'{thumb}.tmp', thumb)
+
+
+def _digest(path: str) -> str:
+    '''SHA-256 of a file.'''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
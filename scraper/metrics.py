@@ -0,0 +1,308 @@
+'''Metrics Module
+
+This module contains the counters and latency histograms of each stage of
+the pipeline: fetching, parsing, saving, images, the RDS and S3. They can
+be served in the Prometheus text format from a local /metrics endpoint,
+or written to a JSON file at an interval during long backfills.
+
+Example usage:
+
+    with FETCH_SECONDS.time():
+        driver.get(url)
+    PAGES.inc()
+    MetricsServer(port=9100).start()
+'''
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+import threading
+import bisect
+import json
+import time
+import os
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Counter(object):
+    '''Counter Class
+
+    A total that only goes up, such as the number of pages fetched.
+    '''
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str):
+        '''Initialises Counter
+
+        Args:
+            name (str): Metric name, ending in _total.
+            help (str): Description of the metric.
+        '''
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self.lock:
+            self.value += amount
+
+    def samples(self) -> list:
+        return [(self.name, '', self.value)]
+
+    def snapshot(self):
+        return self.value
+
+    def reset(self) -> None:
+        with self.lock:
+            self.value = 0
+
+
+class Histogram(object):
+    '''Histogram Class
+
+    Durations in seconds, counted into cumulative buckets as Prometheus
+    expects, with their count and sum.
+    '''
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: tuple = BUCKETS):
+        '''Initialises Histogram
+
+        Args:
+            name (str): Metric name, ending in _seconds.
+            help (str): Description of the metric.
+            buckets (tuple): Upper bounds of the buckets, ascending.
+        '''
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def observe(self, value: float) -> None:
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        '''Observe the duration of a with block, even if it raises.'''
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start)
+
+    def samples(self) -> list:
+        with self.lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        samples = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + ('+Inf',), counts):
+            cumulative += n
+            samples.append(
+                (f'{self.name}_bucket', f'{{le="{bound}"}}', cumulative))
+        samples.append((f'{self.name}_count', '', count))
+        samples.append((f'{self.name}_sum', '', total))
+        return samples
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {'count': self.count, 'sum': self.sum,
+                    'mean': self.sum / self.count if self.count else 0.0}
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.sum = 0.0
+
+
+class Registry(object):
+    '''Registry Class
+
+    The metrics of a process, rendered together.
+    '''
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._add(Counter(name, help))
+
+    def histogram(self, name: str, help: str,
+                  buckets: tuple = BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, buckets))
+
+    def _add(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        '''The metrics in the Prometheus text exposition format.'''
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> dict:
+        '''The metrics as a dict, for a JSON dump.'''
+        return {x.name: x.snapshot() for x in self.metrics.values()}
+
+    def reset(self) -> None:
+        for metric in self.metrics.values():
+            metric.reset()
+
+
+REGISTRY = Registry()
+
+FETCH_SECONDS = REGISTRY.histogram(
+    'scraper_fetch_seconds', 'Time taken to load a page.')
+PARSE_SECONDS = REGISTRY.histogram(
+    'scraper_parse_seconds', 'Time taken to extract a race from a page.')
+SAVE_SECONDS = REGISTRY.histogram(
+    'scraper_save_seconds', 'Time taken to write a race JSON.')
+IMAGE_SECONDS = REGISTRY.histogram(
+    'scraper_image_seconds', 'Time taken to download a photo finish.')
+DB_SECONDS = REGISTRY.histogram(
+    'scraper_db_seconds', 'Time taken by a write to the RDS.')
+S3_SECONDS = REGISTRY.histogram(
+    'scraper_s3_seconds', 'Time taken to upload a race folder to S3.')
+PAGES = REGISTRY.counter(
+    'scraper_pages_total', 'Pages loaded.')
+RACES = REGISTRY.counter(
+    'scraper_races_total', 'Races saved.')
+RETRIES = REGISTRY.counter(
+    'scraper_retries_total', 'Page loads and requests retried.')
+NO_EVENTS = REGISTRY.counter(
+    'scraper_no_events_total', 'Dates found to have no event.')
+HORSES = REGISTRY.counter(
+    'scraper_horses_total', 'Horse profiles fetched.')
+INTEGRITY_ERRORS = REGISTRY.counter(
+    'scraper_integrity_errors_total', 'Rows rejected by the RDS.')
+SLEEP_SECONDS = REGISTRY.counter(
+    'scraper_sleep_seconds_total', 'Time spent waiting to retry or for '
+    'the rate limit.')
+
+
+class MetricsServer(object):
+    '''MetricsServer Class
+
+    Serves the metrics of a registry at /metrics from a background
+    thread, for Prometheus to scrape.
+
+    Example usage:
+
+        server = MetricsServer(port=9100).start()
+        ...
+        server.stop()
+    '''
+
+    def __init__(self, registry: Registry = REGISTRY,
+                 host: str = '127.0.0.1', port: int = 9100):
+        '''Initialises MetricsServer
+
+        Args:
+            registry (Registry): Metrics to serve.
+            host (str): Address to listen on.
+            port (int): Port to listen on, 0 for any free port.
+        '''
+        self.registry = registry
+        self.routes = {'/metrics': self._metrics}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                route = server.routes.get(self.path.split('?')[0])
+                if route is None:
+                    status, content_type, body = 404, 'text/plain', \
+                        'Not Found\n'
+                else:
+                    status, content_type, body = route()
+                body = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                return
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def start(self) -> 'MetricsServer':
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _metrics(self) -> tuple:
+        return (200, 'text/plain; version=0.0.4',
+                self.registry.render())
+
+
+class MetricsDumper(object):
+    '''MetricsDumper Class
+
+    Writes a JSON snapshot of a registry to a file every interval
+    seconds, and once more when stopped.
+
+    Example usage:
+
+        dumper = MetricsDumper('raw_data/metrics.json', 60).start()
+        ...
+        dumper.stop()
+    '''
+
+    def __init__(self, path: str, interval: float = 60,
+                 registry: Registry = REGISTRY):
+        '''Initialises MetricsDumper
+
+        Args:
+            path (str): File the snapshot is written to.
+            interval (float): Seconds between snapshots.
+            registry (Registry): Metrics to write.
+        '''
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> 'MetricsDumper':
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.stopping.set()
+        self.thread.join()
+        self.dump()
+
+    def dump(self) -> None:
+        '''Write the current snapshot, replacing the previous one.'''
+        snapshot = {'time': time.time(), 'metrics': self.registry.snapshot()}
+        with open(f'{self.path}.tmp', 'w') as f:
+            json.dump(snapshot, f, indent=4)
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def _run(self) -> None:
+        while not self.stopping.wait(self.interval):
+            self.dump()
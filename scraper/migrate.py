@@ -0,0 +1,57 @@
+'''Migrate Module
+
+This module upgrades tables created by earlier versions of the pipeline
+to the current schema. Missing tables are created when the engine is
+first built, but tables that already exist are never altered, so a
+runner table created with text columns is migrated here.
+
+Usage:
+
+    python scraper/__main__.py migrate
+'''
+
+from sqlalchemy import select, inspect, text, MetaData, String, Table
+from uploader import _connect_to_rds, runner_table
+from records import Runner
+
+
+def migrate_runner_table(db: dict, batch_size: int = 1000) -> int:
+    '''Convert a runner table with text columns to the typed columns.
+
+    The rows are copied to a new table through Runner records, so the
+    numbers are parsed exactly as for newly scraped races: finish times
+    become milliseconds, and text such as "---" becomes NULL. The old
+    table is then dropped and the new one takes its name, all in one
+    transaction. A table that is already typed is left as it is.
+
+    Args:
+        db (dict): Dict containing parameters used in building an
+            SQLAlchemy Engine.
+        batch_size (int): Number of rows copied per insert.
+
+    Returns:
+        int: The number of rows migrated.
+    '''
+    engine = _connect_to_rds(db)
+    columns = {x['name']: x['type']
+               for x in inspect(engine).get_columns(runner_table.name)}
+    if not isinstance(columns['number'], String):
+        print('Runner table is up to date')
+        return 0
+    migrated = runner_table.to_metadata(
+        MetaData(), name=f'{runner_table.name}_migrated')
+    rows = 0
+    with engine.begin() as conn:
+        legacy = Table(runner_table.name, MetaData(), autoload_with=conn)
+        migrated.create(conn)
+        result = conn.execution_options(stream_results=True).execute(
+            select(legacy))
+        for batch in result.partitions(batch_size):
+            conn.execute(migrated.insert(), [
+                Runner.from_text(dict(x._mapping)).row() for x in batch])
+            rows += len(batch)
+        legacy.drop(conn)
+        conn.execute(text(
+            f'ALTER TABLE {migrated.name} RENAME TO {runner_table.name}'))
+    print(f'Migrated {rows} runners')
+    return rows
@@ -0,0 +1,229 @@
+'''Page Cache Module
+
+This module contains a local cache of fetched results pages. The HTML is
+stored gzip compressed under the SHA-256 of its content, with an SQLite
+index from each URL to its content and the metadata of the fetch, so
+pages can be revalidated with a conditional request, or parsed again
+without going back to the site.
+'''
+
+from http_driver import HtmlPage
+from collections import namedtuple
+import threading
+import hashlib
+import sqlite3
+import gzip
+import time
+import os
+
+GB = 1024 ** 3
+
+CachedPage = namedtuple(
+    'CachedPage',
+    ['url', 'final_url', 'content', 'etag', 'last_modified', 'fetched_at']
+    )
+
+
+class PageNotCached(LookupError):
+    '''Raised when an offline lookup misses the cache.'''
+
+
+class PageCache(object):
+    '''PageCache Class
+
+    Content addressed store of HTML pages. Identical pages, such as the
+    first race of a day and its RaceNo=1 URL, share one compressed file.
+    Once the files exceed max_bytes, the least recently used URLs are
+    evicted until they fit again.
+
+    Example usage:
+
+        cache = PageCache('raw_data/page_cache')
+        cache.put(url, final_url, content, response.headers)
+        page = cache.page(url)
+        PageParser(page).race_dict()
+    '''
+
+    def __init__(self, path: str, max_bytes: int = 2 * GB):
+        '''Initialises PageCache
+
+        Args:
+            path (str): Folder holding the index and page files.
+            max_bytes (int): Maximum compressed size of the pages.
+        '''
+        self.path = path
+        self.max_bytes = max_bytes
+        if not os.path.exists(os.path.join(path, 'objects')):
+            os.makedirs(os.path.join(path, 'objects'))
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            os.path.join(path, 'index.db'),
+            isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS blobs ('
+            'digest TEXT PRIMARY KEY, size INTEGER NOT NULL)'
+            )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'url TEXT PRIMARY KEY, final_url TEXT NOT NULL, '
+            'digest TEXT NOT NULL, etag TEXT, last_modified TEXT, '
+            'fetched_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+            )
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS pages_accessed '
+            'ON pages (accessed_at)'
+            )
+
+    def get(self, url: str) -> CachedPage:
+        '''Look up a page, marking it as recently used.
+
+        Args:
+            url (str): URL the page was requested from.
+
+        Returns:
+            CachedPage: The page and its fetch metadata, or None.
+        '''
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT final_url, digest, etag, last_modified, fetched_at '
+                'FROM pages WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                'UPDATE pages SET accessed_at = ? WHERE url = ?',
+                (time.time(), url))
+        final_url, digest, etag, last_modified, fetched_at = row
+        try:
+            with open(self._blob_path(digest), 'rb') as f:
+                content = gzip.decompress(f.read())
+        except FileNotFoundError:
+            return None
+        return CachedPage(url, final_url, content, etag, last_modified,
+                          fetched_at)
+
+    def page(self, url: str) -> HtmlPage:
+        '''A cached page, ready to parse.
+
+        Args:
+            url (str): URL the page was requested from.
+
+        Raises:
+            PageNotCached: If the URL is not in the cache.
+        '''
+        cached = self.get(url)
+        if cached is None:
+            raise PageNotCached(url)
+        return HtmlPage(cached.final_url, cached.content)
+
+    def put(self, url: str, final_url: str, content: bytes,
+            headers: dict = None) -> str:
+        '''Store a page.
+
+        Args:
+            url (str): URL the page was requested from.
+            final_url (str): URL of the page after redirects.
+            content (bytes): Body of the page.
+            headers (dict): Response headers, looked up case insensitively
+                as in requests and aiohttp. The ETag and Last-Modified
+                headers are kept for conditional requests.
+
+        Returns:
+            str: SHA-256 of the content.
+        '''
+        headers = headers or {}
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._blob_path(digest)
+        now = time.time()
+        with self.lock:
+            if not os.path.exists(path):
+                data = gzip.compress(content)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(f'{path}.tmp', 'wb') as f:
+                    f.write(data)
+                os.replace(f'{path}.tmp', path)
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO blobs (digest, size) '
+                    'VALUES (?, ?)', (digest, len(data)))
+            old = self.conn.execute(
+                'SELECT digest FROM pages WHERE url = ?', (url,)).fetchone()
+            self.conn.execute(
+                'INSERT OR REPLACE INTO pages (url, final_url, digest, '
+                'etag, last_modified, fetched_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, final_url, digest, headers.get('ETag'),
+                 headers.get('Last-Modified'), now, now))
+            if old is not None and old[0] != digest:
+                self._drop_unused(old[0])
+            self._evict()
+        return digest
+
+    def touch(self, url: str) -> None:
+        '''Record that a cached page was revalidated with the site.'''
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                'UPDATE pages SET fetched_at = ?, accessed_at = ? '
+                'WHERE url = ?', (now, now, url))
+
+    def urls(self, unique: bool = False) -> list:
+        '''Every cached URL, in the order they were fetched.
+
+        Args:
+            unique (bool): Return only the first URL of pages with the
+                same content.
+        '''
+        query = 'SELECT url FROM pages ORDER BY fetched_at'
+        if unique:
+            query = ('SELECT url, min(fetched_at) AS first FROM pages '
+                     'GROUP BY digest ORDER BY first')
+        with self.lock:
+            return [x[0] for x in self.conn.execute(query)]
+
+    def size(self) -> int:
+        '''Compressed size of every cached page, in bytes.'''
+        with self.lock:
+            return self._size()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _size(self) -> int:
+        return self.conn.execute(
+            'SELECT coalesce(sum(size), 0) FROM blobs').fetchone()[0]
+
+    def _evict(self) -> None:
+        '''Drop least recently used URLs until the pages fit.'''
+        size = self._size()
+        while size > self.max_bytes:
+            row = self.conn.execute(
+                'SELECT url, digest FROM pages '
+                'ORDER BY accessed_at LIMIT 1').fetchone()
+            if row is None:
+                return
+            self.conn.execute('DELETE FROM pages WHERE url = ?', (row[0],))
+            size -= self._drop_unused(row[1])
+
+    def _drop_unused(self, digest: str) -> int:
+        '''Delete a page file once no URL refers to it.
+
+        Returns:
+            int: The number of bytes freed.
+        '''
+        used = self.conn.execute(
+            'SELECT 1 FROM pages WHERE digest = ? LIMIT 1',
+            (digest,)).fetchone()
+        if used is not None:
+            return 0
+        size = self.conn.execute(
+            'SELECT size FROM blobs WHERE digest = ?', (digest,)).fetchone()
+        self.conn.execute('DELETE FROM blobs WHERE digest = ?', (digest,))
+        try:
+            os.remove(self._blob_path(digest))
+        except FileNotFoundError:
+            pass
+        return size[0] if size else 0
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(
+            self.path, 'objects', digest[:2], f'{digest}.html.gz')
@@ -0,0 +1,289 @@
+'''Page Parser Module
+
+This module contains the extraction logic for the Hong Kong Jockey Club
+LocalResults pages. It works against any page object exposing the
+WebDriver lookup interface, so the same XPaths serve both the Chrome
+webdriver and the driver-free HttpDriver.
+'''
+
+from records import Runner, runners_to_json
+from uuid import uuid4
+
+# Value of selenium's XPATH, so parsing does not import selenium.
+XPATH = 'xpath'
+
+READY_XPATH = ('/html/body/div/div[5]/table'
+               ' | //div[@id="errorContainer"]'
+               ' | /html/body/div/div[4][starts-with(normalize-space(.),'
+               ' "This race has been abandoned")]')
+RUNNER_XPATH = '/html/body/div/div[5]/table/tbody/tr'
+RUNNER_CELLS = 12
+TABLE_SCRIPT = '''
+var rows = document.evaluate(arguments[0], document, null,
+    XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+var table = [];
+for (var i = 0; i < rows.snapshotLength; i++) {
+    var cells = [];
+    rows.snapshotItem(i).querySelectorAll(':scope > td').forEach(
+        function (td) {
+            var a = td.querySelector('a');
+            cells.push([td.innerText.trim(), a ? a.href : null]);
+        });
+    table.push(cells);
+}
+return table;
+'''
+
+
+class PageParser(object):
+    '''PageParser Class
+
+    Extracts race and runner details from the page currently loaded
+    in a driver.
+
+    Example usage:
+
+        parser = PageParser(driver)
+        driver.get(url)
+        race = parser.generate_id()
+        race.update(parser.race_dict())
+    '''
+
+    def __init__(self, page):
+        '''Initialises PageParser
+
+        Parameters:
+            page (webdriver | HttpDriver | HtmlPage): Source of the
+                page to parse.
+        '''
+        self.page = page
+
+    def generate_id(self) -> dict:
+        ''' Generates a unique race ID
+
+        Generates a human readable unique ID for each race by scraping
+        the date and the race number from the current page, then returns
+        a dictionary with those three keys.
+
+        Returns:
+            dict: A dictionary containing the current races ID, date,
+            and race number.
+        '''
+        date = self.page.find_element(
+            XPATH,
+            '/html/body/div/div[3]/p[1]/span[1]'
+        ).text.split('  ')[1]
+        race_number = self.page.find_element(
+            XPATH,
+            '/html/body/div/div[4]/table/thead/tr/td[1]'
+        ).text.split(' ')[1]
+        race_id = date.replace('/', '')+f'-{race_number}'
+        race_dict = {
+            'race_id': race_id,
+            'date': date,
+            'race_number': race_number
+            }
+        return race_dict
+
+    def race(self) -> dict:
+        '''Extract a race from the page.
+
+        Returns:
+            dict: The race details, with a list of its runners.
+        '''
+        race = {'uuid': str(uuid4())}
+        race.update(self.generate_id())
+        race.update(self.race_dict())
+        race['image_link'] = self.image_link()
+        race['runners'] = self.runner_dict(race['race_id'])
+        return race
+
+    def card_races(self) -> list:
+        '''Get daily races from first page.
+
+        Searches the current page of other races taking place on that date.
+
+        Returns:
+            list(str): a list of URLs for other pages to scrape.
+        '''
+        races = self.page.find_elements(
+            XPATH,
+            '/html/body/div/div[2]/table/tbody/tr[1]/td[position()<last()]/a'
+        )
+        links = [race.get_attribute('href') for race in races]
+        return links
+
+    def race_dict(self) -> dict:
+        '''Create dictionary from scraped date.
+
+        Calls _get_race_data and creates a dictionary for the details
+        pertaining to the race.
+
+        Returns:
+            dict: Dictionart of race details.
+        '''
+        data = self._get_race_data()
+        data_dict = {'class': data[3].split(' - ')[0],
+                     'length': int(data[3].split(' - ')[1][:-1]),
+                     'going': data[5],
+                     'course': data[8].replace('"', ''),
+                     'prize': int(data[9].split(' ')[1].replace(',', '')),
+                     'pace': f'{data[-3]}/{data[-2]}/{data[-1]}',
+                     'url': self.page.current_url}
+        return data_dict
+
+    def runner_dict(self, race_id: str = None) -> dict:
+        '''Creates a dictionary for all runners in a race.
+
+        Calls runners and lays the records out as the dictionary of lists
+        saved in the race JSON.
+
+        Args:
+            race_id (str): ID of the race the runners belong to.
+
+        Returns:
+            dict: A dictionary of runner details.
+        '''
+        return runners_to_json(self.runners(race_id))
+
+    def runners(self, race_id: str = None) -> list:
+        '''Creates a typed record for each runner in a race.
+
+        Calls _get_runner_table to read the table of runners in a single
+        pass, and creates a Runner from each row. Rows short of cells are
+        padded with empty text, and rows without a horse are skipped.
+
+        Args:
+            race_id (str): ID of the race the runners belong to.
+
+        Returns:
+            list (Runner): A record for each runner.
+        '''
+        runners = []
+        for row in self._get_runner_table():
+            runner = self._get_runner(row, race_id)
+            if runner is not None:
+                runners.append(runner)
+        return runners
+
+    def image_link(self) -> str:
+        ''' Get link for race image.
+
+        Retrieves the URL for the picture finish for the current page,
+        and alters it to reach the larger version.
+
+        Returns:
+            str: A URL to the page containing a photograph of the race finish.
+        '''
+        img_link = self.page.find_element(
+            XPATH,
+            '/html/body/div/div[6]/div[2]/div[1]/div/a/img'
+        ).get_attribute('src')
+        i = list(img_link)
+        i[-5] = 'L'
+        return ''.join(i)
+
+    def if_event(self, link) -> bool:
+        '''Checks the current page for data to scrape
+
+        Searches the current page for errorContainers, indicating that
+        there is no race on this date, and compares current URL to
+        intended URL incase of redirection.
+
+        Args:
+            link (str): Intended URL to compare to current.
+
+        Returns:
+            bool: True if no race results are present, otherwise False.
+        '''
+        event = self.page.find_elements(
+            XPATH,
+            '//div[@id="errorContainer"]'
+        )
+        abandoned = self.page.find_elements(
+            XPATH,
+            '/html/body/div/div[4]'
+        )
+        if bool(abandoned):
+            for x in abandoned:
+                if x.text.startswith('This race has been abandoned'):
+                    return True
+        redirected = self.page.current_url != link
+        return (bool(event) or bool(redirected))
+
+    def _get_race_data(self) -> list:
+        '''Scrape the current page for race details.
+
+        Scrapes a table from the current page containing a list of
+        details, and returns them as a list.
+
+        Returns:
+            list (str): A list of raw data, extracted from current page.
+        '''
+        data = self.page.find_elements(
+            XPATH,
+            '/html/body/div/div[4]/table/tbody/tr/td'
+        )
+        data_text = [x.text for x in data]
+        return data_text
+
+    def _get_runner_table(self) -> list:
+        '''Read the table of runners from the current page.
+
+        The whole table is fetched at once: with one lxml pass over pages
+        loaded by the HttpDriver, or one script run in the browser for the
+        Chrome webdriver.
+
+        Returns:
+            list: A list of (text, href) pairs for each row, one pair per
+            cell. href is the first link in the cell, or None.
+        '''
+        if hasattr(self.page, 'table_rows'):
+            return self.page.table_rows(RUNNER_XPATH)
+        if hasattr(self.page, 'execute_script'):
+            return [[tuple(x) for x in row] for row in
+                    self.page.execute_script(TABLE_SCRIPT, RUNNER_XPATH)]
+        rows = self.page.find_elements(XPATH, RUNNER_XPATH)
+        return [[(x.text, _href(x)) for x in row.find_elements(
+            XPATH, './td')] for row in rows]
+
+    def _get_runner(self, row: list, race_id: str = None) -> Runner:
+        '''Create a runner from a row of the table of runners.
+
+        Args:
+            row (list): (text, href) pairs for the cells of the row.
+            race_id (str): ID of the race the runner belongs to.
+
+        Returns:
+            Runner: The runner, or None if the row has no horse.
+        '''
+        if len(row) < RUNNER_CELLS:
+            row = row + [('', None)] * (RUNNER_CELLS - len(row))
+        text = [x[0] for x in row]
+        name, _, horse_id = text[2].partition('(')
+        if not horse_id:
+            print(f'Skipping runner row without a horse: {text}')
+            return None
+        return Runner.from_text({
+            'uuid': str(uuid4()),
+            'race_id': race_id,
+            'horse_id': horse_id[:-1],
+            'place': text[0].strip(' '),
+            'number': text[1].strip(' '),
+            'name': name,
+            'jockey': text[3],
+            'trainer': text[4],
+            'actual_weight': text[5],
+            'declared_weight': text[6],
+            'draw': text[7].strip(' '),
+            'length_behind_winner': text[8],
+            'running_positions': text[9],
+            'finish_time': text[10],
+            'win_odds': text[11],
+            'url': row[2][1]})
+
+
+def _href(cell) -> str:
+    '''The first link in a table cell, or None.'''
+    links = cell.find_elements(XPATH, './/a')
+    return links[0].get_attribute('href') if links else None
@@ -0,0 +1,242 @@
+'''Parquet Store Module
+
+This module contains a columnar store for scraped races. Races and their
+runners are appended to Parquet datasets partitioned by race date, with
+typed columns, so analytics can read whole seasons at once and skip the
+dates and courses it does not need.
+
+Requires pyarrow.
+'''
+
+from records import runners_from_json, to_int
+from uuid import uuid4
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pyarrow as pa
+import datetime
+import threading
+import os
+
+PARTITION = 'race_date'
+
+RACE_SCHEMA = pa.schema([
+    ('uuid', pa.string()),
+    ('race_id', pa.string()),
+    ('date', pa.date32()),
+    ('race_number', pa.int16()),
+    ('class', pa.string()),
+    ('length', pa.int32()),
+    ('going', pa.string()),
+    ('course', pa.string()),
+    ('prize', pa.int64()),
+    ('pace', pa.string()),
+    ('url', pa.string()),
+    ('image_link', pa.string())
+    ])
+
+RUNNER_SCHEMA = pa.schema([
+    ('uuid', pa.string()),
+    ('race_id', pa.string()),
+    ('date', pa.date32()),
+    ('course', pa.string()),
+    ('horse_id', pa.string()),
+    ('place', pa.string()),
+    ('number', pa.int16()),
+    ('name', pa.string()),
+    ('jockey', pa.string()),
+    ('trainer', pa.string()),
+    ('actual_weight', pa.int16()),
+    ('declared_weight', pa.int16()),
+    ('draw', pa.int16()),
+    ('length_behind_winner', pa.string()),
+    ('running_positions', pa.list_(pa.int16())),
+    ('finish_time', pa.int32()),
+    ('win_odds', pa.float64()),
+    ('url', pa.string())
+    ])
+
+
+class ParquetStore(object):
+    '''ParquetStore Class
+
+    Buffers races, then writes one file per race date to the race and
+    runner datasets under path, in folders named race_date=YYYY-MM-DD.
+    Every flush adds new files, so compact() should be run from time to
+    time to merge the files of each date into one.
+
+    Runner rows carry the date and course of their race, so both tables
+    can be filtered on them without a join. The finish time is stored in
+    milliseconds and the running positions as a list of integers.
+
+    Example usage:
+
+        store = ParquetStore('raw_data/parquet')
+        store.add(race)
+        store.flush()
+        store.compact()
+        runners = store.read_runners(dates=['2022-01-26'],
+                                     courses=['TURF - A COURSE'])
+    '''
+
+    def __init__(self, path: str, batch_size: int = 500):
+        '''Initialises ParquetStore
+
+        Args:
+            path (str): Folder holding the race and runner datasets.
+            batch_size (int): Number of races buffered before a flush.
+        '''
+        self.path = path
+        self.batch_size = batch_size
+        self.races = []
+        self.lock = threading.Lock()
+
+    def add(self, race: dict) -> None:
+        '''Add a race to the buffer, writing the buffer once it is full.
+
+        Args:
+            race (dict): A scraped race, with its runners under 'runners'.
+        '''
+        with self.lock:
+            self.races.append(race)
+            full = len(self.races) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        '''Write every buffered race.
+
+        Returns:
+            int: The number of files written.
+        '''
+        with self.lock:
+            races, self.races = self.races, []
+        by_date = {}
+        for race in races:
+            by_date.setdefault(race_date(race['date']), []).append(race)
+        files = 0
+        for date, group in by_date.items():
+            self._write('race', date, race_table(group))
+            self._write('runner', date, runner_table(group))
+            files += 2
+        return files
+
+    def compact(self) -> int:
+        '''Merge the files of each date into a single file.
+
+        Returns:
+            int: The number of files removed.
+        '''
+        removed = 0
+        for name in ('race', 'runner'):
+            root = os.path.join(self.path, name)
+            if not os.path.exists(root):
+                continue
+            for partition in sorted(os.listdir(root)):
+                folder = os.path.join(root, partition)
+                files = sorted(x for x in os.listdir(folder)
+                               if x.endswith('.parquet'))
+                if len(files) < 2:
+                    continue
+                table = pa.concat_tables(
+                    [pq.read_table(os.path.join(folder, x)) for x in files])
+                self._write(name, partition.split('=', 1)[1], table)
+                for x in files:
+                    os.remove(os.path.join(folder, x))
+                removed += len(files) - 1
+        return removed
+
+    def read_races(self, dates: list = None, courses: list = None,
+                   columns: list = None) -> pa.Table:
+        '''Read races, only opening the files of the requested dates.
+
+        Args:
+            dates (list): Dates as datetime.date, YYYY-MM-DD or
+                DD/MM/YYYY, or None for every date.
+            courses (list): Courses to keep, or None for every course.
+            columns (list): Columns to read, or None for every column.
+        '''
+        return self._read('race', dates, courses, columns)
+
+    def read_runners(self, dates: list = None, courses: list = None,
+                     columns: list = None) -> pa.Table:
+        '''Read runners, only opening the files of the requested dates.
+
+        Args:
+            dates (list): Dates as datetime.date, YYYY-MM-DD or
+                DD/MM/YYYY, or None for every date.
+            courses (list): Courses to keep, or None for every course.
+            columns (list): Columns to read, or None for every column.
+        '''
+        return self._read('runner', dates, courses, columns)
+
+    def _read(self, name: str, dates: list, courses: list,
+              columns: list) -> pa.Table:
+        root = os.path.join(self.path, name)
+        schema = RACE_SCHEMA if name == 'race' else RUNNER_SCHEMA
+        if not os.path.exists(root):
+            return schema.empty_table()
+        dataset = ds.dataset(
+            root, format='parquet', schema=schema.append(
+                pa.field(PARTITION, pa.string())),
+            partitioning=ds.partitioning(
+                pa.schema([(PARTITION, pa.string())]), flavor='hive'))
+        expression = None
+        if dates is not None:
+            expression = ds.field(PARTITION).isin(
+                [race_date(x) for x in dates])
+        if courses is not None:
+            course = ds.field('course').isin(list(courses))
+            expression = course if expression is None \
+                else expression & course
+        columns = columns or schema.names
+        return dataset.to_table(columns=columns, filter=expression)
+
+    def _write(self, name: str, date: str, table: pa.Table) -> None:
+        '''Write a table to a new file in the partition of a date.'''
+        folder = os.path.join(self.path, name, f'{PARTITION}={date}')
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f'part-{uuid4().hex}.parquet')
+        pq.write_table(table, f'{path}.tmp')
+        os.replace(f'{path}.tmp', path)
+
+
+def race_table(races: list) -> pa.Table:
+    '''Typed table of races.'''
+    columns = {x: [] for x in RACE_SCHEMA.names}
+    for race in races:
+        for x in columns:
+            columns[x].append(race[x])
+    columns['date'] = [_date(x) for x in columns['date']]
+    for x in ('race_number', 'length', 'prize'):
+        columns[x] = [to_int(i) for i in columns[x]]
+    return pa.Table.from_pydict(columns, schema=RACE_SCHEMA)
+
+
+def runner_table(races: list) -> pa.Table:
+    '''Typed table of the runners of races.'''
+    columns = {x: [] for x in RUNNER_SCHEMA.names}
+    for race in races:
+        date = _date(race['date'])
+        for runner in runners_from_json(race['runners']):
+            for x in columns:
+                if x == 'date':
+                    columns[x].append(date)
+                elif x == 'course':
+                    columns[x].append(race['course'])
+                else:
+                    columns[x].append(getattr(runner, x))
+    return pa.Table.from_pydict(columns, schema=RUNNER_SCHEMA)
+
+
+def race_date(date) -> str:
+    '''A date as YYYY-MM-DD, from a date, YYYY-MM-DD or DD/MM/YYYY.'''
+    if isinstance(date, datetime.date):
+        return date.isoformat()
+    if '/' in date:
+        return _date(date).isoformat()
+    return date
+
+
+def _date(value: str) -> datetime.date:
+    return datetime.datetime.strptime(value, '%d/%m/%Y').date()
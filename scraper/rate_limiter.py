@@ -0,0 +1,336 @@
+'''Rate Limiter Module
+
+This module contains the request scheduler shared by every fetcher of a
+run: the page and race drivers, the async crawler and the image stage.
+The request rate to each host adapts to the site, rising steadily while
+responses are quick and halving when they slow down or fail. Failures
+back off exponentially, and a run of them opens a circuit breaker that
+stops requests to the host until a trial request succeeds.
+
+Example usage:
+
+    limiter = RateLimiter(rate=2, max_rate=8)
+    response = limiter.send(session, url)
+'''
+
+from metrics import SLEEP_SECONDS, RETRIES
+from urllib.parse import urlsplit
+from collections import deque
+import threading
+import requests
+import asyncio
+import time
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    '''Raised when a host has stayed unhealthy for too long to continue.'''
+
+
+class HostState(object):
+    '''HostState Class
+
+    The schedule and health of requests to one host.
+    '''
+
+    def __init__(self, host: str, rate: float = None):
+        '''Initialises HostState
+
+        Args:
+            host (str): Host name and port.
+            rate (float): Requests per second, or None for no limit.
+
+        Parameters:
+            next_slot (float): Earliest start of the next request.
+            starts (deque): Start times of the latest requests.
+            latency (float): Seconds taken by the last response.
+            decreased_at (float): Time the rate was last decreased.
+            failures (int): Failures since the last success.
+            trips (int): Times the circuit opened since the last success.
+            open_until (float): End of the open circuit, or None while
+                it is closed.
+            probing (bool): A trial request is in flight.
+        '''
+        self.host = host
+        self.rate = rate
+        self.next_slot = 0.0
+        self.starts = deque(maxlen=50)
+        self.latency = None
+        self.decreased_at = 0.0
+        self.failures = 0
+        self.trips = 0
+        self.open_until = None
+        self.probing = False
+
+    def observed_rate(self) -> float:
+        '''Requests per second started over the latest requests.'''
+        if len(self.starts) < 2 or self.starts[-1] == self.starts[0]:
+            return None
+        return (len(self.starts) - 1) / (self.starts[-1] - self.starts[0])
+
+
+class RateLimiter(object):
+    '''RateLimiter Class
+
+    Schedules requests to each host with additive increase,
+    multiplicative decrease. Every response quicker than slow adds
+    increase to the rate, up to max_rate, and a slow response or a
+    failure multiplies it by decrease, at most once per round trip.
+    Starting without a rate or max_rate, requests are unthrottled until
+    the first slow response or failure, from which the rate starts at
+    the rate observed, or at one request per round trip.
+
+    Each failure also holds back the next request for backoff seconds,
+    doubling with each failure in a row. After threshold failures in a
+    row the circuit opens for reset seconds, then a single trial request
+    is let through: success closes the circuit, failure opens it again.
+    Once it has opened max_trips times in a row, CircuitOpenError is
+    raised so the run stops rather than hammering the site.
+
+    One RateLimiter is thread safe, and can be shared between threads
+    and an event loop.
+
+    Example usage:
+
+        limiter = RateLimiter(rate=2)
+        limiter.wait(url)
+        start = time.monotonic()
+        ...
+        limiter.success(url, time.monotonic() - start)
+    '''
+
+    def __init__(self, rate: float = None, max_rate: float = None,
+                 min_rate: float = 0.2, increase: float = 0.2,
+                 decrease: float = 0.5, slow: float = 5.0,
+                 backoff: float = 0.5, max_backoff: float = 60,
+                 threshold: int = 5, reset: float = 30,
+                 max_trips: int = 5):
+        '''Initialises RateLimiter
+
+        Args:
+            rate (float): Starting requests per second to each host, or
+                None to start at max_rate.
+            max_rate (float): Highest requests per second, or None for
+                no ceiling.
+            min_rate (float): Lowest requests per second.
+            increase (float): Requests per second added on each quick
+                response.
+            decrease (float): Factor the rate is multiplied by on a slow
+                response or a failure.
+            slow (float): Seconds beyond which a response is slow.
+            backoff (float): Seconds the next request is held back after
+                a failure, doubling with each failure in a row.
+            max_backoff (float): Longest backoff in seconds.
+            threshold (int): Failures in a row that open the circuit.
+            reset (float): Seconds the circuit stays open.
+            max_trips (int): Times in a row the circuit may open before
+                CircuitOpenError is raised, or None to wait forever.
+
+        Parameters:
+            hosts (dict): HostState of each host requested.
+        '''
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.slow = slow
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.threshold = threshold
+        self.reset = reset
+        self.max_trips = max_trips
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def host(self, url: str) -> HostState:
+        '''The state of the host of a URL.'''
+        name = urlsplit(url).netloc
+        with self.lock:
+            if name not in self.hosts:
+                self.hosts[name] = HostState(
+                    name, self.rate if self.rate is not None
+                    else self.max_rate)
+            return self.hosts[name]
+
+    def wait(self, url: str) -> None:
+        '''Block until a request to the host of a URL may start.
+
+        Raises:
+            CircuitOpenError: If the circuit has opened max_trips times
+                in a row.
+        '''
+        while True:
+            seconds, reserved = self._reserve(url)
+            if seconds > 0:
+                SLEEP_SECONDS.inc(seconds)
+                time.sleep(seconds)
+            if reserved:
+                return
+
+    async def wait_async(self, url: str) -> None:
+        '''Wait without blocking the event loop, as wait.'''
+        while True:
+            seconds, reserved = self._reserve(url)
+            if seconds > 0:
+                SLEEP_SECONDS.inc(seconds)
+                await asyncio.sleep(seconds)
+            if reserved:
+                return
+
+    def success(self, url: str, latency: float) -> None:
+        '''Record a response, closing the circuit of its host.
+
+        Args:
+            url (str): URL requested.
+            latency (float): Seconds taken by the response.
+        '''
+        host = self.host(url)
+        with self.lock:
+            now = time.monotonic()
+            host.latency = latency
+            host.failures = 0
+            host.trips = 0
+            host.open_until = None
+            host.probing = False
+            if latency > self.slow:
+                self._decrease(host, now)
+            elif host.rate is not None:
+                host.rate += self.increase
+                if self.max_rate is not None:
+                    host.rate = min(host.rate, self.max_rate)
+
+    def failure(self, url: str) -> None:
+        '''Record a failed request, or a page that did not load.
+
+        Args:
+            url (str): URL requested.
+        '''
+        host = self.host(url)
+        with self.lock:
+            now = time.monotonic()
+            self._decrease(host, now)
+            host.failures += 1
+            if host.probing or host.failures >= self.threshold:
+                host.trips += 1
+                host.failures = 0
+                host.probing = False
+                host.open_until = now + self.reset
+                print(f'Circuit open for {host.host}: '
+                      f'{host.trips} trips')
+                return
+            delay = min(self.backoff * 2 ** (host.failures - 1),
+                        self.max_backoff)
+            host.next_slot = max(host.next_slot, now + delay)
+
+    def release(self, url: str) -> None:
+        '''Record a request that ended without a verdict on its host.
+
+        A request that waited is expected to be reported by success or
+        failure. One that ends any other way, for example with an error
+        response that says nothing of the host's health, must be
+        released, or a trial request of an open circuit would keep every
+        later request to the host waiting.
+
+        Args:
+            url (str): URL requested.
+        '''
+        host = self.host(url)
+        with self.lock:
+            host.probing = False
+
+    def retry_delay(self, tries: int) -> float:
+        '''Seconds to wait before loading a page again that loaded
+        without the content expected, such as results not yet published.
+
+        The page did load, so unlike failure this neither slows the host
+        nor counts towards its circuit breaker.
+
+        Args:
+            tries (int): Attempts made so far, less one.
+        '''
+        return min(self.backoff * 2 ** tries, self.max_backoff)
+
+    def send(self, session: requests.Session, url: str, retries: int = 3,
+             **kwargs) -> requests.Response:
+        '''Request a URL on a session, retrying failures.
+
+        Connection errors, timeouts and RETRY_STATUS responses are
+        retried after the backoff. Once the retries are used up the last
+        error is raised, or the last response returned.
+
+        Args:
+            session (requests.Session): Session to request the URL on.
+            url (str): URL to request.
+            retries (int): Attempts after the first.
+            **kwargs: Passed to session.get.
+
+        Returns:
+            requests.Response: The response.
+        '''
+        for tries in range(retries + 1):
+            self.wait(url)
+            start = time.monotonic()
+            try:
+                response = session.get(url, **kwargs)
+            except requests.RequestException as e:
+                self.failure(url)
+                if tries == retries:
+                    raise
+                print(f'Request failed ({e!r}): {tries+1} attempts')
+                RETRIES.inc()
+                continue
+            except BaseException:
+                self.release(url)
+                raise
+            if response.status_code in RETRY_STATUS:
+                self.failure(url)
+                if tries == retries:
+                    return response
+                print(f'Request failed ({response.status_code} from '
+                      f'{url}): {tries+1} attempts')
+                RETRIES.inc()
+                response.close()
+                continue
+            self.success(url, time.monotonic() - start)
+            return response
+
+    def _reserve(self, url: str) -> tuple:
+        '''Reserve the next request slot of the host of a URL.
+
+        Returns:
+            tuple: Seconds to wait, and whether a slot was reserved.
+            Without one, the wait is for the circuit and the caller
+            tries again after it.
+        '''
+        host = self.host(url)
+        with self.lock:
+            now = time.monotonic()
+            if host.open_until is not None:
+                if self.max_trips is not None \
+                        and host.trips >= self.max_trips:
+                    raise CircuitOpenError(
+                        f'Circuit open for {host.host} after '
+                        f'{host.trips} trips')
+                if now < host.open_until or host.probing:
+                    return max(host.open_until - now, 0.1), False
+                host.probing = True
+            slot = max(now, host.next_slot)
+            if host.rate:
+                host.next_slot = slot + 1 / host.rate
+            host.starts.append(slot)
+            return slot - now, True
+
+    def _decrease(self, host: HostState, now: float) -> None:
+        if now - host.decreased_at < (host.latency or 1.0):
+            return
+        host.decreased_at = now
+        rate = host.rate
+        if rate is None:
+            rate = host.observed_rate()
+            if rate is None and host.latency:
+                rate = 1 / host.latency
+            if rate is None:
+                return
+        host.rate = max(rate * self.decrease, self.min_rate)
@@ -0,0 +1,169 @@
+'''Records Module
+
+This module contains the typed record of a runner. Numbers scraped from
+the results table are parsed once, when the record is created, so the
+weights, draw and odds are numbers, the finish time is in milliseconds
+and the running positions are a tuple of integers. Records convert back
+to the dict of string lists saved in the race JSON without loss.
+'''
+
+from dataclasses import dataclass
+from typing import Optional
+
+FIELDS = ('uuid', 'race_id', 'horse_id', 'place', 'number', 'name',
+          'jockey', 'trainer', 'actual_weight', 'declared_weight', 'draw',
+          'length_behind_winner', 'running_positions', 'finish_time',
+          'win_odds', 'url')
+
+
+def to_int(value: str) -> Optional[int]:
+    '''An integer, or None for values such as "---".'''
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        return None
+
+
+def to_float(value: str) -> Optional[float]:
+    '''A float, or None for values such as "---".'''
+    try:
+        return float(str(value).strip())
+    except ValueError:
+        return None
+
+
+def finish_ms(value: str) -> Optional[int]:
+    '''A finish time such as 1:09.45 in milliseconds, or None.'''
+    try:
+        minutes, _, seconds = value.strip().rpartition(':')
+        return round((int(minutes or 0) * 60 + float(seconds)) * 1000)
+    except ValueError:
+        return None
+
+
+def positions(value: str) -> tuple:
+    '''Running positions such as "5 5 1" as a tuple of integers.'''
+    return tuple(int(x) for x in value.split() if x.isdigit())
+
+
+def format_ms(value: int) -> str:
+    '''A time in milliseconds as M:SS.ss.'''
+    minutes, ms = divmod(value, 60000)
+    return f'{minutes}:{ms / 1000:05.2f}'
+
+
+PARSERS = {
+    'number': to_int,
+    'actual_weight': to_int,
+    'declared_weight': to_int,
+    'draw': to_int,
+    'running_positions': positions,
+    'finish_time': finish_ms,
+    'win_odds': to_float
+    }
+
+FORMATTERS = {
+    'number': str,
+    'actual_weight': str,
+    'declared_weight': str,
+    'draw': str,
+    'running_positions': lambda x: ' '.join(str(i) for i in x),
+    'finish_time': format_ms,
+    'win_odds': lambda x: f'{x:g}'
+    }
+
+
+@dataclass
+class Runner(object):
+    '''Runner Class
+
+    A horse's participation in a race, with typed fields. Where the
+    typed value of a field would not format back to the scraped text,
+    for example a draw of "---" for a withdrawn horse, the text is kept
+    in raw so the JSON round trip stays lossless.
+
+    Example usage:
+
+        runners = runners_from_json(race['runners'])
+        fastest = min(x.finish_time for x in runners if x.finish_time)
+        race['runners'] = runners_to_json(runners)
+    '''
+
+    __slots__ = FIELDS + ('raw',)
+
+    uuid: str
+    race_id: str
+    horse_id: str
+    place: str
+    number: Optional[int]
+    name: str
+    jockey: str
+    trainer: str
+    actual_weight: Optional[int]
+    declared_weight: Optional[int]
+    draw: Optional[int]
+    length_behind_winner: str
+    running_positions: tuple
+    finish_time: Optional[int]
+    win_odds: Optional[float]
+    url: str
+    raw: Optional[dict]
+
+    @classmethod
+    def from_text(cls, values: dict) -> 'Runner':
+        '''Create a runner from the scraped text of each field.
+
+        Args:
+            values (dict): Text keyed by field name.
+        '''
+        fields = {}
+        raw = {}
+        for name in FIELDS:
+            value = values[name]
+            if name in PARSERS and value is not None:
+                parsed = PARSERS[name](value)
+                if parsed is None or FORMATTERS[name](parsed) != value:
+                    raw[name] = value
+                value = parsed
+            fields[name] = value
+        return cls(raw=raw or None, **fields)
+
+    def text(self, name: str) -> str:
+        '''A field as the text it was scraped from.'''
+        if self.raw and name in self.raw:
+            return self.raw[name]
+        value = getattr(self, name)
+        if name in FORMATTERS and value is not None:
+            return FORMATTERS[name](value)
+        return value
+
+    def row(self) -> dict:
+        '''The runner as a row of the runner table.'''
+        row = {x: getattr(self, x) for x in FIELDS}
+        row['running_positions'] = self.text('running_positions')
+        return row
+
+
+def runners_from_json(runners: dict) -> list:
+    '''Runner records from the runners of a race JSON.
+
+    Args:
+        runners (dict): Lists of text, keyed by field name.
+
+    Returns:
+        list (Runner): One record per runner.
+    '''
+    return [Runner.from_text(dict(zip(FIELDS, x)))
+            for x in zip(*[runners[x] for x in FIELDS])]
+
+
+def runners_to_json(runners: list) -> dict:
+    '''The runners of a race JSON from runner records.
+
+    Args:
+        runners (list): Runner records.
+
+    Returns:
+        dict: Lists of text, keyed by field name.
+    '''
+    return {name: [x.text(name) for x in runners] for name in FIELDS}
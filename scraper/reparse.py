@@ -0,0 +1,158 @@
+'''Reparse Module
+
+This module rebuilds the race JSON in raw_data from the page cache,
+without going back to the site. Pages are parsed in parallel across
+every core with a process pool, and the refreshed races can optionally
+be reloaded into the RDS.
+
+Usage:
+
+    python scraper/__main__.py reparse [--cache raw_data/page_cache]
+        [--reload-rds]
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+from page_cache import PageCache
+from page_parser import PageParser
+from uploader import RAW_DATA_PATH
+import json
+import time
+import os
+
+CHUNK_SIZE = 64
+
+_cache = None
+
+
+def reparse(cache_path: str, raw_data_path: str = RAW_DATA_PATH,
+            db: dict = None, workers: int = None,
+            batch_size: int = 500, parquet_path: str = None) -> dict:
+    '''Parse every cached results page again.
+
+    Each race is written to its JSON file in raw_data_path. The uuids
+    of a race and its runners are kept from the existing file, so rows
+    already in the RDS keep their ids.
+
+    Args:
+        cache_path (str): Folder of the page cache.
+        raw_data_path (str): Location of data folder.
+        db (dict): Optional parameters used in building an SQLAlchemy
+            Engine. The races are reloaded into the RDS, replacing the
+            rows that are already there.
+        workers (int): Number of processes, defaults to the CPU count.
+        batch_size (int): Number of races reloaded per transaction.
+        parquet_path (str): Optional folder of Parquet datasets the races
+            are also written to.
+
+    Returns:
+        dict: Counts of pages, races and runners, pages skipped because
+        they could not be read or parsed, the elapsed seconds, and the
+        records (races and runners) parsed per second.
+    '''
+    start = time.monotonic()
+    cache = PageCache(cache_path)
+    urls = cache.urls(unique=True)
+    cache.close()
+    chunks = [urls[x:x + CHUNK_SIZE] for x in range(0, len(urls), CHUNK_SIZE)]
+    loader = None
+    if db is not None:
+        from bulk_loader import BulkLoader
+        loader = BulkLoader(db, batch_size, replace=True)
+    store = None
+    if parquet_path is not None:
+        from parquet_store import ParquetStore
+        store = ParquetStore(parquet_path, batch_size)
+    seen = set()
+    runners = 0
+    skipped = 0
+    with ProcessPoolExecutor(
+            max_workers=workers, initializer=_open_cache,
+            initargs=(cache_path,)) as executor:
+        for races, failed in executor.map(
+                _parse_chunk, chunks, [raw_data_path] * len(chunks)):
+            skipped += failed
+            for race in races:
+                if race['race_id'] in seen:
+                    continue
+                seen.add(race['race_id'])
+                runners += len(race['runners']['uuid'])
+                if loader is not None:
+                    loader.add(race)
+                if store is not None:
+                    store.add(race)
+    if loader is not None:
+        loader.flush()
+    if store is not None:
+        store.flush()
+        store.compact()
+    elapsed = time.monotonic() - start
+    stats = {'pages': len(urls), 'races': len(seen), 'runners': runners,
+             'skipped': skipped, 'seconds': elapsed,
+             'records_per_second': (len(seen) + runners) / elapsed
+             if elapsed else 0.0}
+    print(f"Reparsed {stats['races']} races and {stats['runners']} runners "
+          f"from {stats['pages']} pages in {elapsed:.1f}s "
+          f"({stats['records_per_second']:.0f} records/sec), "
+          f"skipping {skipped} pages")
+    return stats
+
+
+def _open_cache(cache_path: str) -> None:
+    '''Open the page cache once in each worker process.'''
+    global _cache
+    _cache = PageCache(cache_path)
+
+
+def _parse_chunk(urls: list, raw_data_path: str) -> list:
+    '''Parse and save the races of a list of cached pages.
+
+    Args:
+        urls (list): Cached URLs.
+        raw_data_path (str): Location of data folder.
+
+    Returns:
+        tuple: The races found, skipping pages with no event, and the
+        number of pages that could not be read or parsed.
+    '''
+    races = []
+    skipped = 0
+    for url in urls:
+        try:
+            parser = PageParser(_cache.page(url))
+            if parser.if_event(url):
+                continue
+            race = parser.race()
+        except (LookupError, ValueError) as e:
+            print(f'Unable to parse {url}: {e!r}')
+            skipped += 1
+            continue
+        _keep_uuids(race, raw_data_path)
+        _write_race(race, raw_data_path)
+        races.append(race)
+    return races, skipped
+
+
+def _keep_uuids(race: dict, raw_data_path: str) -> None:
+    '''Reuse the uuids of a previously saved copy of a race.'''
+    id = race['race_id']
+    path = os.path.join(raw_data_path, id, f'{id}.json')
+    if not os.path.exists(path):
+        return
+    with open(path, 'r') as f:
+        old = json.load(f)
+    race['uuid'] = old['uuid']
+    uuids = dict(zip(old['runners']['horse_id'], old['runners']['uuid']))
+    runners = race['runners']
+    runners['uuid'] = [uuids.get(horse, uuid) for horse, uuid in
+                       zip(runners['horse_id'], runners['uuid'])]
+
+
+def _write_race(race: dict, raw_data_path: str) -> None:
+    id = race['race_id']
+    folder = os.path.join(raw_data_path, id)
+    if not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+    tmp = os.path.join(folder, f'{id}.{os.getpid()}.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(race, f, indent=4)
+    os.replace(tmp, os.path.join(folder, f'{id}.json'))
@@ -0,0 +1,222 @@
+'''S3 Uploader Module
+
+This module contains a concurrent uploader for race folders. A single
+boto3 client is shared by every upload, files are sent in parallel from
+a thread pool with multipart transfers for large images, and files whose
+content is already in the bucket are skipped. Only the race JSON and its
+photo finish are uploaded, so partial downloads and thumbnails left in
+a folder stay local.
+'''
+
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from metrics import S3_SECONDS
+import threading
+import hashlib
+import boto3
+import os
+
+MB = 1024 * 1024
+
+_clients = {}
+_uploaders = {}
+_lock = threading.RLock()
+
+
+def s3_client(endpoint_url: str = None):
+    '''Get the shared S3 client.
+
+    boto3 clients are thread safe, so one is created per endpoint and
+    reused for the life of the process. The endpoint defaults to the
+    S3_ENDPOINT_URL environment variable, which allows a MinIO or other
+    S3 compatible target to be used in place of AWS.
+
+    Args:
+        endpoint_url (str): URL of an S3 compatible service.
+    '''
+    endpoint_url = endpoint_url or os.getenv('S3_ENDPOINT_URL') or None
+    with _lock:
+        if endpoint_url not in _clients:
+            _clients[endpoint_url] = boto3.client(
+                's3', endpoint_url=endpoint_url)
+        return _clients[endpoint_url]
+
+
+def s3_uploader(bucket: str, raw_data_path: str) -> 'S3Uploader':
+    '''Get the shared S3Uploader for a bucket and data folder.'''
+    with _lock:
+        if (bucket, raw_data_path) not in _uploaders:
+            _uploaders[bucket, raw_data_path] = S3Uploader(
+                bucket, raw_data_path)
+        return _uploaders[bucket, raw_data_path]
+
+
+class S3Uploader(object):
+    '''S3Uploader Class
+
+    Uploads the race JSON and image of a race folder to a bucket. The
+    files of a folder are uploaded concurrently, and folders can be
+    submitted to run in the background while scraping continues. Each
+    object stores the SHA-256 of its content as metadata, so unchanged
+    files are not sent again. The keys of a folder are listed in one
+    request, and an object's metadata is only fetched when a key of the
+    same size is already in the bucket.
+
+    Example usage:
+
+        uploader = S3Uploader(bucket, raw_data_path)
+        uploader.submit(race_id)
+        ...
+        uploader.wait()
+    '''
+
+    def __init__(self, bucket: str, raw_data_path: str,
+                 max_workers: int = 8,
+                 multipart_threshold: int = 8 * MB,
+                 multipart_chunksize: int = 8 * MB,
+                 endpoint_url: str = None):
+        '''Initialises S3Uploader
+
+        Args:
+            bucket (str): The name of the S3 bucket.
+            raw_data_path (str): Location of data folder.
+            max_workers (int): Number of files uploaded at once.
+            multipart_threshold (int): Size in bytes above which files
+                are sent as multipart uploads.
+            multipart_chunksize (int): Size in bytes of each part.
+            endpoint_url (str): URL of an S3 compatible service.
+
+        Parameters:
+            uploaded (int): Files sent to the bucket.
+            skipped (int): Files already in the bucket.
+        '''
+        self.bucket = bucket
+        self.client = s3_client(endpoint_url)
+        self.config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=4
+            )
+        self.raw_data_path = raw_data_path
+        self.files = ThreadPoolExecutor(max_workers=max_workers)
+        self.folders = ThreadPoolExecutor(max_workers=2)
+        self.pending = []
+        self.uploaded = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def upload_folder(self, id: str) -> list:
+        '''Upload the files of a race folder, blocking until done.
+
+        Args:
+            id (str): The id of a race to upload.
+
+        Returns:
+            list: The keys of the files now in the bucket.
+        '''
+        folder = os.path.join(self.raw_data_path, id)
+        if not os.path.isdir(folder):
+            raise FileNotFoundError(folder)
+        names = [x for x in race_files(id)
+                 if os.path.isfile(os.path.join(folder, x))]
+        with S3_SECONDS.time():
+            stored = self._stored_sizes(id)
+            futures = [self.files.submit(
+                            self.upload_file, os.path.join(folder, x), x,
+                            stored)
+                       for x in names]
+            for future in futures:
+                future.result()
+        return names
+
+    def submit(self, id: str):
+        '''Upload a race folder in the background.
+
+        Args:
+            id (str): The id of a race to upload.
+
+        Returns:
+            Future: Resolves to the uploaded keys.
+        '''
+        future = self.folders.submit(self.upload_folder, id)
+        with self.lock:
+            self.pending.append(future)
+        return future
+
+    def wait(self) -> None:
+        '''Block until every submitted folder has been uploaded.
+
+        Raises the first upload error, after all uploads have finished.
+        '''
+        with self.lock:
+            pending, self.pending = self.pending, []
+        errors = [x.exception() for x in pending]
+        errors = [x for x in errors if x is not None]
+        if errors:
+            raise errors[0]
+
+    def upload_file(self, path: str, key: str, stored: dict = None) -> bool:
+        '''Upload a file unless the bucket already holds its content.
+
+        Args:
+            path (str): Location of the file.
+            key (str): Object key in the bucket.
+            stored (dict): Sizes of the objects in the bucket by key, from
+                a listing. A key missing from it, or of another size, is
+                uploaded without fetching its metadata. Without a listing
+                the metadata is always fetched.
+
+        Returns:
+            bool: True if the file was sent, False if it was skipped.
+        '''
+        digest = _sha256(path)
+        if stored is None or stored.get(key) == os.path.getsize(path):
+            unchanged = self._stored_digest(key) == digest
+        else:
+            unchanged = False
+        if unchanged:
+            with self.lock:
+                self.skipped += 1
+            return False
+        self.client.upload_file(
+            path, self.bucket, key,
+            ExtraArgs={'Metadata': {'sha256': digest}},
+            Config=self.config
+            )
+        with self.lock:
+            self.uploaded += 1
+        return True
+
+    def _stored_sizes(self, prefix: str) -> dict:
+        '''Sizes of the objects whose keys start with a prefix.'''
+        sizes = {}
+        pages = self.client.get_paginator('list_objects_v2').paginate(
+            Bucket=self.bucket, Prefix=prefix)
+        for page in pages:
+            for item in page.get('Contents', []):
+                sizes[item['Key']] = item['Size']
+        return sizes
+
+    def _stored_digest(self, key: str) -> str:
+        '''SHA-256 recorded on an object, or None if it does not exist.'''
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return None
+            raise
+        return head.get('Metadata', {}).get('sha256')
+
+
+def race_files(id: str) -> tuple:
+    '''Names of the files of a race folder that belong in the bucket.'''
+    return f'{id}.json', f'{id}.jpg'
+
+
+def _sha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(MB), b''):
+            sha.update(block)
+    return sha.hexdigest()
@@ -0,0 +1,294 @@
+'''Sharding Module
+
+This module splits a range of dates into shards, and leases them to
+scraper workers through the shard table in the RDS, so any number of
+workers can share a backfill without scraping the same date twice.
+'''
+
+from sqlalchemy import select, update, func, or_, and_, case
+from bulk_loader import INSERTS
+from uploader import _connect_to_rds, shard_table
+from urllib.parse import urlsplit, parse_qs
+import functools
+import datetime
+import threading
+import socket
+import time
+import os
+
+DATE_FORMAT = '%Y/%m/%d'
+
+
+def create_shards(db: dict, links: list, shard_days: int = 30) -> int:
+    '''Split a list of date links into shards in the shard table.
+
+    Each shard covers shard_days consecutive links, and is named after
+    its first and last date, so creating the same shards again adds
+    nothing. Run once by the coordinator before starting the workers.
+
+    Args:
+        db (dict): Dict containing parameters used in building an
+            SQLAlchemy Engine.
+        links (list): a list of urls to the first race of a day, as
+            returned by Scraper.create_date_links.
+        shard_days (int): Number of dates in each shard.
+
+    Returns:
+        int: The number of new shards.
+    '''
+    dates = [link_date(x) for x in links]
+    rows = []
+    for x in range(0, len(dates), shard_days):
+        first, last = dates[x], dates[min(x + shard_days, len(dates)) - 1]
+        rows.append({'shard_id': f'{first}-{last}', 'first_date': first,
+                     'last_date': last, 'status': 'pending',
+                     'attempts': 0})
+    if not rows:
+        return 0
+    engine = _connect_to_rds(db)
+    with engine.begin() as conn:
+        existing = set(conn.execute(
+            select(shard_table.c.shard_id).where(shard_table.c.shard_id.in_(
+                [x['shard_id'] for x in rows]))).scalars())
+        rows = [x for x in rows if x['shard_id'] not in existing]
+        if rows:
+            insert = INSERTS.get(conn.dialect.name)
+            stmt = (insert(shard_table).on_conflict_do_nothing()
+                    if insert else shard_table.insert())
+            conn.execute(stmt, rows)
+    print(f'Created {len(rows)} shards')
+    return len(rows)
+
+
+class ShardWorker(object):
+    '''ShardWorker Class
+
+    Claims shards from the shard table and scrapes their dates. A claim
+    is a lease that the worker renews while it scrapes; the lease of a
+    worker that dies expires, and its shard is claimed by another worker.
+    On PostgreSQL the claim locks the shard row with FOR UPDATE SKIP
+    LOCKED, so workers never wait on each other. SQLite has no row locks,
+    and the claim instead relies on a conditional UPDATE. A shard that has
+    been claimed max_attempts times without finishing is marked failed.
+    Each shard is scraped in one call to scrape_dates, so a checkpoint or
+    planner is set up once per shard. The lease is checked before each
+    date, and a worker that has lost it stops scraping the shard.
+
+    Example usage:
+
+        create_shards(db, scraper.create_date_links(days=3650))
+        ShardWorker(db).run(scraper, db, bucket)
+    '''
+
+    def __init__(self, db: dict, worker_id: str = None,
+                 lease_seconds: float = 600, poll_interval: float = 30,
+                 max_attempts: int = 3):
+        '''Initialises ShardWorker
+
+        Args:
+            db (dict): Dict containing parameters used in building an
+                SQLAlchemy Engine.
+            worker_id (str): Name recorded as the owner of leased shards,
+                defaults to the host name and process id.
+            lease_seconds (float): Length of a lease. It is renewed every
+                third of this while a shard is scraped.
+            poll_interval (float): Seconds to wait for the leases of other
+                workers to finish or expire.
+            max_attempts (int): Claims of a shard before it is marked
+                failed.
+
+        Parameters:
+            completed (list): Ids of the shards this worker finished.
+        '''
+        self.engine = _connect_to_rds(db)
+        self.worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.completed = []
+
+    def claim(self) -> dict:
+        '''Lease the most recent pending or expired shard.
+
+        Expired shards that have used up their attempts are marked failed
+        instead of being claimed.
+
+        Returns:
+            dict: The shard row, or None if no shard is available.
+        '''
+        while True:
+            now = time.time()
+            expired = and_(shard_table.c.status == 'leased',
+                           shard_table.c.lease_expires < now)
+            exhausted = shard_table.c.attempts >= self.max_attempts
+            available = and_(
+                or_(shard_table.c.status == 'pending', expired),
+                ~exhausted)
+            with self.engine.begin() as conn:
+                failed = conn.execute(
+                    update(shard_table).where(expired, exhausted)
+                    .values(status='failed', lease_expires=None)).rowcount
+                if failed:
+                    print(f'Marked {failed} shards failed')
+                row = conn.execute(
+                    select(shard_table).where(available)
+                    .order_by(shard_table.c.first_date.desc()).limit(1)
+                    .with_for_update(skip_locked=True)).first()
+                if row is None:
+                    return None
+                shard = dict(row._mapping)
+                shard.update(status='leased', owner=self.worker_id,
+                             lease_expires=now + self.lease_seconds,
+                             attempts=row.attempts + 1)
+                result = conn.execute(
+                    update(shard_table)
+                    .where(shard_table.c.shard_id == row.shard_id, available)
+                    .values(**shard))
+            if result.rowcount == 1:
+                print(f'Claimed shard {row.shard_id}')
+                return shard
+
+    def renew(self, shard_id: str) -> bool:
+        '''Extend the lease on a shard.
+
+        Returns:
+            bool: False if the lease has been lost to another worker.
+        '''
+        return self._update(
+            shard_id, lease_expires=time.time() + self.lease_seconds)
+
+    def complete(self, shard_id: str) -> bool:
+        '''Mark a leased shard done.'''
+        return self._update(shard_id, status='done', lease_expires=None)
+
+    def release(self, shard_id: str) -> bool:
+        '''Give up the lease on a shard, so another worker can claim it,
+        or mark it failed if it has used up its attempts.'''
+        status = case(
+            (shard_table.c.attempts >= self.max_attempts, 'failed'),
+            else_='pending')
+        return self._update(
+            shard_id, status=status, owner=None, lease_expires=None)
+
+    def remaining(self) -> int:
+        '''Number of shards that are neither done nor failed.'''
+        with self.engine.connect() as conn:
+            return conn.execute(
+                select(func.count()).select_from(shard_table)
+                .where(shard_table.c.status.in_(('pending', 'leased')))
+                ).scalar()
+
+    def run(self, scraper, db: dict, bucket: str, **kwargs) -> list:
+        '''Claim and scrape shards until every shard is done.
+
+        When no shard is available but others are still leased, the
+        worker waits, so the shards of a worker that died are picked up
+        once their leases expire. The lease is renewed before each date
+        of a shard; if it has been lost the rest of the shard is left to
+        its new owner. Dates that fail are skipped, and a shard with
+        failed dates, or whose scrape raises, is released to be claimed
+        again, until it is marked failed after max_attempts.
+
+        Args:
+            scraper (Scraper): Scraper used for the dates of each shard.
+            db (dict): Dict containing parameters used in building an
+                SQLAlchemy Engine.
+            bucket (str): The name of the S3 bucket.
+            **kwargs: Passed on to scraper.scrape_dates.
+
+        Returns:
+            list: Ids of the shards this worker finished.
+        '''
+        while True:
+            shard = self.claim()
+            if shard is None:
+                if not self.remaining():
+                    return self.completed
+                time.sleep(self.poll_interval)
+                continue
+            shard_id = shard['shard_id']
+            links = [f'{scraper.base_url}{x}' for x in shard_dates(
+                shard['first_date'], shard['last_date'])]
+            stop = threading.Event()
+            lost = threading.Event()
+            heartbeat = threading.Thread(
+                target=self._heartbeat, args=(shard_id, stop, lost),
+                daemon=True)
+            heartbeat.start()
+            scraper.before_date = functools.partial(
+                self._check_lease, shard_id, lost)
+            scraper.failed_dates = []
+            try:
+                scraper.scrape_dates(links, db, bucket, **kwargs)
+            except Exception as e:
+                print(f'Failed to scrape shard {shard_id}: {e!r}')
+                self.release(shard_id)
+                continue
+            except BaseException:
+                self.release(shard_id)
+                raise
+            finally:
+                stop.set()
+                heartbeat.join()
+                failed = scraper.failed_dates
+                scraper.before_date = scraper.failed_dates = None
+            if failed:
+                print(f'Releasing shard {shard_id}, '
+                      f'{len(failed)} dates failed')
+                self.release(shard_id)
+            elif self.complete(shard_id):
+                self.completed.append(shard_id)
+
+    def _check_lease(self, shard_id: str, lost: threading.Event,
+                     link: str) -> bool:
+        '''Renew the lease on a shard before one of its dates.'''
+        if lost.is_set() or not self.renew(shard_id):
+            lost.set()
+            print(f'Lost lease on shard {shard_id}')
+            return False
+        return True
+
+    def _heartbeat(self, shard_id: str, stop: threading.Event,
+                   lost: threading.Event) -> None:
+        while not stop.wait(self.lease_seconds / 3):
+            if not self.renew(shard_id):
+                lost.set()
+                return
+
+    def _update(self, shard_id: str, **values) -> bool:
+        '''Update a shard leased by this worker.
+
+        Returns:
+            bool: True if this worker held the lease.
+        '''
+        with self.engine.begin() as conn:
+            result = conn.execute(
+                update(shard_table).where(
+                    shard_table.c.shard_id == shard_id,
+                    shard_table.c.owner == self.worker_id,
+                    shard_table.c.status == 'leased'
+                    ).values(**values))
+        return result.rowcount == 1
+
+
+def link_date(link: str) -> str:
+    '''RaceDate of a results page URL, as YYYY/MM/DD.'''
+    return parse_qs(urlsplit(link).query)['RaceDate'][0]
+
+
+def shard_dates(first: str, last: str) -> list:
+    '''Every date from first to last, in either direction.
+
+    Args:
+        first (str): First date, as YYYY/MM/DD.
+        last (str): Last date, as YYYY/MM/DD.
+
+    Returns:
+        list (str): The dates, as YYYY/MM/DD.
+    '''
+    first = datetime.datetime.strptime(first, DATE_FORMAT)
+    last = datetime.datetime.strptime(last, DATE_FORMAT)
+    step = datetime.timedelta(days=1 if last >= first else -1)
+    days = abs((last - first).days)
+    return [(first + step * x).strftime(DATE_FORMAT)
+            for x in range(days + 1)]
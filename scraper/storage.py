@@ -0,0 +1,342 @@
+'''Storage Module
+
+This module contains the sinks scraped races are written to: a local
+folder, an SQL database (SQLite or PostgreSQL) and an S3 compatible
+bucket. Every sink buffers races and writes them in batches behind the
+same interface, and the sinks of a deployment are chosen in the
+[STORAGE] section of config.ini, so the pipeline can run on a single
+machine without AWS.
+
+config.ini:
+
+    [STORAGE]
+    SINKS = sqlite, local
+    BATCH_SIZE = 50
+    SQLITE_PATH = raw_data/races.db
+    LOCAL_PATH = raw_data/store
+    S3_ENDPOINT_URL = http://localhost:9000
+'''
+
+from uploader import RAW_DATA_PATH
+import threading
+import shutil
+import json
+import abc
+import os
+
+SINKS = ('rds', 'sqlite', 's3', 'local')
+
+
+class Sink(abc.ABC):
+    '''Sink Class
+
+    Abstract base class of the storage sinks. Races are buffered by add,
+    and the buffer is passed to write once batch_size races are waiting,
+    or when flush is called.
+
+    Example usage:
+
+        sink = SQLSink(db, batch_size=50)
+        sink.add(race)
+        sink.close()
+    '''
+
+    name = None
+
+    def __init__(self, batch_size: int = 1):
+        '''Initialises Sink
+
+        Args:
+            batch_size (int): Number of races buffered before a write.
+
+        Parameters:
+            written (int): Number of races written.
+        '''
+        self.batch_size = batch_size
+        self.races = []
+        self.written = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> 'Sink':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def add(self, race: dict) -> None:
+        '''Add a race to the buffer, writing the buffer once it is full.
+
+        Args:
+            race (dict): A scraped race, with its runners under 'runners'.
+        '''
+        with self.lock:
+            self.races.append(race)
+            full = len(self.races) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        '''Write every buffered race.
+
+        Returns:
+            int: The number of races written.
+        '''
+        with self.lock:
+            races, self.races = self.races, []
+        return self.put(races)
+
+    def put(self, races: list) -> int:
+        '''Write races straight away, past the buffer.
+
+        Args:
+            races (list): Scraped races.
+
+        Returns:
+            int: The number of races written.
+        '''
+        if not races:
+            return 0
+        written = self.write(races)
+        with self.lock:
+            self.written += written
+        return written
+
+    @abc.abstractmethod
+    def write(self, races: list) -> int:
+        '''Write a batch of races to the sink.
+
+        Args:
+            races (list): Scraped races.
+
+        Returns:
+            int: The number of races written.
+        '''
+
+    def close(self) -> None:
+        self.flush()
+
+
+class SQLSink(Sink):
+    '''SQLSink Class
+
+    Writes races to the race and runner tables of any database supported
+    by _connect_to_rds, in one transaction per batch. Races already in
+    the race table are skipped, and are not counted as written.
+    '''
+
+    name = 'sql'
+
+    def __init__(self, db: dict, batch_size: int = 50):
+        '''Initialises SQLSink
+
+        Args:
+            db (dict): Parameters used in building an SQLAlchemy Engine.
+            batch_size (int): Number of races written per transaction.
+        '''
+        super().__init__(batch_size)
+        self.db = db
+
+    def write(self, races: list) -> int:
+        from bulk_loader import BulkLoader
+        loader = BulkLoader(self.db, batch_size=len(races))
+        for race in races:
+            loader.add(race)
+        loader.flush()
+        return loader.inserted
+
+
+class FolderSink(Sink):
+    '''FolderSink Class
+
+    Base class of the sinks that store whole race folders, the JSON and
+    the photo finish, read from the data folder.
+    '''
+
+    def __init__(self, raw_data_path: str = RAW_DATA_PATH,
+                 batch_size: int = 1):
+        '''Initialises FolderSink
+
+        Args:
+            raw_data_path (str): Location of data folder.
+            batch_size (int): Number of races buffered before a write.
+        '''
+        super().__init__(batch_size)
+        self.raw_data_path = raw_data_path
+
+    def _ids(self, races: list) -> list:
+        '''The ids of the races whose folder exists.'''
+        ids = []
+        for race in races:
+            if os.path.isdir(os.path.join(self.raw_data_path,
+                                          race['race_id'])):
+                ids.append(race['race_id'])
+            else:
+                print(f"Id not found: {race['race_id']}")
+        return ids
+
+
+class S3Sink(FolderSink):
+    '''S3Sink Class
+
+    Uploads race folders to a bucket of AWS S3, or of any S3 compatible
+    service such as MinIO. The folders of a batch are uploaded
+    concurrently, and files already in the bucket are skipped.
+    '''
+
+    name = 's3'
+
+    def __init__(self, bucket: str, raw_data_path: str = RAW_DATA_PATH,
+                 batch_size: int = 1, endpoint_url: str = None):
+        '''Initialises S3Sink
+
+        Args:
+            bucket (str): The name of the S3 bucket.
+            raw_data_path (str): Location of data folder.
+            batch_size (int): Number of races buffered before a write.
+            endpoint_url (str): URL of an S3 compatible service, defaults
+                to AWS or the S3_ENDPOINT_URL environment variable.
+        '''
+        super().__init__(raw_data_path, batch_size)
+        from s3_uploader import S3Uploader
+        self.uploader = S3Uploader(bucket, raw_data_path,
+                                   endpoint_url=endpoint_url)
+
+    def write(self, races: list) -> int:
+        ids = self._ids(races)
+        for id in ids:
+            self.uploader.submit(id)
+        self.uploader.wait()
+        return len(ids)
+
+
+class LocalSink(FolderSink):
+    '''LocalSink Class
+
+    Copies race folders to another folder on disk, laid out as in the
+    bucket: one file per key, named <id>.json and <id>.jpg.
+    '''
+
+    name = 'local'
+
+    def __init__(self, path: str, raw_data_path: str = RAW_DATA_PATH,
+                 batch_size: int = 1):
+        '''Initialises LocalSink
+
+        Args:
+            path (str): Folder the files are copied to.
+            raw_data_path (str): Location of data folder.
+            batch_size (int): Number of races buffered before a write.
+        '''
+        super().__init__(raw_data_path, batch_size)
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path, exist_ok=True)
+
+    def write(self, races: list) -> int:
+        ids = self._ids(races)
+        for id in ids:
+            folder = os.path.join(self.raw_data_path, id)
+            for name in sorted(os.listdir(folder)):
+                target = os.path.join(self.path, name)
+                shutil.copyfile(os.path.join(folder, name), f'{target}.tmp')
+                os.replace(f'{target}.tmp', target)
+        return len(ids)
+
+
+class Storage(object):
+    '''Storage Class
+
+    Writes each race to every configured sink.
+
+    Example usage:
+
+        with storage_from_config(config) as storage:
+            storage.add(race)
+    '''
+
+    def __init__(self, sinks: list):
+        '''Initialises Storage
+
+        Args:
+            sinks (list): The Sinks races are written to.
+        '''
+        self.sinks = sinks
+
+    def __enter__(self) -> 'Storage':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def add(self, race: dict) -> None:
+        for sink in self.sinks:
+            sink.add(race)
+
+    def put(self, race: dict) -> None:
+        '''Write a race to every sink before returning, unbuffered.'''
+        for sink in self.sinks:
+            sink.put([race])
+
+    def flush(self) -> None:
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.close()
+
+
+def storage_from_config(config, raw_data_path: str = RAW_DATA_PATH,
+                        batch_size: int = None) -> Storage:
+    '''Build the sinks listed in the [STORAGE] section of a config.
+
+    SINKS is a comma separated list of:
+
+        rds: The database of the [RDS] section.
+        sqlite: An SQLite file at SQLITE_PATH.
+        s3: The bucket of the [S3] section, at S3_ENDPOINT_URL if set.
+        local: A folder at LOCAL_PATH.
+
+    Without a [STORAGE] section or SINKS, races go to the RDS and S3.
+    Empty settings take their defaults.
+
+    Args:
+        config (ConfigParser): The parsed config.ini.
+        raw_data_path (str): Location of data folder.
+        batch_size (int): Number of races buffered before a write,
+            overriding BATCH_SIZE.
+
+    Returns:
+        Storage: The configured sinks.
+    '''
+    section = config['STORAGE'] if config.has_section('STORAGE') else {}
+    names = [x.strip().lower()
+             for x in (section.get('SINKS') or 'rds, s3').split(',')]
+    batch_size = batch_size or int(section.get('BATCH_SIZE') or 1)
+    sinks = []
+    for name in filter(None, names):
+        if name == 'rds':
+            sinks.append(SQLSink(config['RDS'], batch_size))
+        elif name == 'sqlite':
+            path = section.get('SQLITE_PATH') or os.path.join(
+                raw_data_path, 'races.db')
+            sinks.append(SQLSink(
+                {'DATABASE_TYPE': 'sqlite', 'DATABASE': path}, batch_size))
+        elif name == 's3':
+            sinks.append(S3Sink(
+                config['S3']['BUCKET'], raw_data_path, batch_size,
+                section.get('S3_ENDPOINT_URL') or None))
+        elif name == 'local':
+            path = section.get('LOCAL_PATH') or os.path.join(
+                raw_data_path, 'store')
+            sinks.append(LocalSink(path, raw_data_path, batch_size))
+        else:
+            raise ValueError(f'Unknown sink: {name}, expected one of '
+                             f"{', '.join(SINKS)}")
+    return Storage(sinks)
+
+
+def load_race(raw_data_path: str, id: str) -> dict:
+    '''Read a saved race back from the data folder.'''
+    with open(os.path.join(raw_data_path, id, f'{id}.json'), 'r') as f:
+        return json.load(f)
@@ -4,84 +4,170 @@ This module contains functions used to upload data to aws services, and to
 retrieve a list of previously scraped urls.
 '''
 
-import boto3
-from botocore.exceptions import ClientError
+from records import runners_from_json
+from metrics import DB_SECONDS, INTEGRITY_ERRORS
 from sqlalchemy import Integer, create_engine, Table, Column
-from sqlalchemy import String, MetaData
+from sqlalchemy import String, Float, MetaData, SmallInteger
 from sqlalchemy.engine.base import Connection, Engine
 from sqlalchemy.exc import IntegrityError
-import pandas as pd
+import threading
 import json
 import os
 
-
-def upload_to_bucket_by_id(id: str, bucket: str) -> bool:
+RAW_DATA_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '../raw_data/')
+
+metadata = MetaData()
+
+# The data for each race.
+race_table = Table(
+    'race', metadata,
+    Column('uuid', String, nullable=False),
+    Column('race_id', String, primary_key=True,
+           nullable=False, unique=True),
+    Column('date', String, nullable=False),
+    Column('race_number', Integer, nullable=False),
+    Column('class', String, nullable=False),
+    Column('length', Integer, nullable=False),
+    Column('going', String, nullable=False),
+    Column('course', String, nullable=False),
+    Column('prize', Integer, nullable=False),
+    Column('pace', String, nullable=False),
+    Column('url', String, nullable=False),
+    Column('image_link', String, nullable=False)
+)
+
+# A horses participation in an event.
+runner_table = Table(
+    'runner', metadata,
+    Column('uuid', String, unique=True),
+    Column('race_id', String, primary_key=True, nullable=False),
+    Column('horse_id', String, primary_key=True, nullable=False),
+    Column('place', String),
+    Column('number', SmallInteger),
+    Column('name', String, nullable=False),
+    Column('jockey', String, nullable=False),
+    Column('trainer', String, nullable=False),
+    Column('actual_weight', SmallInteger),
+    Column('declared_weight', SmallInteger),
+    Column('draw', SmallInteger),
+    Column('length_behind_winner', String, nullable=False),
+    Column('running_positions', String, nullable=False),
+    Column('finish_time', Integer),
+    Column('win_odds', Float),
+    Column('url', String, nullable=False)
+)
+
+# The profile of each horse, fetched from the url of its runners.
+horse_table = Table(
+    'horse', metadata,
+    Column('horse_id', String, primary_key=True),
+    Column('name', String),
+    Column('url', String, nullable=False),
+    Column('profile', String, nullable=False),
+    Column('fetched_at', Float, nullable=False)
+)
+
+# Urls with no event on that date.
+no_event_table = Table(
+    'no_event', metadata,
+    Column('url', String, primary_key=True)
+)
+
+# Ranges of dates leased to scraper workers.
+shard_table = Table(
+    'shard', metadata,
+    Column('shard_id', String, primary_key=True),
+    Column('first_date', String, nullable=False),
+    Column('last_date', String, nullable=False),
+    Column('status', String, nullable=False),
+    Column('owner', String),
+    Column('lease_expires', Float),
+    Column('attempts', Integer, nullable=False)
+)
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def upload_to_bucket_by_id(id: str, bucket: str,
+                           raw_data_path: str = None) -> bool:
     '''Uploads a folder to a AWS Bucket
 
     Takes a given sample ID and searches for its corrasponding data folder,
-    then uploades its contents to a AWS S3 Bucket.
+    then uploades all of its contents to a AWS S3 Bucket. Files are sent
+    concurrently on a shared client, and files already in the bucket
+    with the same content are skipped.
 
     Args:
         id: The id of a race to upload
         bucket: The name of the targeted S3 bucket.
+        raw_data_path: Location of data folder, defaulting to
+            RAW_DATA_PATH.
 
     Returns:
         bool: True if upload was successful. False otherwise.
     '''
-    s3_client = boto3.client('s3')
-    folder = os.path.join(
-            os.path.dirname(os.path.abspath(__file__)), f'../raw_data/{id}')
-    for x in os.listdir(folder):
-        if x.startswith(id):
-            try:
-                s3_client.upload_file(
-                    os.path.join(folder, x),
-                    bucket,
-                    os.path.split(x)[1]
-                )
-                return True
-            except ClientError:
-                raise
-    print('Id not found.')
-    return False
-
-
-def upload_to_rds_by_id(id: str, db: dict) -> bool:
+    raw_data_path = raw_data_path or RAW_DATA_PATH
+    if not os.path.isdir(os.path.join(raw_data_path, id)):
+        print('Id not found.')
+        return False
+    from s3_uploader import s3_uploader
+    s3_uploader(bucket, raw_data_path).upload_folder(id)
+    return True
+
+
+def upload_to_rds_by_id(id: str, db: dict,
+                        raw_data_path: str = None) -> bool:
     '''Uploads JSON file to AWS RDS
 
     Takes a given sample ID and searches for its corrasponding data folder,
-    then uploads its contents race and runner tables.
+    then uploads its contents race and runner tables. The race and its
+    runners are written in a single transaction on a pooled connection.
 
     Args:
         id: The id of a race to upload
         db: Dict containing parameters used in building SQLAlchemy Engine.
+        raw_data_path: Location of data folder, defaulting to
+            RAW_DATA_PATH.
     '''
     engine = _connect_to_rds(db)
-    folder = os.path.join(
-            os.path.dirname(os.path.abspath(__file__)), f'../raw_data/{id}')
+    folder = os.path.join(raw_data_path or RAW_DATA_PATH, id)
     for x in os.listdir(folder):
         if x.endswith('.json'):
             with open(os.path.join(folder, x), 'r') as f:
                 data = json.load(f)
+            with DB_SECONDS.time(), engine.begin() as conn:
                 _race_insert(
-                    engine,
+                    conn,
                     {i: data[i] for i in data if i != 'runners'}
                     )
-                _runner_insert(engine, data.pop('runners'))
+                _runner_insert(conn, data.pop('runners'))
     return True
 
 
-def upload_folder_to_rds(db: dict) -> None:
+def upload_folder_to_rds(db: dict, batch_size: int = 500) -> int:
     '''Uploades all JSON files to RDS.
 
+    Reads every race in the data folder and bulk loads them in batches,
+    skipping races that are already in the race table.
+
     Args:
         db: Dict containing parameters used in building SQLAlchemy Engine.
+        batch_size: Number of races written per transaction.
+
+    Returns:
+        int: The number of new races written.
     '''
-    folder = os.path.join(
-            os.path.dirname(os.path.abspath(__file__)), '../raw_data/')
-    for x in os.listdir(folder):
-        upload_to_bucket_by_id(x, db)
-    return
+    from bulk_loader import BulkLoader
+    with BulkLoader(db, batch_size) as loader:
+        for id in sorted(os.listdir(RAW_DATA_PATH)):
+            path = os.path.join(RAW_DATA_PATH, id, f'{id}.json')
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r') as f:
+                loader.add(json.load(f))
+    return loader.inserted
 
 
 def get_retrieved_urls(db: dict) -> list:
@@ -93,12 +179,10 @@ def get_retrieved_urls(db: dict) -> list:
         db (dict): Dict containing parameters used in building an
             SQLAlchemy Engine.
     '''
+    import pandas as pd
     engine = _connect_to_rds(db)
-    if 'race' not in engine.table_names():
-        _create_race_table(engine)
-    con = engine.connect()
-    race_urls = pd.read_sql('SELECT url FROM race', con)
-    con.close()
+    with engine.connect() as con:
+        race_urls = pd.read_sql('SELECT url FROM race', con)
     return race_urls.values.reshape(-1).tolist()
 
 
@@ -111,12 +195,10 @@ def get_no_event_urls(db: dict) -> list:
         db (dict): Dict containing parameters used in building an
             SQLAlchemy Engine.
     '''
+    import pandas as pd
     engine = _connect_to_rds(db)
-    if 'no_event' not in engine.table_names():
-        _create_no_event_table(engine)
-    con = engine.connect()
-    no_event_urls = pd.read_sql('SELECT url FROM no_event', con)
-    con.close()
+    with engine.connect() as con:
+        no_event_urls = pd.read_sql('SELECT url FROM no_event', con)
     return no_event_urls.values.reshape(-1).tolist()
 
 
@@ -128,68 +210,50 @@ def no_event_insert(db: dict, url: str) -> None:
             SQLAlchemy Engine.
     '''
     engine = _connect_to_rds(db)
-    if 'no_event' not in engine.table_names():
-        _create_no_event_table(engine)
-    url_dataframe = pd.DataFrame.from_dict({'url': [url]})
-    conn = engine.connect()
     try:
-        url_dataframe.to_sql(
-            'no_event', conn, if_exists='append', index=False
-            )
+        with DB_SECONDS.time(), engine.begin() as conn:
+            conn.execute(no_event_table.insert(), {'url': url})
     except IntegrityError as e:
+        INTEGRITY_ERRORS.inc()
         print(e)
-    conn.close()
 
 
-def _race_insert(engine: Engine, race: dict) -> None:
+def _race_insert(conn: Connection, race: dict) -> None:
     '''Insert rows to race table
 
-    Creates the race table if none exists, then inserts a row.
-
     Params:
-        engine (Engine): SQLAlchemy Engine to connect to the RDS.
-        race (dict): A dictionary of all the runners in a given race.
+        conn (Connection): SQLAlchemy connection to the RDS.
+        race (dict): A dictionary of the details of a race.
     '''
-    if 'race' not in engine.table_names():
-        _create_race_table(engine)
-    race = {x: [y] for x, y in race.items()}
-    race_dataframe = pd.DataFrame.from_dict(race)
-    conn = engine.connect()
     try:
-        race_dataframe.to_sql(
-            'race', conn, if_exists='append', index=False
-            )
+        conn.execute(race_table.insert(), race)
     except IntegrityError:
+        INTEGRITY_ERRORS.inc()
         raise
-    conn.close()
 
 
-def _runner_insert(engine: Engine, runners: dict) -> None:
+def _runner_insert(conn: Connection, runners: dict) -> None:
     '''Insert rows to runner table
 
-    Creates the runner table if none exists, then inserts rows.
-
     Params:
-        engine (Engine): SQLAlchemy Engine to connect to the RDS.
+        conn (Connection): SQLAlchemy connection to the RDS.
         runners (dict): A dictionary of all the runners in a given race.
     '''
-    if 'runner' not in engine.table_names():
-        _create_runner_table(engine)
-    runners_dataframe = pd.DataFrame().from_dict(runners)
-    conn = engine.connect()
+    rows = [x.row() for x in runners_from_json(runners)]
     try:
-        runners_dataframe.to_sql(
-            'runner', conn, if_exists='append', index=False
-            )
+        conn.execute(runner_table.insert(), rows)
     except IntegrityError:
+        INTEGRITY_ERRORS.inc()
         raise
-    conn.close()
 
 
 def _connect_to_rds(db: dict) -> Engine:
-    '''Create SQLALchemy Engine
+    '''Get the shared SQLALchemy Engine
 
-    Creates an Engine from a dictionary.
+    Engines are created once per process for each database, and reused
+    by every later call with the same parameters. Missing tables are
+    created when the engine is first built, so the schema is only
+    inspected once.
 
     Args:
         db (dict): A dictionary parsed from the config file
@@ -197,84 +261,28 @@ def _connect_to_rds(db: dict) -> Engine:
     Returns:
         Engine: SQLAlchemy Engine to connect to the RDS.
     '''
-    engine = create_engine(
-        f"{db['DATABASE_TYPE']}+{db['DBAPI']}://{db['USER']}"
-        f":{db['PASSWORD']}@{db['ENDPOINT']}:{db['PORT']}"
-        f"/{db['DATABASE']}"
-        )
-    return engine
+    url = _database_url(db)
+    with _engines_lock:
+        if url not in _engines:
+            engine = create_engine(url, pool_pre_ping=True)
+            metadata.create_all(engine, checkfirst=True)
+            _engines[url] = engine
+        return _engines[url]
 
 
-def _create_race_table(conn: Connection):
-    ''' Create race table if none exists.
+def _database_url(db: dict) -> str:
+    '''Build a database URL from the config file parameters.
 
-    Table used to store the data for each race.
+    For SQLite only DATABASE is used, as the path to the database file.
 
     Args:
-        conn (Connection): SQLAlchemy connection to the RDS.
-    '''
-    meta = MetaData()
-    Table(
-        'race', meta,
-        Column('uuid', String, nullable=False),
-        Column('race_id', String, primary_key=True,
-               nullable=False, unique=True),
-        Column('date', String, nullable=False),
-        Column('race_number', Integer, nullable=False),
-        Column('class', String, nullable=False),
-        Column('length', Integer, nullable=False),
-        Column('going', String, nullable=False),
-        Column('course', String, nullable=False),
-        Column('prize', Integer, nullable=False),
-        Column('pace', String, nullable=False),
-        Column('url', String, nullable=False),
-        Column('image_link', String, nullable=False)
-    )
-    meta.create_all(conn)
-
-
-def _create_runner_table(conn: Connection) -> None:
-    ''' Create runner table if none exists.
-
-    Table used to store a horses participation in an event.
-
-    Args:
-        conn (Connection): SQLAlchemy connection to the RDS.
-    '''
-    meta = MetaData()
-    Table(
-        'runner', meta,
-        Column('uuid', String, unique=True),
-        Column('race_id', String, primary_key=True, nullable=False),
-        Column('horse_id', String, primary_key=True, nullable=False),
-        Column('place', String),
-        Column('number', String),
-        Column('name', String, nullable=False),
-        Column('jockey', String, nullable=False),
-        Column('trainer', String, nullable=False),
-        Column('actual_weight', String, nullable=False),
-        Column('declared_weight', String, nullable=False),
-        Column('draw', String, nullable=False),
-        Column('length_behind_winner', String, nullable=False),
-        Column('running_positions', String, nullable=False),
-        Column('finish_time', String, nullable=False),
-        Column('win_odds', String, nullable=False),
-        Column('url', String, nullable=False)
-    )
-    meta.create_all(conn)
-
-
-def _create_no_event_table(conn: Connection) -> None:
-    ''' Create no_event table if none exists.
-
-    Table used to list urls with no event on that date.
-
-    Args:
-        conn (Connection): SQLAlchemy connection to the RDS.
+        db (dict): A dictionary parsed from the config file
+            with parameters for the RDS.
+    Returns:
+        str: The SQLAlchemy database URL.
     '''
-    meta = MetaData()
-    Table(
-        'no_event', meta,
-        Column('url', String, primary_key=True)
-    )
-    meta.create_all(conn)
+    if db['DATABASE_TYPE'] == 'sqlite':
+        return f"sqlite:///{db['DATABASE']}"
+    return (f"{db['DATABASE_TYPE']}+{db['DBAPI']}://{db['USER']}"
+            f":{db['PASSWORD']}@{db['ENDPOINT']}:{db['PORT']}"
+            f"/{db['DATABASE']}")
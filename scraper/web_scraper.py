@@ -1,25 +1,40 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
-from webdriver_manager.chrome import ChromeDriverManager
-import numpy as np
+from selenium.webdriver.support.ui import WebDriverWait
+from driver_pool import DriverPool, chrome_driver
+from http_driver import HttpDriver, PageLoadError
+from page_parser import PageParser, READY_XPATH
+from bulk_loader import BulkLoader
+from dedup_index import DedupIndex
+from work_queue import WorkQueue, UploadWorkers
+from checkpoint import RunState
+from page_cache import PageCache
+from image_fetcher import ImageFetcher
+from rate_limiter import RateLimiter
+from storage import load_race
+from metrics import (
+                    FETCH_SECONDS, PARSE_SECONDS, SAVE_SECONDS,
+                    PAGES, RACES, RETRIES, NO_EVENTS, SLEEP_SECONDS
+                    )
+from concurrent.futures import Future
+import collections
+import functools
 import time
 import datetime
 import os
 import json
-import urllib
-import urllib.request
-import urllib.error
-from uuid import uuid4
 from uploader import (
                     no_event_insert,
                     upload_to_bucket_by_id,
-                    upload_to_rds_by_id,
-                    get_retrieved_urls,
-                    get_no_event_urls
+                    upload_to_rds_by_id
                     )
 
+BASE_URL = ('https://racing.hkjc.com/racing/information/'
+            'English/Racing/LocalResults.aspx?RaceDate=')
+# Page loads kept in page_latency, so a long running scraper does not
+# grow without bound.
+LATENCY_SAMPLES = 10000
+
 
 class Scraper(object):
     '''Scraper Class
@@ -28,6 +43,39 @@ class Scraper(object):
     for all race results across a range of dates, and store the raw data
     locally.
 
+    Pages are loaded with a headless Chrome webdriver by default. Passing
+    backend='http' fetches them over a pooled HTTP session and parses them
+    with lxml instead, which avoids launching a browser.
+
+    After each page load the scraper waits until the results table, the
+    error container or the abandoned race notice is present, rather than
+    for a fixed time, and records how long the page took to become ready
+    in page_latency.
+
+    Setting queue_path hands uploads to background UploadWorkers through
+    a durable WorkQueue, so scraping does not wait on the RDS or S3, and
+    races left unacknowledged by a crash are uploaded on the next run.
+
+    Setting checkpoint_path records the status of every date and race of
+    a run, and scrape_dates(..., resume=True) then continues the last run
+    without fetching the pages it had already finished.
+
+    Every request, for pages, races and images alike, waits on a shared
+    RateLimiter, which adapts the request rate to the site, backs off
+    after failures and stops the run if the site stays unhealthy.
+
+    Setting planner to a CalendarPlanner scrapes the dates likely to
+    hold a meeting first, probes the unlikely ones together over plain
+    HTTP, and skips those known to have no meeting.
+
+    Setting horses to a HorseCrawler fetches the profiles of the horses
+    in the runner table in the background while dates are scraped,
+    sharing the scraper's RateLimiter.
+
+    Setting cache_path keeps a compressed copy of every results page.
+    The http backend revalidates cached pages with conditional requests,
+    and the cached pages can be parsed again without the site.
+
     Example usage:
 
         scraper = Scraper()
@@ -39,27 +87,124 @@ class Scraper(object):
         )
     '''
 
-    def __init__(self):
+    def __init__(self, backend: str = 'selenium', pool_size: int = 1,
+                 batch_size: int = 1, queue_path: str = None,
+                 upload_workers: int = 4, cache_path: str = None,
+                 image_workers: int = 4, thumbnail: int = None,
+                 limiter: RateLimiter = None):
         '''Initialises Scraper
 
+        Args:
+            backend (str): 'selenium' to load pages in Google Chrome, or
+                'http' to fetch and parse them without a browser.
+            pool_size (int): Number of additional drivers used to scrape
+                the races of a day in parallel. 1 scrapes them one after
+                another with the main driver.
+            batch_size (int): Number of races buffered and written to the
+                RDS together. 1 writes each race as it is scraped.
+            queue_path (str): Optional SQLite file for the upload queue.
+                None uploads each race as it is scraped.
+            upload_workers (int): Number of uploader threads used with
+                the upload queue.
+            cache_path (str): Optional folder for the page cache.
+            image_workers (int): Number of threads downloading photo
+                finishes while pages are scraped.
+            thumbnail (int): Optional longest side, in pixels, of a
+                thumbnail saved next to each photo finish. Requires
+                Pillow.
+            limiter (RateLimiter): Scheduler shared by every request.
+                Defaults to one that starts unthrottled.
+
         Parameters:
-            driver (webdriver): Google Chrome webdriver.
-            retrieved_urls (list): A list of URLs that has been
-                previously scraped.
+            driver (webdriver | HttpDriver): Driver used to load pages.
+            pool (DriverPool): Drivers shared by race scraping threads,
+                or None when pool_size is 1.
+            parser (PageParser): Extracts data from the loaded page.
+            loader (BulkLoader): Buffers races for the RDS while
+                scrape_dates runs with a batch_size above 1.
+            index (DedupIndex): Scraped and no event URLs, kept between
+                calls to scrape_dates.
+            cards (dict): URLs of every race on the card of each date
+                loaded, kept between calls to scrape_dates.
+            dedup_path (str): Optional file the index is persisted to.
+            queue (WorkQueue): Races waiting to be uploaded while
+                scrape_dates runs with a queue_path.
+            checkpoint_path (str): Optional file the run state is kept in.
+            state (RunState): Status of each date and race while
+                scrape_dates runs with a checkpoint_path.
+            cache (PageCache): Cached results pages, or None.
+            images (ImageFetcher): Downloads the photo finishes.
+            limiter (RateLimiter): Scheduler shared by every request.
+            parquet_path (str): Optional folder of Parquet datasets that
+                races are also appended to. Requires pyarrow.
+            parquet (ParquetStore): Buffers races for the Parquet
+                datasets while scrape_dates runs with a parquet_path.
+            storage (Storage): Optional sinks races are written to in
+                place of the RDS and bucket given to scrape_dates.
+            planner (CalendarPlanner): Optional planner ordering and
+                filtering the dates given to scrape_dates.
+            horses (HorseCrawler): Optional crawler of horse profiles
+                run alongside scrape_dates.
+            before_date (callable): Optional check given the link of
+                each date before it is scraped. scrape_dates stops once
+                it returns False.
+            failed_dates (list): Optional list that dates whose scrape
+                raises are appended to. When set, such dates are reported
+                and skipped, instead of ending scrape_dates.
             raw_data_path (str): Location of data folder.
+            timeout (int): Seconds to wait for a page to become ready.
+            retries (int): Attempts at loading a page before giving up.
+            page_latency (deque): (url, seconds) for the latest
+                LATENCY_SAMPLES pages loaded.
+            base_url (str): Prefix of every results page URL.
         '''
-        s = Service(ChromeDriverManager().install())
-        chrome_options = Options()
-        chrome_options.headless = True
-        chrome_options.add_argument('--no-sandbox')
-        chrome_options.add_argument('--disable-dev-shm-usage')
-        self.driver = webdriver.Chrome(service=s, options=chrome_options)
-        self.driver.find_elements()
+        self.cache = None
+        if cache_path is not None:
+            self.cache = PageCache(cache_path)
+        self.limiter = limiter or RateLimiter()
+        if backend == 'selenium':
+            factory = chrome_driver
+        elif backend == 'http':
+            factory = functools.partial(
+                HttpDriver, cache=self.cache, limiter=self.limiter)
+        else:
+            raise ValueError(f'Unknown backend: {backend}')
+        self.driver = factory()
+        self.pool = None
+        if pool_size > 1:
+            self.pool = DriverPool(size=pool_size, factory=factory).start()
+        self.backend = backend
+        self.batch_size = batch_size
+        self.loader = None
+        self.index = None
+        self.cards = {}
+        self.unfinished = []
+        self.dedup_path = None
+        self.queue_path = queue_path
+        self.upload_workers = upload_workers
+        self.queue = None
+        self.checkpoint_path = None
+        self.state = None
+        self.parquet_path = None
+        self.parquet = None
+        self.storage = None
+        self.planner = None
+        self.horses = None
+        self.before_date = None
+        self.failed_dates = None
+        self.images = ImageFetcher(workers=image_workers,
+                                   thumbnail=thumbnail,
+                                   limiter=self.limiter)
+        self.parser = PageParser(self.driver)
         self.raw_data_path = os.path.join(
             os.path.dirname(os.path.abspath(__file__)), '../raw_data/')
-        self.sleep_time = 3
+        self.base_url = BASE_URL
+        self.timeout = 10
+        self.retries = 3
+        self.page_latency = collections.deque(maxlen=LATENCY_SAMPLES)
 
-    def scrape_dates(self, links: list, db: dict, bucket: str) -> None:
+    def scrape_dates(self, links: list, db: dict, bucket: str,
+                     concurrency: int = 1, resume: bool = False) -> None:
         '''Scrapes website for along a list of dates.
 
         Iterates throuch a list of urls, created from dates, and
@@ -68,11 +213,17 @@ class Scraper(object):
         loaded and scraped. Once all of the races on a day have been
         scraped, the next days result page will be loaded.
 
+        With a concurrency greater than 1 the dates are instead crawled
+        by an AsyncCrawler, which fetches that many pages at once.
+
         Args:
             links (list): a list of urls to the first race of a day.
             db (dict): Dict containing parameters used in building an
                 SQLAlchemy Engine.
             bucket (str): The name of the S3 bucket.
+            concurrency (int): Maximum number of pages fetched at once.
+            resume (bool): Continue the run recorded at checkpoint_path,
+                in place of the given links.
 
         db keys:
             USER: Username
@@ -84,43 +235,234 @@ class Scraper(object):
             DBAPI: Database API (psycopg2)
         '''
         try:
-            base_url = ('https://racing.hkjc.com/racing/information/'
-                        'English/Racing/LocalResults.aspx?RaceDate=')
-            if not all([url.startswith(base_url) for url in links]):
+            if not all([url.startswith(self.base_url) for url in links]):
                 raise ValueError('Invalid URL found.')
         except ValueError as e:
             print(e)
             raise
-        retrieved_urls = get_retrieved_urls(db)
-        no_event_urls = get_no_event_urls(db)
-        for link in links:
-            if link in no_event_urls:
-                print(f'No Event on {link}')
-                continue
-            self.driver.get(link)
-            time.sleep(self.sleep_time)
-            if self._if_event(link):
-                print(f'No Event on {link}')
-                no_event_insert(db, link)
-                continue
-            card_races = self._get_card_races()
-            if link not in retrieved_urls:
-                self._scrape_page(db, bucket)
+        if self.planner is not None and not resume:
+            links = self._plan_dates(links, db)
+        if self.horses is not None:
+            self.horses.start()
+        try:
+            self._scrape_checkpointed(links, db, bucket, concurrency, resume)
+        finally:
+            if self.horses is not None:
+                self.horses.stop()
+
+    def _scrape_checkpointed(self, links: list, db: dict, bucket: str,
+                             concurrency: int, resume: bool) -> None:
+        if self.checkpoint_path is not None:
+            self.state = RunState(self.checkpoint_path)
+            links = self.state.start(links, resume)
+            try:
+                self._scrape_queued(links, db, bucket, concurrency)
+            finally:
+                print(f'Run state: {self.state.counts()}')
+                self.state.close()
+                self.state = None
+            return
+        self._scrape_queued(links, db, bucket, concurrency)
+
+    def _plan_dates(self, links: list, db: dict) -> list:
+        '''Order dates with the planner, probing the unlikely ones.
+
+        Dates a probe finds without a meeting are written to the
+        no_event table together, and dropped with the skipped dates.
+
+        Args:
+            links (list): a list of urls to the first race of a day.
+            db (dict): Parameters used in building an SQLAlchemy Engine.
+
+        Returns:
+            list: The links to scrape, likely meeting days first.
+        '''
+        self.planner.learn(db)
+        plan = self.planner.plan(links)
+        meetings = self.planner.probe(plan.unlikely, self.limiter)
+        no_events = [x for x in plan.unlikely if x not in meetings]
+        if no_events:
+            BulkLoader(db).add_no_events(no_events)
+            NO_EVENTS.inc(len(no_events))
+        print(f'Planned {len(plan.likely)} likely and '
+              f'{len(plan.uncertain)} uncertain dates, found '
+              f'{len(meetings)} meetings in {len(plan.unlikely)} probed '
+              f'and skipped {len(plan.skipped)}')
+        return plan.likely + plan.uncertain + [
+            x for x in plan.unlikely if x in meetings]
+
+    def _scrape_queued(self, links: list, db: dict, bucket: str,
+                       concurrency: int) -> None:
+        if self.queue_path is not None:
+            self.queue = WorkQueue(self.queue_path)
+            workers = UploadWorkers(
+                self.queue, db, bucket, self.raw_data_path,
+                self.upload_workers, storage=self.storage).start()
+            try:
+                self._scrape_dates(links, db, bucket, concurrency)
+            finally:
+                workers.stop()
+                print(f'Upload queue: {self.queue.counts()}')
+                self.queue.close()
+                self.queue = None
+            return
+        self._scrape_dates(links, db, bucket, concurrency)
+
+    def _scrape_dates(self, links: list, db: dict, bucket: str,
+                      concurrency: int) -> None:
+        if self.state is not None:
+            self._upload_saved(db, bucket)
+        if self.parquet_path is not None:
+            from parquet_store import ParquetStore
+            self.parquet = ParquetStore(self.parquet_path)
+        try:
+            if concurrency > 1:
+                from async_crawler import AsyncCrawler
+                AsyncCrawler(self, concurrency=concurrency).run(
+                    links, db, bucket)
             else:
-                print(f'Data Already Retrieved: {link}')
-            for race_link in card_races:
-                if race_link in retrieved_urls:
-                    print(f'Data Already Retrieved: {race_link}')
-                    continue
-                while True:
-                    self.driver.get(race_link)
-                    print(f'Accessed {race_link}')
-                    time.sleep(self.sleep_time)
-                    if not self._if_event(race_link):
-                        break
-                    print(f'No Event loaded {race_link}')
-                self._scrape_page(db, bucket)
-        return
+                self._scrape_batched(links, db, bucket)
+        finally:
+            if self.parquet is not None:
+                self.parquet.flush()
+                self.parquet = None
+            if self.storage is not None:
+                self.storage.flush()
+                if self.state is not None:
+                    self.state.promote('saved', 'uploaded')
+
+    def _scrape_batched(self, links: list, db: dict, bucket: str) -> None:
+        if self.batch_size > 1:
+            self.loader = BulkLoader(db, self.batch_size)
+        index = self._load_index(db, links)
+        try:
+            self._scrape_links(links, db, bucket)
+        finally:
+            if self.loader is not None:
+                self.loader.flush()
+                self.loader = None
+                if self.state is not None:
+                    self.state.promote('saved', 'uploaded')
+            index.save()
+
+    def _scrape_links(self, links: list, db: dict, bucket: str) -> None:
+        '''Scrape each date, and every race on its card.
+
+        Each date is first passed to before_date, if set. With
+        failed_dates set, a date that raises is recorded and skipped.
+
+        Args:
+            links (list): a list of urls to the first race of a day.
+            db (dict): Parameters used in building an SQLAlchemy Engine.
+            bucket (str): The name of the S3 bucket.
+        '''
+        self.unfinished = []
+        for link in links:
+            if self.before_date is not None and not self.before_date(link):
+                print(f'Stopped before {link}')
+                return
+            try:
+                self._scrape_link(link, db, bucket)
+            except Exception as e:
+                if self.failed_dates is None:
+                    raise
+                print(f'Failed to scrape {link}: {e!r}')
+                self.failed_dates.append(link)
+
+    def _scrape_link(self, link: str, db: dict, bucket: str) -> None:
+        '''Scrape a date, and every race on its card.
+
+        Args:
+            link (str): URL to the first race of the day.
+            db (dict): Parameters used in building an SQLAlchemy Engine.
+            bucket (str): The name of the S3 bucket.
+        '''
+        if link in self.index.no_event:
+            print(f'No Event on {link}')
+            return
+        status = 'pending'
+        if self.state is not None:
+            status = self.state.date_status(link)
+        if status == 'done':
+            print(f'Date Already Completed: {link}')
+            return
+        if status == 'parsed':
+            race_links = self.state.card(link)
+        else:
+            race_links = self._scrape_date(link, db, bucket)
+            if race_links is None:
+                return
+        race_links = [x for x in race_links
+                      if not self._race_done(x, self.index.retrieved)]
+        if self.pool is not None:
+            self.pool.map(
+                lambda driver, race_link: self._scrape_race(
+                    driver, race_link, db, bucket),
+                race_links
+                )
+        else:
+            for race_link in race_links:
+                self._scrape_race(self.driver, race_link, db, bucket)
+        self._finish_races(db, bucket)
+        if self.state is not None:
+            self.state.finish_date(link)
+
+    def _scrape_date(self, link: str, db: dict, bucket: str) -> list:
+        '''Load the first race of a day, and scrape it.
+
+        Args:
+            link (str): URL to the first race of the day.
+            db (dict): Parameters used in building an SQLAlchemy Engine.
+            bucket (str): The name of the S3 bucket.
+
+        Returns:
+            list: URLs of the other races on the card, or None if the
+            page did not load or there was no event.
+        '''
+        if not self._load_page(self.driver, link):
+            print(f'Unable to load {link}')
+            return None
+        if self.state is not None:
+            self.state.set_date(link, 'fetched')
+        if self.parser.if_event(link):
+            print(f'No Event on {link}')
+            NO_EVENTS.inc()
+            no_event_insert(db, link)
+            self.index.add_no_event(link)
+            if self.state is not None:
+                self.state.set_date(link, 'done')
+            return None
+        card_races = self.parser.card_races()
+        self.cards[link] = [link] + card_races
+        if self.state is not None:
+            self.state.set_card(link, [link] + card_races)
+        if not self._race_done(link, self.index.retrieved):
+            if self.state is not None:
+                self.state.set_race(link, 'fetched')
+            self._scrape_page(db, bucket, link=link)
+        return card_races
+
+    def _race_done(self, race_link: str, retrieved_urls: set) -> bool:
+        '''Check whether a race has already been saved.
+
+        Races found in the dedup index are recorded as uploaded in the
+        run state.
+
+        Args:
+            race_link (str): URL of the race.
+            retrieved_urls (set): URLs that have already been scraped.
+        '''
+        if race_link in retrieved_urls:
+            print(f'Data Already Retrieved: {race_link}')
+            if self.state is not None:
+                self.state.set_race(race_link, 'uploaded')
+            return True
+        if self.state is not None:
+            status = self.state.race_status(race_link)
+            if status in ('saved', 'uploaded'):
+                print(f'Race Already Saved: {race_link}')
+                return True
+        return False
 
     def create_date_links(self, days=1) -> list:
         ''' Creates a list of URLs to be used by the scrape_page method
@@ -137,232 +479,224 @@ class Scraper(object):
         Returns:
             list(str): The list of URLs for the first race on the given day.
         '''
-        base_url = ('https://racing.hkjc.com/racing/information/'
-                    'English/Racing/LocalResults.aspx?RaceDate=')
         dates = self._create_date_list(days)
-        date_links = [f'{base_url}{str(date.year)}/'
+        date_links = [f'{self.base_url}{str(date.year)}/'
                       f'{str(date.month).zfill(2)}/'
                       f'{str(date.day).zfill(2)}' for date in dates]
         return date_links
 
-    def _scrape_page(self, db: dict, bucket: str) -> None:
-        '''Scrapes current webpage to a dictionary.-
+    def _scrape_race(self, driver, race_link: str, db: dict,
+                     bucket: str) -> None:
+        '''Load a race page and scrape it.
 
-        Creates a dictionary with a unique identifier and
-        scrapes the page for data relevant to the race. Then
-        saves them to a JSON file.
+        The page is loaded again, up to the retry budget, until it holds
+        results for the race. A page without results is not counted as
+        a failure by the RateLimiter, and is loaded again after its retry
+        delay.
 
         Args:
-            db (dict):
-            bucket (str):
+            driver (webdriver | HttpDriver): Driver used to load the page.
+            race_link (str): URL of the race.
+            db (dict): Parameters used in building an SQLAlchemy Engine.
+            bucket (str): The name of the S3 bucket.
         '''
-        scraped_json = {'uuid': str(uuid4())}
-        scraped_json.update(self._generate_id())
-        scraped_json.update(self._race_dict())
-        scraped_json['image_link'] = self._get_image_link()
-        scraped_json['runners'] = self._runner_dict()
-        scraped_json['runners']['race_id'] =   \
-            [scraped_json['race_id'] for x in
-                range(len(scraped_json['runners']['url']))]
-        self._save_data(scraped_json)
-        self._save_image(scraped_json['image_link'], scraped_json['race_id'])
-        upload_to_rds_by_id(scraped_json['race_id'], db)
-        upload_to_bucket_by_id(scraped_json['race_id'], bucket)
-
-    def _generate_id(self) -> dict:
-        ''' Generates a unique race ID
-
-        Generates a human readable unique ID for each race by scraping
-        the date and the race number from the current page, then returns
-        a dictionary with those three keys.
+        parser = PageParser(driver)
+        for tries in range(self.retries):
+            if not self._load_page(driver, race_link):
+                break
+            print(f'Accessed {race_link}')
+            if self.state is not None:
+                self.state.set_race(race_link, 'fetched')
+            if not parser.if_event(race_link):
+                self._scrape_page(db, bucket, driver, race_link)
+                return
+            print(f'No Event loaded {race_link}')
+            if tries < self.retries - 1:
+                RETRIES.inc()
+                delay = self.limiter.retry_delay(tries)
+                SLEEP_SECONDS.inc(delay)
+                time.sleep(delay)
+        print(f'Unable to load race: {race_link}')
+
+    def _load_page(self, driver, link: str, ready: str = READY_XPATH) -> bool:
+        '''Load a page and wait until it is ready to scrape.
+
+        Waits for an element matching the ready XPath, or a redirect away
+        from the link, reloading the page if neither happens within the
+        timeout. Pages fetched by the HttpDriver are complete once loaded
+        and are not waited on, and are given up on if the request fails
+        or the site answers with an error. The time taken for the page to
+        become ready is appended to page_latency. Chrome loads wait on the
+        RateLimiter and report their outcome to it, or release it if the
+        driver raises, and results pages loaded in Chrome are added to the
+        page cache; the HttpDriver does both itself.
 
-        Returns:
-            dict: A dictionary containing the current races ID, date,
-            and race number.
-        '''
-        date = self.driver.find_element(
-            By.XPATH,
-            '/html/body/div/div[3]/p[1]/span[1]'
-        ).text.split('  ')[1]
-        race_number = self.driver.find_element(
-            By.XPATH,
-            '/html/body/div/div[4]/table/thead/tr/td[1]'
-        ).text.split(' ')[1]
-        race_id = date.replace('/', '')+f'-{race_number}'
-        race_dict = {
-            'race_id': race_id,
-            'date': date,
-            'race_number': race_number
-            }
-        return race_dict
-
-    def _get_card_races(self) -> list:
-        '''Get daily races from first page.
-
-        Searches the current page of other races taking place on that date.
+        Args:
+            driver (webdriver | HttpDriver): Driver used to load the page.
+            link (str): URL of the page.
+            ready (str): XPath of an element present once the page loads.
 
         Returns:
-            list(str): a list of URLs for other pages to scrape.
+            bool: True if the page became ready within the retry budget.
         '''
-        races = self.driver.find_elements(
-            By.XPATH,
-            '/html/body/div/div[2]/table/tbody/tr[1]/td[position()<last()]/a'
-        )
-        links = [race.get_attribute('href') for race in races]
-        return links
-
-    def _race_dict(self) -> dict:
-        '''Create dictionary from scraped date.
+        browser = not isinstance(driver, HttpDriver)
+        for tries in range(self.retries):
+            if browser:
+                self.limiter.wait(link)
+            start = time.monotonic()
+            try:
+                driver.get(link)
+                if browser:
+                    WebDriverWait(driver, self.timeout, 0.1).until(
+                        lambda x: x.current_url != link
+                        or x.find_elements(By.XPATH, ready))
+            except TimeoutException:
+                print(f'Timed out loading {link}: {tries+1} attempts')
+                RETRIES.inc()
+                self.limiter.failure(link)
+                continue
+            except PageLoadError as e:
+                print(e)
+                return False
+            except BaseException:
+                if browser:
+                    self.limiter.release(link)
+                raise
+            latency = time.monotonic() - start
+            if browser:
+                self.limiter.success(link, latency)
+            self.page_latency.append((link, latency))
+            FETCH_SECONDS.observe(latency)
+            PAGES.inc()
+            if self.cache is not None and ready == READY_XPATH and browser:
+                self.cache.put(link, driver.current_url,
+                               driver.page_source.encode('utf-8'))
+            return True
+        return False
 
-        Calls _get_race_data and creates a dictionary for the details
-        pertaining to the race.
+    def _scrape_page(self, db: dict, bucket: str, driver=None,
+                     link: str = None) -> None:
+        '''Scrapes current webpage to a dictionary.-
 
-        Returns:
-            dict: Dictionart of race details.
-        '''
-        data = self._get_race_data()
-        data_dict = {'class': data[3].split(' - ')[0],
-                     'length': int(data[3].split(' - ')[1][:-1]),
-                     'going': data[5],
-                     'course': data[8].replace('"', ''),
-                     'prize': int(data[9].split(' ')[1].replace(',', '')),
-                     'pace': f'{data[-3]}/{data[-2]}/{data[-1]}',
-                     'url': self.driver.current_url}
-        return data_dict
-
-    def _get_race_data(self) -> list:
-        '''Scrape the current page for race details.
-
-        Scrapes a table from the current page containing a list of
-        details, and returns them as a list.
+        Creates a dictionary with a unique identifier and
+        scrapes the page for data relevant to the race. Then
+        saves them to a JSON file, and starts downloading its image.
+        The race is uploaded by _finish_races once the image is saved,
+        so the download overlaps the loading of the next races.
 
-        Returns:
-            list (str): A list of raw data, extracted from current page.
+        Args:
+            db (dict):
+            bucket (str):
+            driver (webdriver | HttpDriver): Driver holding the page,
+                defaults to the main driver.
+            link (str): URL the page was requested from, used to record
+                its progress in the run state.
         '''
-        data = self.driver.find_elements(
-            By.XPATH,
-            '/html/body/div/div[4]/table/tbody/tr/td'
-        )
-        data_text = [x.text for x in data]
-        return data_text
+        driver = driver or self.driver
+        scraped_json = self._parse_page(PageParser(driver))
+        id = scraped_json['race_id']
+        link = link or scraped_json['url']
+        if self.state is not None:
+            self.state.set_race(link, 'parsed', id)
+        image = self.images.submit(
+            scraped_json['image_link'], self._image_path(id))
+        self._save_data(scraped_json)
+        if self.parquet is not None:
+            self.parquet.add(scraped_json)
+        self.unfinished.append((link, scraped_json, image))
 
-    def _runner_dict(self) -> dict:
-        '''Creates a dictionary for all runners in a race.
+    def _finish_races(self, db: dict, bucket: str) -> None:
+        '''Wait for the images of the scraped races, then upload them.
 
-        Calls _get_runner_table to scrape the current page for all of the
-        runners in the race, and creates a dictionary with the details
-        of each runner.
+        Called at the end of each card, with the races whose pages were
+        scraped since the last call.
 
-        Returns:
-            dict: A dictionary of runner details.
-        '''
-        table = self._get_runner_table()
-        dict_runners = {'uuid': [str(uuid4()) for x in range(len(table[0]))],
-                        'race_id': [],
-                        'horse_id': [x.split('(')[1][:-1] for x in table[2]],
-                        'place': [x.strip(' ') for x in table[0]],
-                        'number': [x.strip(' ') for x in table[1]],
-                        'name': [x.split('(')[0] for x in table[2]],
-                        'jockey': table[3],
-                        'trainer': table[4],
-                        'actual_weight': table[5],
-                        'declared_weight': table[6],
-                        'draw': [x.strip(' ') for x in table[7]],
-                        'length_behind_winner': table[8],
-                        'running_positions': table[9],
-                        'finish_time': table[10],
-                        'win_odds': table[11],
-                        'url': self._get_runner_links()}
-        return dict_runners
-
-    def _get_runner_table(self) -> list:
-        '''Scrape the current page for the details of each runner.
-
-        Scrapes a table from the current page containing a list of
-        details, and returns them as a list.
-
-        Returns:
-            list (str): a 2-dimensional list of details for each runner.
+        Args:
+            db (dict): Parameters used in building an SQLAlchemy Engine.
+            bucket (str): The name of the S3 bucket.
         '''
-        table = self.driver.find_elements(
-            By.XPATH,
-            '/html/body/div/div[5]/table/tbody/tr'
-        )
-        table = [self._get_runner(x) for x in table]
-        return np.array(table).T.tolist()
-
-    def _get_runner(self, row) -> list:
-        '''Extract text for each runner.
+        unfinished, self.unfinished = self.unfinished, []
+        for link, scraped_json, image in unfinished:
+            id = scraped_json['race_id']
+            self._save_image(scraped_json['image_link'], id, image)
+            RACES.inc()
+            if self.state is not None:
+                self.state.set_race(link, 'saved', id)
+            if self.queue is not None:
+                self.queue.put(id)
+            elif self.storage is not None:
+                self.storage.add(scraped_json)
+            else:
+                if self.loader is not None:
+                    self.loader.add(scraped_json)
+                else:
+                    upload_to_rds_by_id(id, db, self.raw_data_path)
+                upload_to_bucket_by_id(id, bucket, self.raw_data_path)
+            if (self.state is not None and self.loader is None
+                    and (self.storage is None or self.queue is not None)):
+                self.state.set_race(link, 'uploaded', id)
+            if self.index is not None:
+                self.index.add_retrieved(scraped_json['url'])
+
+    def _upload_saved(self, db: dict, bucket: str) -> None:
+        '''Upload the races a previous run saved but did not upload.
+
+        The races are read back from the data folder, and written with
+        a BulkLoader so rows that did reach the RDS are skipped.
 
         Args:
-            row (WebElement): A row from the table of runners.
-
-        Returns:
-            list (str): A list of parameters for a runner.
+            db (dict): Parameters used in building an SQLAlchemy Engine.
+            bucket (str): The name of the S3 bucket.
         '''
-        runner = row.find_elements(By.XPATH, './/td')
-        return [x.text for x in runner]
+        saved = self.state.races('saved')
+        if not saved:
+            return
+        print(f'Uploading {len(saved)} saved races')
+        loader = BulkLoader(db, batch_size=len(saved))
+        for link, id in saved:
+            if self.queue is not None:
+                self.queue.put(id)
+                continue
+            race = load_race(self.raw_data_path, id)
+            if self.storage is not None:
+                self.storage.add(race)
+                continue
+            loader.add(race)
+            upload_to_bucket_by_id(id, bucket, self.raw_data_path)
+        if self.storage is not None:
+            self.storage.flush()
+        elif self.queue is None:
+            loader.flush()
+        self.state.promote('saved', 'uploaded')
 
-    def _get_runner_links(self) -> list:
-        ''' Get URL for each runner
+    def _load_index(self, db: dict, links: list) -> DedupIndex:
+        '''Load the dedup index for the dates of a list of links.
 
-        Scrapes a URL to the page for each runner and returns them
-        as a list.
+        The index is created on first use and kept for later runs.
 
-        Returns:
-            list (str): A list of URLs to the runners of the race.
-        '''
-        runners = self.driver.find_elements(
-            By.XPATH,
-            '/html/body/div/div[5]/table/tbody/tr/td[3]/a'
-        )
-        links = [horse.get_attribute('href') for horse in runners]
-        return links
-
-    def _get_image_link(self) -> str:
-        ''' Get link for race image.
-
-        Retrieves the URL for the picture finish for the current page,
-        and alters it to reach the larger version.
+        Args:
+            db (dict): Parameters used in building an SQLAlchemy Engine.
+            links (list): a list of urls to the first race of a day.
 
         Returns:
-            str: A URL to the page containing a photograph of the race finish.
+            DedupIndex: The scraper's index.
         '''
-        img_link = self.driver.find_element(
-            By.XPATH,
-            '/html/body/div/div[6]/div[2]/div[1]/div/a/img'
-        ).get_attribute('src')
-        i = list(img_link)
-        i[-5] = 'L'
-        return ''.join(i)
-
-    def _if_event(self, link) -> bool:
-        '''Checks the current page for data to scrape
+        if self.index is None:
+            self.index = DedupIndex(db, self.dedup_path)
+        self.index.load(links)
+        return self.index
 
-        Searches the current page for errorContainers, indicating that
-        there is no race on this date, and compares current URL to
-        intended URL incase of redirection.
+    def _parse_page(self, parser: PageParser) -> dict:
+        '''Extract a race from a loaded page.
 
         Args:
-            link (str): Intended URL to compare to current.
+            parser (PageParser): Parser for the page holding the race.
 
         Returns:
-            bool: True if no race results are present, otherwise False.
+            dict: The race details, with a list of its runners.
         '''
-        event = self.driver.find_elements(
-            By.XPATH,
-            '//div[@id="errorContainer"]'
-        )
-        abandoned = self.driver.find_elements(
-            By.XPATH,
-            '/html/body/div/div[4]'
-        )
-        if bool(abandoned):
-            for x in abandoned:
-                if x.text.startswith('This race has been abandoned'):
-                    return True
-        redirected = self.driver.current_url != link
-        return (bool(event) or bool(redirected))
+        with PARSE_SECONDS.time():
+            return parser.race()
 
     def _create_date_list(self, days: int) -> list():
         '''Get a range of datetimes.
@@ -391,37 +725,32 @@ class Scraper(object):
         '''
         id = data['race_id']
         folder = os.path.join((self.raw_data_path), id)
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-        with open(os.path.join(folder, f'{id}.json'), 'w') as f:
-            json.dump(data, f, indent=4)
+        with SAVE_SECONDS.time():
+            os.makedirs(folder, exist_ok=True)
+            with open(os.path.join(folder, f'{id}.json'), 'w') as f:
+                json.dump(data, f, indent=4)
 
-    def _save_image(self, link: str, id: str) -> bool:
+    def _save_image(self, link: str, id: str, image: Future = None) -> bool:
         '''Save photo finish.
 
         Save image of race finish in /raw_data sub-directory, with
-        corrasponding JSON. Will atempt to find image 3 times.
+        corrasponding JSON. The image is downloaded directly by the
+        ImageFetcher, and is not requested again if already saved.
 
         Args:
             link (str): URL link to the image.
             id (str): id field of corrasponding JSON. Used as image name.
+            image (Future): Download already started with images.submit,
+                waited on instead of starting a new one.
         Returns:
-            bool: True if image has been saved with urllib.
+            bool: True if image has been saved.
         '''
-        folder = os.path.join((self.raw_data_path), id)
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-        for tries in range(3):
-            try:
-                self.driver.get(link)
-                time.sleep(self.sleep_time)
-                img = self.driver.find_element(
-                    By.XPATH, '/html/body/img').get_attribute('src')
-                urllib.request.urlretrieve(
-                    img, os.path.join(folder, f'{id}.jpg')
-                    )
-                return True
-            except urllib.error.URLError:
-                print(f'URL error occured: {tries+1} attempts')
-        print(f'Unable to retrieve picture: {id}')
-        return False
+        if image is None:
+            image = self.images.submit(link, self._image_path(id))
+        if not image.result():
+            print(f'Unable to retrieve picture: {id}')
+            return False
+        return True
+
+    def _image_path(self, id: str) -> str:
+        return os.path.join(self.raw_data_path, id, f'{id}.jpg')
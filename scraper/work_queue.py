@@ -0,0 +1,277 @@
+'''Work Queue Module
+
+This module contains a durable SQLite backed queue of scraped race ids,
+and the uploader workers that drain it. Scraping only has to enqueue a
+race once its files are saved; uploading to the RDS and S3 happens on
+separate threads, and anything not acknowledged when the process stops
+is picked up again on the next run.
+'''
+
+from bulk_loader import BulkLoader
+import threading
+import uploader
+import sqlite3
+import json
+import time
+import os
+
+
+class WorkQueue(object):
+    '''WorkQueue Class
+
+    A queue of ids stored in an SQLite database. A claimed id must be
+    acknowledged with ack(), or released with nack() to be retried after
+    a backoff. Claims that are not acknowledged within the visibility
+    timeout, for example because the process was killed, become
+    available again. Ids that fail max_attempts times are marked failed.
+
+    Example usage:
+
+        queue = WorkQueue('raw_data/queue.db')
+        queue.put(race_id)
+        id = queue.claim()
+        queue.ack(id)
+    '''
+
+    def __init__(self, path: str, visibility_timeout: float = 300,
+                 max_attempts: int = 5, backoff: float = 5):
+        '''Initialises WorkQueue
+
+        Args:
+            path (str): Location of the SQLite database.
+            visibility_timeout (float): Seconds before an unacknowledged
+                claim is handed out again.
+            max_attempts (int): Attempts before an id is marked failed.
+            backoff (float): Seconds before the first retry, doubling
+                with each further attempt.
+        '''
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS queue ('
+            'id TEXT PRIMARY KEY, '
+            "status TEXT NOT NULL DEFAULT 'pending', "
+            'attempts INTEGER NOT NULL DEFAULT 0, '
+            'available_at REAL NOT NULL DEFAULT 0, '
+            'claimed_at REAL, '
+            'error TEXT)'
+            )
+
+    def put(self, id: str) -> None:
+        '''Add an id to the queue.
+
+        An id that is already done or failed is queued again, while one
+        that is pending or claimed is left as it is.
+
+        Args:
+            id (str): The id of a race to upload.
+        '''
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO queue (id) VALUES (?) ON CONFLICT (id) DO '
+                "UPDATE SET status = 'pending', attempts = 0, "
+                'available_at = 0, error = NULL '
+                "WHERE status IN ('done', 'failed')",
+                (id,)
+                )
+
+    def claim(self) -> str:
+        '''Claim the next available id.
+
+        Returns:
+            str: The claimed id, or None if nothing is available.
+        '''
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute(
+                    "SELECT id FROM queue WHERE (status = 'pending' "
+                    'AND available_at <= ?) '
+                    "OR (status = 'claimed' AND claimed_at <= ?) "
+                    'ORDER BY available_at LIMIT 1',
+                    (now, now - self.visibility_timeout)
+                    ).fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        "UPDATE queue SET status = 'claimed', "
+                        'claimed_at = ? WHERE id = ?', (now, row[0]))
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        return row[0] if row is not None else None
+
+    def ack(self, id: str) -> None:
+        '''Mark a claimed id as done.'''
+        with self.lock:
+            self.conn.execute(
+                "UPDATE queue SET status = 'done', error = NULL "
+                'WHERE id = ?', (id,))
+
+    def nack(self, id: str, error: str = None) -> None:
+        '''Release a claimed id to be retried after a backoff.
+
+        Args:
+            id (str): The claimed id.
+            error (str): Description of the failure.
+        '''
+        with self.lock:
+            attempts = self.conn.execute(
+                'SELECT attempts FROM queue WHERE id = ?', (id,)
+                ).fetchone()[0] + 1
+            status = 'failed' if attempts >= self.max_attempts else 'pending'
+            self.conn.execute(
+                'UPDATE queue SET status = ?, attempts = ?, '
+                'available_at = ?, error = ? WHERE id = ?',
+                (status, attempts,
+                 time.time() + self.backoff * 2 ** (attempts - 1),
+                 error, id)
+                )
+
+    def release_claims(self) -> None:
+        '''Make every claimed id available again.
+
+        Used on startup, when no worker can still be holding a claim
+        from a previous run of this process.
+        '''
+        with self.lock:
+            self.conn.execute(
+                "UPDATE queue SET status = 'pending' "
+                "WHERE status = 'claimed'")
+
+    def counts(self) -> dict:
+        '''Number of ids in each status.'''
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT status, count(*) FROM queue GROUP BY status'
+                ).fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class UploadWorkers(object):
+    '''UploadWorkers Class
+
+    Threads that claim race ids from a WorkQueue and upload them to the
+    RDS and S3, or to the sinks of a Storage. The uploads are idempotent,
+    so a race that was partly uploaded before a crash can safely be
+    uploaded again. Without a Storage each thread writes through its own
+    BulkLoader, and an id is only acknowledged once its rows have been
+    committed and its files are in the bucket, or written to every sink.
+
+    Example usage:
+
+        workers = UploadWorkers(queue, db, bucket, raw_data_path).start()
+        ...
+        workers.stop()
+    '''
+
+    def __init__(self, queue: WorkQueue, db: dict, bucket: str,
+                 raw_data_path: str, workers: int = 4,
+                 poll_interval: float = 0.5, storage=None):
+        '''Initialises UploadWorkers
+
+        Args:
+            queue (WorkQueue): Queue of race ids to upload.
+            db (dict): Dict containing parameters used in building an
+                SQLAlchemy Engine.
+            bucket (str): The name of the S3 bucket.
+            raw_data_path (str): Location of data folder.
+            workers (int): Number of uploader threads.
+            poll_interval (float): Seconds to wait when the queue is empty.
+            storage (Storage): Optional sinks races are written to in
+                place of the RDS and bucket.
+        '''
+        self.queue = queue
+        self.db = db
+        self.bucket = bucket
+        self.raw_data_path = raw_data_path
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.storage = storage
+        self.local = threading.local()
+        self.stopping = threading.Event()
+        self.draining = False
+        self.threads = []
+
+    def start(self) -> 'UploadWorkers':
+        '''Start the uploader threads.'''
+        self.queue.release_claims()
+        self.stopping.clear()
+        self.threads = [threading.Thread(target=self._work, daemon=True)
+                        for x in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self, drain: bool = True) -> None:
+        '''Stop the uploader threads.
+
+        Args:
+            drain (bool): Wait until the queue has no available ids first.
+        '''
+        self.draining = drain
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def run_once(self) -> bool:
+        '''Claim and upload a single id.
+
+        Returns:
+            bool: False if there was nothing to claim.
+        '''
+        id = self.queue.claim()
+        if id is None:
+            return False
+        try:
+            self.upload(id)
+        except Exception as e:
+            print(f'Upload failed for {id}: {e}')
+            self.queue.nack(id, repr(e))
+        else:
+            self.queue.ack(id)
+        return True
+
+    def upload(self, id: str) -> None:
+        '''Upload a race to the RDS and S3, or to every sink.
+
+        Args:
+            id (str): The id of a race to upload.
+        '''
+        path = os.path.join(self.raw_data_path, id, f'{id}.json')
+        with open(path, 'r') as f:
+            race = json.load(f)
+        if self.storage is not None:
+            self.storage.put(race)
+            return
+        self._loader().add(race)
+        if not uploader.upload_to_bucket_by_id(
+                id, self.bucket, self.raw_data_path):
+            raise FileNotFoundError(f'No files for {id}')
+
+    def _loader(self) -> BulkLoader:
+        '''The BulkLoader of the calling thread.'''
+        if not hasattr(self.local, 'loader'):
+            self.local.loader = BulkLoader(self.db, batch_size=1)
+        return self.local.loader
+
+    def _work(self) -> None:
+        while not (self.stopping.is_set() and not self.draining):
+            if self.run_once():
+                continue
+            if self.stopping.is_set():
+                return
+            self.stopping.wait(self.poll_interval)
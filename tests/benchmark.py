@@ -0,0 +1,250 @@
+'''End to end benchmark of scrape_dates against the local mock site.
+
+Serves a run of race meetings, with no event and abandoned days mixed
+in, from MockSite with the given latency and error rate. The races are
+written to SQLite and to a local folder standing in for S3, or to a
+moto S3 bucket with --sinks sqlite,s3. Reports pages/sec, p50/p95 page
+latency, DB rows/sec and peak RSS, and compares them with a saved
+baseline so regressions show up. With --plan the dates are ordered and
+probed by a CalendarPlanner first.
+
+Usage:
+
+    python benchmark.py --dates 60 --latency 0.02 --error-rate 0.01
+    python benchmark.py --dates 60 --save-baseline
+    python benchmark.py --dates 60 --baseline benchmark_baseline.json
+'''
+
+from unittest import mock
+import configparser
+import contextlib
+import datetime
+import argparse
+import resource
+import tempfile
+import json
+import time
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '../scraper'))
+from sqlalchemy import select, func  # noqa: E402
+from scraper.web_scraper import Scraper  # noqa: E402
+from storage import storage_from_config  # noqa: E402
+from calendar_planner import CalendarPlanner  # noqa: E402
+from uploader import (  # noqa: E402
+                        _connect_to_rds,
+                        race_table,
+                        runner_table
+                        )
+from tests.mock_server import MockSite, RESULTS_PATH, add_meeting  # noqa
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'benchmark_baseline.json')
+HIGHER = ('pages_per_second', 'db_rows_per_second')
+LOWER = ('p50_ms', 'p95_ms', 'peak_rss_mb')
+FIRST_DATE = datetime.date(2022, 1, 26)
+
+
+def benchmark_site(dates: int, latency: float = 0, error_rate: float = 0,
+                   seed: int = 1) -> tuple:
+    '''A mock site with a meeting, no event or abandoned race each day.
+
+    Every fifth day has no event and every tenth day is abandoned.
+
+    Returns:
+        tuple: The started MockSite, and the date links to scrape.
+    '''
+    site = MockSite(latency=latency, error_rate=error_rate, seed=seed)
+    links = []
+    for x in range(dates):
+        date = FIRST_DATE - datetime.timedelta(days=x)
+        path = f"{RESULTS_PATH}?RaceDate={date.strftime('%Y/%m/%d')}"
+        if x % 10 == 9:
+            site.add_page(path, 'abandoned.html')
+        elif x % 5 == 4:
+            site.add_page(path, 'no_event.html')
+        else:
+            add_meeting(site, date)
+        links.append(site.url(path))
+    return site.start(), links
+
+
+def run(dates: int = 30, latency: float = 0, error_rate: float = 0,
+        concurrency: int = 1, pool_size: int = 1, batch_size: int = 50,
+        sinks: str = 'sqlite, local', seed: int = 1,
+        plan: bool = False) -> dict:
+    '''Scrape a mock site once and measure it.
+
+    Args:
+        dates (int): Number of days served.
+        latency (float): Seconds added to every response.
+        error_rate (float): Share of requests answered with a 503.
+        concurrency (int): Passed to scrape_dates; above 1 crawls with
+            the AsyncCrawler.
+        pool_size (int): Number of drivers scraping races in parallel.
+        batch_size (int): Races written per batch by each sink.
+        sinks (str): Storage sinks, from sqlite, local and s3.
+        seed (int): Seed of the errors served.
+        plan (bool): Plan the dates with a CalendarPlanner.
+
+    Returns:
+        dict: The scenario and its measurements.
+    '''
+    scenario = {'dates': dates, 'latency': latency,
+                'error_rate': error_rate, 'concurrency': concurrency,
+                'pool_size': pool_size, 'batch_size': batch_size,
+                'sinks': sinks, 'plan': plan}
+    site, links = benchmark_site(dates, latency, error_rate, seed)
+    with tempfile.TemporaryDirectory() as tmp, _mock_s3(sinks):
+        db = {'DATABASE_TYPE': 'sqlite',
+              'DATABASE': os.path.join(tmp, 'bench.db')}
+        config = configparser.ConfigParser()
+        config.read_dict({'RDS': db, 'S3': {'BUCKET': 'races'},
+                          'STORAGE': {'SINKS': sinks,
+                                      'BATCH_SIZE': str(batch_size),
+                                      'SQLITE_PATH': db['DATABASE'],
+                                      'LOCAL_PATH': os.path.join(tmp, 's3')}})
+        scr = Scraper(backend='http', pool_size=pool_size)
+        scr.base_url = site.url(f'{RESULTS_PATH}?RaceDate=')
+        scr.raw_data_path = os.path.join(tmp, 'raw_data')
+        scr.storage = storage_from_config(config, scr.raw_data_path)
+        if plan:
+            scr.planner = CalendarPlanner()
+        start = time.monotonic()
+        try:
+            scr.scrape_dates(links, db, 'races', concurrency=concurrency)
+            scr.storage.close()
+            scr.images.close()
+        finally:
+            elapsed = time.monotonic() - start
+            site.stop()
+        with _connect_to_rds(db).connect() as conn:
+            rows = sum(conn.execute(select(func.count()).select_from(
+                x)).scalar() for x in (race_table, runner_table))
+    latencies = sorted(x[1] for x in scr.page_latency)
+    return {
+        'scenario': scenario,
+        'pages': len(latencies),
+        'errors': site.errors,
+        'seconds': round(elapsed, 3),
+        'pages_per_second': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'db_rows': rows,
+        'db_rows_per_second': round(rows / elapsed, 2),
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+        }
+
+
+def percentile(values: list, q: float) -> float:
+    '''Nearest rank percentile of sorted values, or 0 if there are none.'''
+    if not values:
+        return 0.0
+    rank = max(1, -(-len(values) * q // 100))
+    return values[int(rank) - 1]
+
+
+def peak_rss_mb() -> float:
+    '''Peak resident set size of this process, in MB.'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / 1024 ** 2
+    return peak / 1024
+
+
+def scenario_key(report: dict) -> str:
+    return json.dumps(report['scenario'], sort_keys=True)
+
+
+def save_baseline(report: dict, path: str = BASELINE_PATH) -> None:
+    '''Store a report as the baseline of its scenario.'''
+    baselines = load_baselines(path)
+    baselines[scenario_key(report)] = report
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(baselines, f, indent=4, sort_keys=True)
+    os.replace(f'{path}.tmp', path)
+
+
+def load_baselines(path: str = BASELINE_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def regressions(report: dict, baseline: dict,
+                tolerance: float = 0.2) -> list:
+    '''Measurements more than tolerance worse than the baseline.
+
+    Returns:
+        list: (name, baseline, current) for each regression.
+    '''
+    worse = []
+    for name in HIGHER:
+        if report[name] < baseline[name] * (1 - tolerance):
+            worse.append((name, baseline[name], report[name]))
+    for name in LOWER:
+        if report[name] > baseline[name] * (1 + tolerance):
+            worse.append((name, baseline[name], report[name]))
+    return worse
+
+
+@contextlib.contextmanager
+def _mock_s3(sinks: str):
+    '''moto's S3 in place of AWS when the s3 sink is benchmarked.'''
+    if 's3' not in sinks:
+        yield
+        return
+    import boto3
+    try:
+        from moto import mock_aws
+    except ImportError:
+        from moto import mock_s3 as mock_aws
+    env = {'AWS_ACCESS_KEY_ID': 'testing',
+           'AWS_SECRET_ACCESS_KEY': 'testing',
+           'AWS_DEFAULT_REGION': 'us-east-1'}
+    with mock.patch.dict(os.environ, env), mock_aws(), \
+            mock.patch('s3_uploader._clients', {}):
+        boto3.client('s3').create_bucket(Bucket='races')
+        yield
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark scrape_dates against a local mock site.')
+    parser.add_argument('--dates', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--pool-size', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--sinks', default='sqlite, local',
+                        help='sinks from sqlite, local and s3')
+    parser.add_argument('--plan', action='store_true',
+                        help='plan the dates with a CalendarPlanner')
+    parser.add_argument('--baseline', default=BASELINE_PATH,
+                        help='file of saved baselines')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store this run as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown before failing (0.2 = 20%%)')
+    args = parser.parse_args()
+    report = run(args.dates, args.latency, args.error_rate,
+                 args.concurrency, args.pool_size, args.batch_size,
+                 args.sinks, plan=args.plan)
+    print(json.dumps(report, indent=4))
+    if args.save_baseline:
+        save_baseline(report, args.baseline)
+        print(f'Saved baseline to {args.baseline}')
+        sys.exit(0)
+    baseline = load_baselines(args.baseline).get(scenario_key(report))
+    if baseline is None:
+        print('No baseline for this scenario.')
+        sys.exit(0)
+    worse = regressions(report, baseline, args.tolerance)
+    for name, before, after in worse:
+        print(f'Regression in {name}: {before} -> {after}')
+    sys.exit(1 if worse else 0)
@@ -0,0 +1,68 @@
+'''Races and databases shared by the tests.
+
+Builds race dicts in the format of the saved race JSON, and throwaway
+SQLite databases and data folders to write them to.
+'''
+
+from sqlalchemy import select, func
+import copy
+import json
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '../scraper'))
+from uploader import _connect_to_rds, race_table  # noqa: E402
+
+RACE = {
+    'uuid': 'a1', 'race_id': '26012022-1', 'date': '26/01/2022',
+    'race_number': '1', 'class': 'Class 4', 'length': 1200,
+    'going': 'GOOD', 'course': 'TURF - A COURSE', 'prize': 875000,
+    'pace': '24.09/22.51/22.85', 'url': 'https://a/1', 'image_link': 'i',
+    'runners': {
+        'uuid': ['r1', 'r2'], 'race_id': ['26012022-1', '26012022-1'],
+        'horse_id': ['E280', 'B123'], 'place': ['1', '2'],
+        'number': ['7', '3'], 'name': ['GOLDEN SIXTY', 'LUCKY GOR'],
+        'jockey': ['V Ho', 'Z Purton'], 'trainer': ['F C Lor', 'J Size'],
+        'actual_weight': ['133', '126'], 'declared_weight': ['1138', '1090'],
+        'draw': ['4', '1'], 'length_behind_winner': ['-', '1/2'],
+        'running_positions': ['5 5 1', '1 1 2'],
+        'finish_time': ['1:09.45', '1:09.53'], 'win_odds': ['2.3', '5.6'],
+        'url': ['https://a/h1', 'https://a/h2']
+        }
+    }
+
+
+def make_race(number: int, date: str = '26/01/2022',
+              course: str = 'TURF - A COURSE') -> dict:
+    '''A copy of RACE with its own race id, uuids and url.'''
+    race = copy.deepcopy(RACE)
+    race['race_id'] = f"{date.replace('/', '')}-{number}"
+    race['uuid'] = f"race-{race['race_id']}"
+    race['date'] = date
+    race['race_number'] = str(number)
+    race['course'] = course
+    race['url'] = f"https://a/{race['race_id']}"
+    race['runners']['race_id'] = [race['race_id']] * 2
+    race['runners']['uuid'] = [f"{race['race_id']}-{x}" for x in (1, 2)]
+    return race
+
+
+def sqlite_db(folder: str) -> dict:
+    '''Database parameters for an SQLite file in a folder.'''
+    return {'DATABASE_TYPE': 'sqlite',
+            'DATABASE': os.path.join(folder, 'test.db')}
+
+
+def save_race(folder: str, race: dict) -> None:
+    '''Save a race to a data folder as the scraper does.'''
+    os.makedirs(os.path.join(folder, race['race_id']))
+    path = os.path.join(folder, race['race_id'], f"{race['race_id']}.json")
+    with open(path, 'w') as f:
+        json.dump(race, f)
+
+
+def count(db: dict) -> int:
+    '''Number of rows in the race table.'''
+    with _connect_to_rds(db).connect() as conn:
+        return conn.execute(
+            select(func.count()).select_from(race_table)).scalar()
@@ -0,0 +1,138 @@
+'''Local HTTP stand-in for the Hong Kong Jockey Club website.
+
+Serves saved pages from tests/fixtures so the scraper can be exercised
+without reaching the real site.
+'''
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import hashlib
+import random
+import time
+import os
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'fixtures')
+RESULTS_PATH = '/racing/information/English/Racing/LocalResults.aspx'
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return f.read()
+
+
+class MockSite(object):
+    '''Threaded HTTP server returning canned responses.
+
+    Routes map a request path, including its query string, to a
+    (status, headers, body) tuple. Unknown paths return 404. Every
+    response is delayed by `latency` seconds, and a share `error_rate`
+    of requests fail with a 503. Requests whose If-None-Match header
+    matches the ETag of a route get a 304.
+    '''
+
+    def __init__(self, routes: dict = None, latency: float = 0,
+                 error_rate: float = 0, seed: int = None):
+        self.routes = routes if routes is not None else {}
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = []
+        self.errors = 0
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                site.requests.append(self.path)
+                time.sleep(site.latency)
+                status, headers, body = site.routes.get(
+                    self.path, (404, {}, b'Not Found'))
+                if site.error_rate and site.random.random() < site.error_rate:
+                    site.errors += 1
+                    status, headers, body = 503, {}, b'Service Unavailable'
+                etag = headers.get('ETag')
+                if etag and self.headers.get('If-None-Match') == etag:
+                    status, body = 304, b''
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                return
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+
+    @property
+    def base(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def url(self, path: str) -> str:
+        return f'{self.base}{path}'
+
+    def add_page(self, path: str, name: str, body: bytes = None) -> None:
+        body = body if body is not None else fixture(name)
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        self.routes[path] = (200, {'Content-Type': 'text/html',
+                                   'ETag': etag}, body)
+
+    def add_no_events(self, dates: list) -> None:
+        for date in dates:
+            self.add_page(f'{RESULTS_PATH}?RaceDate={date}', 'no_event.html')
+
+    def add_redirect(self, path: str, location: str) -> None:
+        self.routes[path] = (302, {'Location': location}, b'')
+
+    def start(self) -> 'MockSite':
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def meeting_site() -> MockSite:
+    '''A site with a two race meeting on 2022/01/26 and no event
+    the day before.'''
+    site = MockSite()
+    date = f'{RESULTS_PATH}?RaceDate=2022/01/26'
+    site.add_page(date, 'race_1.html')
+    for n in (1, 2):
+        site.add_page(f'{date}&Racecourse=HV&RaceNo={n}', f'race_{n}.html')
+    site.add_page(f'{RESULTS_PATH}?RaceDate=2022/01/25', 'no_event.html')
+    site.add_page(f'{RESULTS_PATH}?RaceDate=2022/01/24', 'abandoned.html')
+    site.routes['/racing/content/Images/photo/20220126/1L.jpg'] = (
+        200, {'Content-Type': 'image/jpeg'}, b'\xff\xd8race1\xff\xd9')
+    site.routes['/racing/content/Images/photo/20220126/2L.jpg'] = (
+        200, {'Content-Type': 'image/jpeg'}, b'\xff\xd8race2\xff\xd9')
+    return site
+
+
+def add_meeting(site: MockSite, date) -> None:
+    '''Serve the two race meeting of 2022/01/26 as if run on another
+    date, with its own race ids and photo finishes.'''
+    slash, day, compact = (date.strftime('%Y/%m/%d'),
+                           date.strftime('%d/%m/%Y'), date.strftime('%Y%m%d'))
+
+    def page(name: str) -> bytes:
+        return fixture(name).replace(b'2022/01/26', slash.encode()).replace(
+            b'26/01/2022', day.encode()).replace(b'20220126', compact.encode())
+
+    link = f'{RESULTS_PATH}?RaceDate={slash}'
+    site.add_page(link, 'race_1.html', page('race_1.html'))
+    for n in (1, 2):
+        site.add_page(f'{link}&Racecourse=HV&RaceNo={n}', f'race_{n}.html',
+                      page(f'race_{n}.html'))
+        site.routes[f'/racing/content/Images/photo/{compact}/{n}L.jpg'] = (
+            200, {'Content-Type': 'image/jpeg'},
+            b'\xff\xd8' + f'{compact}-{n}'.encode() + b'\xff\xd9')
@@ -0,0 +1,134 @@
+from unittest import mock
+import unittest
+import tempfile
+import json
+import sys
+import os
+sys.path.append('..')
+sys.path.append('../scraper')
+from scraper.web_scraper import Scraper  # noqa: E402
+from async_crawler import AsyncCrawler  # noqa: E402
+from rate_limiter import RateLimiter  # noqa: E402
+from uploader import _connect_to_rds, race_table  # noqa: E402
+from tests.mock_server import meeting_site, RESULTS_PATH  # noqa: E402
+from tests.helpers import RACE, sqlite_db  # noqa: E402
+
+
+@mock.patch('async_crawler.upload_to_bucket_by_id')
+@mock.patch('async_crawler.upload_to_rds_by_id')
+@mock.patch('async_crawler.no_event_insert')
+class AsyncCrawlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.site = meeting_site().start()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = sqlite_db(self.tmp.name)
+        self.scr = Scraper(backend='http')
+        self.scr.base_url = self.site.url(f'{RESULTS_PATH}?RaceDate=')
+        self.scr.raw_data_path = self.tmp.name
+
+    def tearDown(self):
+        self.site.stop()
+        self.tmp.cleanup()
+
+    def test_scrape_dates_concurrently(self, no_event, rds, s3):
+        links = [f'{self.scr.base_url}2022/01/{x}' for x in (26, 25, 24)]
+        self.scr.scrape_dates(links, self.db, 'bucket', concurrency=4)
+        for id in ('26012022-1', '26012022-2'):
+            folder = os.path.join(self.tmp.name, id)
+            with open(os.path.join(folder, f'{id}.json')) as f:
+                data = json.load(f)
+            self.assertEqual(data['race_id'], id)
+            self.assertEqual(data['runners']['race_id'][0], id)
+            self.assertTrue(os.path.exists(os.path.join(folder, f'{id}.jpg')))
+        self.assertCountEqual([x.args[0] for x in rds.call_args_list],
+                              ['26012022-1', '26012022-2'])
+        self.assertEqual(s3.call_count, 2)
+        self.assertCountEqual([x.args[1] for x in no_event.call_args_list],
+                              links[1:])
+        self.assertEqual(self.scr.index.no_event, set(links[1:]))
+        self.assertEqual(len(self.scr.index.retrieved), 2)
+
+    def test_skips_retrieved_urls(self, no_event, rds, s3):
+        link = f'{self.scr.base_url}2022/01/26'
+        race = {i: RACE[i] for i in RACE if i != 'runners'}
+        race['url'] = link
+        with _connect_to_rds(self.db).begin() as conn:
+            conn.execute(race_table.insert(), race)
+        self.scr.index = None
+        self.scr._load_index(self.db, [])
+        self.scr.index.add_no_event(f'{self.scr.base_url}2022/01/25')
+        self.scr.scrape_dates([link, f'{self.scr.base_url}2022/01/25'],
+                              self.db, 'bucket', concurrency=2)
+        self.assertEqual([x.args[0] for x in rds.call_args_list],
+                         ['26012022-2'])
+        self.assertNotIn(f'{RESULTS_PATH}?RaceDate=2022/01/25',
+                         self.site.requests)
+
+    def test_retries_server_errors(self, no_event, rds, s3):
+        path = f'{RESULTS_PATH}?RaceDate=2022/01/20'
+        self.site.routes[path] = (503, {}, b'')
+        self.scr.limiter = RateLimiter(backoff=0.01)
+        crawler = AsyncCrawler(self.scr, retries=2)
+        crawler.run([self.site.url(path),
+                     f'{self.scr.base_url}2022/01/26'], self.db, 'bucket')
+        self.assertEqual(self.site.requests.count(path), 3)
+        self.assertEqual(rds.call_count, 2)
+
+    def test_client_errors_are_not_retried(self, no_event, rds, s3):
+        path = f'{RESULTS_PATH}?RaceDate=2022/01/20'
+        self.site.routes[path] = (404, {}, b'')
+        crawler = AsyncCrawler(self.scr, retries=2)
+        crawler.run([self.site.url(path)], self.db, 'bucket')
+        self.assertEqual(self.site.requests.count(path), 1)
+        self.assertEqual(self.scr.limiter.host(self.site.base).failures, 0)
+
+    def test_client_error_releases_the_trial_request(self, no_event, rds, s3):
+        path = f'{RESULTS_PATH}?RaceDate=2022/01/20'
+        self.site.routes[path] = (404, {}, b'')
+        self.scr.limiter = RateLimiter(backoff=0, threshold=1, reset=0.01)
+        self.scr.limiter.failure(self.site.base)
+        crawler = AsyncCrawler(self.scr, retries=0)
+        crawler.run([self.site.url(path)], self.db, 'bucket')
+        self.assertFalse(self.scr.limiter.host(self.site.base).probing)
+
+    def test_races_without_results_do_not_trip_the_circuit(
+            self, no_event, rds, s3):
+        path = f'{RESULTS_PATH}?RaceDate=2022/01/26&Racecourse=HV&RaceNo=2'
+        self.site.add_page(path, 'no_event.html')
+        self.scr.limiter = RateLimiter(backoff=0.01, threshold=2)
+        crawler = AsyncCrawler(self.scr, retries=3)
+        crawler.run([f'{self.scr.base_url}2022/01/26'], self.db, 'bucket')
+        self.assertEqual(self.site.requests.count(path), 4)
+        self.assertEqual([x.args[0] for x in rds.call_args_list],
+                         ['26012022-1'])
+        host = self.scr.limiter.host(self.site.base)
+        self.assertEqual((host.failures, host.trips), (0, 0))
+
+    def test_race_that_fails_to_parse_is_skipped(self, no_event, rds, s3):
+        path = f'{RESULTS_PATH}?RaceDate=2022/01/26&Racecourse=HV&RaceNo=2'
+        self.site.routes[path] = (
+            200, {}, b'<html><body><p>Maintenance</p></body></html>')
+        crawler = AsyncCrawler(self.scr)
+        crawler.run([f'{self.scr.base_url}2022/01/26'], self.db, 'bucket')
+        self.assertEqual([x.args[0] for x in rds.call_args_list],
+                         ['26012022-1'])
+        self.assertEqual(len(self.scr.index.retrieved), 1)
+
+    def test_throughput_scales_with_concurrency(self, no_event, rds, s3):
+        self.site.latency = 0.05
+        dates = [f'2021/12/{str(x).zfill(2)}' for x in range(1, 25)]
+        self.site.add_no_events(dates)
+        links = [f'{self.scr.base_url}{x}' for x in dates]
+        rates = []
+        for concurrency in (1, 8):
+            self.scr.index = None
+            crawler = AsyncCrawler(self.scr, concurrency=concurrency)
+            crawler.run(links, self.db, 'bucket')
+            self.assertEqual(crawler.pages, len(links))
+            rates.append(crawler.pages_per_second)
+        self.assertGreater(rates[1], rates[0] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
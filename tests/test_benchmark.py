@@ -0,0 +1,52 @@
+import unittest
+import tempfile
+import sys
+import os
+sys.path.append('..')
+sys.path.append('../scraper')
+from tests.benchmark import (  # noqa: E402
+                        load_baselines,
+                        percentile,
+                        regressions,
+                        run,
+                        save_baseline
+                        )
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def test_run_reports_measurements(self):
+        report = run(dates=10, batch_size=5)
+        self.assertEqual(report['pages'], 18)
+        self.assertEqual(report['db_rows'], 8 * 7)
+        self.assertGreater(report['pages_per_second'], 0)
+        self.assertGreaterEqual(report['p95_ms'], report['p50_ms'])
+        self.assertGreater(report['peak_rss_mb'], 0)
+
+    def test_errors_are_retried(self):
+        report = run(dates=5, error_rate=0.1, seed=3)
+        self.assertGreater(report['errors'], 0)
+        self.assertEqual(report['db_rows'], 4 * 7)
+
+    def test_baselines(self):
+        report = {'scenario': {'dates': 1}, 'pages_per_second': 100,
+                  'db_rows_per_second': 50, 'p50_ms': 2, 'p95_ms': 4,
+                  'peak_rss_mb': 100}
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'baseline.json')
+            save_baseline(report, path)
+            baseline = load_baselines(path)['{"dates": 1}']
+        self.assertEqual(regressions(report, baseline), [])
+        slower = dict(report, pages_per_second=70, p95_ms=6)
+        self.assertEqual(regressions(slower, baseline), [
+            ('pages_per_second', 100, 70), ('p95_ms', 4, 6)])
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile([], 95), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
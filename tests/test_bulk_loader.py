@@ -0,0 +1,62 @@
+from sqlalchemy import event
+from unittest import mock
+import unittest
+import tempfile
+import sys
+sys.path.append('..')
+sys.path.append('../scraper')
+from uploader import (  # noqa: E402
+                        get_retrieved_urls,
+                        upload_folder_to_rds,
+                        _connect_to_rds
+                        )
+from bulk_loader import BulkLoader  # noqa: E402
+from tests.helpers import make_race, sqlite_db, save_race  # noqa: E402
+
+
+class BulkLoaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db = sqlite_db(self.tmp.name)
+
+    def test_flushes_full_batches_in_one_transaction(self):
+        engine = _connect_to_rds(self.db)
+        commits = []
+        event.listen(engine, 'commit', lambda conn: commits.append(1))
+        loader = BulkLoader(self.db, batch_size=3)
+        for x in range(1, 4):
+            loader.add(make_race(x))
+        self.assertEqual(loader.inserted, 3)
+        self.assertEqual(len(commits), 1)
+        loader.add(make_race(4))
+        self.assertEqual(loader.inserted, 3)
+        loader.flush()
+        self.assertEqual(loader.inserted, 4)
+        self.assertEqual(len(get_retrieved_urls(self.db)), 4)
+        with engine.connect() as con:
+            runners = con.execute('SELECT count(*) FROM runner').scalar()
+        self.assertEqual(runners, 8)
+
+    def test_duplicates_are_skipped(self):
+        with BulkLoader(self.db, batch_size=10) as loader:
+            loader.add(make_race(1))
+        with BulkLoader(self.db, batch_size=10) as loader:
+            loader.add(make_race(1))
+            loader.add(make_race(2))
+        self.assertEqual(loader.inserted, 1)
+        self.assertEqual(loader.skipped, 1)
+        self.assertEqual(len(get_retrieved_urls(self.db)), 2)
+
+    def test_upload_folder_to_rds(self):
+        for x in range(1, 6):
+            save_race(self.tmp.name, make_race(x))
+        with mock.patch('uploader.RAW_DATA_PATH', self.tmp.name):
+            self.assertEqual(upload_folder_to_rds(self.db, batch_size=2), 5)
+            self.assertEqual(upload_folder_to_rds(self.db, batch_size=2), 0)
+        self.assertEqual(len(get_retrieved_urls(self.db)), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
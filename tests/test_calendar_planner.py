@@ -0,0 +1,120 @@
+from sqlalchemy import select
+from unittest import mock
+import unittest
+import tempfile
+import datetime
+import sys
+sys.path.append('..')
+sys.path.append('../scraper')
+from scraper.web_scraper import Scraper  # noqa: E402
+from calendar_planner import CalendarPlanner, fixture_dates  # noqa: E402
+from uploader import _connect_to_rds, no_event_table  # noqa: E402
+from uploader import race_table  # noqa: E402
+from tests.mock_server import meeting_site, fixture  # noqa: E402
+from tests.mock_server import RESULTS_PATH  # noqa: E402
+from tests.helpers import RACE, sqlite_db  # noqa: E402
+
+FIXTURE_LIST = b'''<html><body><table>
+<tr><td>05/01/2022</td><td>Happy Valley</td></tr>
+<tr><td><a href="LocalResults.aspx?RaceDate=2022/01/09">09/01/2022</a></td>
+<td>Sha Tin</td></tr>
+<tr><td>12/01/2022</td><td>Happy Valley</td></tr>
+</table></body></html>'''
+
+
+def link(date: datetime.date) -> str:
+    return f"https://a{RESULTS_PATH}?RaceDate={date.strftime('%Y/%m/%d')}"
+
+
+class CalendarPlannerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db = sqlite_db(self.tmp.name)
+        self.planner = CalendarPlanner()
+
+    def test_fixture_dates(self):
+        self.assertEqual(fixture_dates(fixture('race_1.html')),
+                         {datetime.date(2022, 1, 26)})
+        self.assertEqual(len(self.planner.add_fixtures(FIXTURE_LIST)), 3)
+        self.assertEqual(
+            self.planner.probability(datetime.date(2022, 1, 9)), 1.0)
+        self.assertEqual(
+            self.planner.probability(datetime.date(2022, 1, 10)), 0.0)
+
+    def test_only_fixture_lists_span_days(self):
+        page = (b'<html><body><p>Printed 01/01/2022</p>'
+                b'<td>Updated on 31/01/2022</td></body></html>')
+        self.assertEqual(fixture_dates(page), set())
+        self.planner.add_fixtures(fixture('race_1.html'))
+        self.assertEqual(self.planner.meetings, {datetime.date(2022, 1, 26)})
+        self.assertEqual(self.planner.fixture_spans, [])
+
+    def test_failed_probes_are_not_learned(self):
+        site = meeting_site().start()
+        self.addCleanup(site.stop)
+        site.routes[f'{RESULTS_PATH}?RaceDate=2022/01/20'] = (503, {}, b'')
+        links = [site.url(f'{RESULTS_PATH}?RaceDate=2022/01/{x}')
+                 for x in (20, 25, 26)]
+        self.assertEqual(self.planner.probe(links), {links[0], links[2]})
+        self.assertEqual(self.planner.meetings, {datetime.date(2022, 1, 26)})
+        self.assertEqual(self.planner.no_events, {datetime.date(2022, 1, 25)})
+
+    def test_learns_weekdays_and_months(self):
+        with _connect_to_rds(self.db).begin() as conn:
+            conn.execute(race_table.insert(), {
+                i: RACE[i] for i in RACE if i != 'runners'})
+            conn.execute(no_event_table.insert(), {'url': link(
+                datetime.date(2022, 1, 25))})
+        self.planner.learn(self.db)
+        self.assertEqual(self.planner.meetings, {datetime.date(2022, 1, 26)})
+        first = datetime.date(2021, 1, 1)
+        for x in range(2 * 364):
+            day = first + datetime.timedelta(days=x)
+            if day.month in (7, 8) or day.weekday() not in (2, 6):
+                self.planner.no_events.add(day)
+            else:
+                self.planner.meetings.add(day)
+        wednesday = datetime.date(2023, 3, 1)
+        self.assertGreater(self.planner.probability(wednesday), 0.9)
+        self.assertLess(self.planner.probability(
+            wednesday + datetime.timedelta(days=1)), 0.05)
+        self.assertLess(self.planner.probability(
+            datetime.date(2023, 7, 12)), 0.1)
+        links = [link(wednesday + datetime.timedelta(days=x))
+                 for x in range(7)] + [link(datetime.date(2022, 1, 25))]
+        plan = self.planner.plan(links)
+        self.assertEqual(plan.likely, [links[0], links[4]])
+        self.assertEqual(plan.uncertain, [])
+        self.assertEqual(len(plan.unlikely), 5)
+        self.assertEqual(plan.skipped, [links[7]])
+        plan = CalendarPlanner().plan(links)
+        self.assertEqual(plan.uncertain, links)
+
+    @mock.patch('scraper.web_scraper.upload_to_bucket_by_id')
+    @mock.patch('scraper.web_scraper.upload_to_rds_by_id')
+    def test_scraper_probes_unlikely_dates(self, rds, s3):
+        site = meeting_site().start()
+        self.addCleanup(site.stop)
+        scr = Scraper(backend='http')
+        scr.base_url = site.url(f'{RESULTS_PATH}?RaceDate=')
+        scr.raw_data_path = self.tmp.name
+        scr.planner = self.planner = CalendarPlanner(probe=0.6)
+        self.planner.no_events.add(datetime.date(2022, 1, 24))
+        links = [f'{scr.base_url}2022/01/{x}' for x in (24, 25, 26)]
+        scr.scrape_dates(links, self.db, 'bucket')
+        scr.images.close()
+        self.assertNotIn(f'{RESULTS_PATH}?RaceDate=2022/01/24',
+                         site.requests)
+        self.assertEqual(
+            site.requests.count(f'{RESULTS_PATH}?RaceDate=2022/01/25'), 1)
+        with _connect_to_rds(self.db).connect() as conn:
+            self.assertEqual(conn.execute(
+                select(no_event_table.c.url)).scalars().all(), [links[1]])
+        self.assertEqual(rds.call_count, 2)
+        self.assertIn(datetime.date(2022, 1, 26), self.planner.meetings)
+
+
+if __name__ == '__main__':
+    unittest.main()
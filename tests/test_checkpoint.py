@@ -0,0 +1,108 @@
+from unittest import mock
+import unittest
+import tempfile
+import sys
+import os
+sys.path.append('..')
+sys.path.append('../scraper')
+from scraper.web_scraper import Scraper  # noqa: E402
+from checkpoint import RunState  # noqa: E402
+from tests.mock_server import meeting_site, RESULTS_PATH  # noqa: E402
+from tests.helpers import sqlite_db  # noqa: E402
+
+
+class RunStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'checkpoint.db')
+
+    def test_resume_keeps_the_recorded_run(self):
+        state = RunState(self.path)
+        self.assertEqual(state.start(['a', 'b']), ['a', 'b'])
+        state.set_card('a', ['a', 'a2'])
+        state.close()
+        state = RunState(self.path)
+        self.assertEqual(state.start(['c'], resume=True), ['a', 'b'])
+        self.assertEqual(state.date_status('a'), 'parsed')
+        self.assertEqual(state.card('a'), ['a', 'a2'])
+        self.assertEqual(state.start(['c']), ['c'])
+        self.assertEqual(state.date_status('a'), 'pending')
+
+    def test_statuses_only_move_forwards(self):
+        state = RunState(self.path)
+        state.set_race('a', 'saved', '26012022-1')
+        state.set_race('a', 'fetched')
+        self.assertEqual(state.race_status('a'), 'saved')
+        self.assertEqual(state.races('saved'), [('a', '26012022-1')])
+        state.set_date('d', 'parsed')
+        state.set_date('d', 'fetched')
+        self.assertEqual(state.date_status('d'), 'parsed')
+
+    def test_date_finishes_once_every_race_is_saved(self):
+        state = RunState(self.path)
+        state.set_card('d', ['a', 'b'])
+        state.set_race('a', 'uploaded')
+        self.assertFalse(state.finish_date('d'))
+        state.set_race('b', 'saved')
+        self.assertTrue(state.finish_date('d'))
+        self.assertEqual(state.counts(), {
+            'dates': {'done': 1}, 'races': {'saved': 1, 'uploaded': 1}})
+
+
+@mock.patch('scraper.web_scraper.upload_to_bucket_by_id')
+@mock.patch('scraper.web_scraper.upload_to_rds_by_id')
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.site = meeting_site().start()
+        self.addCleanup(self.site.stop)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db = sqlite_db(self.tmp.name)
+        self.path = os.path.join(self.tmp.name, 'checkpoint.db')
+        self.scr = self.scraper()
+        self.links = [f'{self.scr.base_url}2022/01/{x}' for x in (26, 25)]
+
+    def scraper(self) -> Scraper:
+        scr = Scraper(backend='http')
+        scr.base_url = self.site.url(f'{RESULTS_PATH}?RaceDate=')
+        scr.raw_data_path = self.tmp.name
+        scr.checkpoint_path = self.path
+        return scr
+
+    def test_resume_after_crash_while_uploading(self, rds, s3):
+        s3.side_effect = [True, Exception('Instance reclaimed')]
+        with self.assertRaises(Exception):
+            self.scr.scrape_dates(self.links, self.db, 'bucket')
+        self.site.requests.clear()
+        s3.side_effect = None
+        with mock.patch('uploader.RAW_DATA_PATH', self.tmp.name):
+            self.scraper().scrape_dates([], self.db, 'bucket', resume=True)
+        self.assertEqual(self.site.requests,
+                         [f'{RESULTS_PATH}?RaceDate=2022/01/25'])
+        self.assertEqual(rds.call_count, 2)
+        self.assertEqual(s3.call_args.args[0], '26012022-2')
+        state = RunState(self.path)
+        self.assertEqual(state.counts(), {
+            'dates': {'done': 2}, 'races': {'uploaded': 2}})
+
+    def test_resume_refetches_only_unsaved_races(self, rds, s3):
+        with mock.patch.object(Scraper, '_save_image',
+                               side_effect=[True, KeyboardInterrupt]):
+            with self.assertRaises(KeyboardInterrupt):
+                self.scr.scrape_dates(self.links, self.db, 'bucket')
+        self.scr.images.close()
+        self.site.requests.clear()
+        self.scraper().scrape_dates([], self.db, 'bucket', resume=True)
+        race_2 = f'{RESULTS_PATH}?RaceDate=2022/01/26&Racecourse=HV&RaceNo=2'
+        self.assertEqual(self.site.requests[0], race_2)
+        self.assertNotIn(f'{RESULTS_PATH}?RaceDate=2022/01/26',
+                         self.site.requests)
+        self.assertEqual([x.args[0] for x in s3.call_args_list],
+                         ['26012022-1', '26012022-2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+from unittest import mock
+import configparser
+import contextlib
+import subprocess
+import unittest
+import tempfile
+import runpy
+import io
+import sys
+import os
+sys.path.append('..')
+sys.path.append('../scraper')
+import driver_pool  # noqa: E402
+from tests.helpers import count, make_race  # noqa: E402
+from tests.helpers import sqlite_db, save_race  # noqa: E402
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    '../scraper/__main__.py')
+cli = runpy.run_path(MAIN)
+main, parse_args = cli['main'], cli['parse_args']
+
+
+class CliTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.raw_data_path = os.path.join(self.tmp.name, 'raw_data')
+
+    def test_scrapes_without_a_subcommand(self):
+        args = parse_args(['--resume', '--backend', 'http'])
+        self.assertEqual(args.command, 'scrape')
+        self.assertTrue(args.resume)
+        self.assertEqual(parse_args(['status']).command, 'status')
+
+    def test_scrape_options(self):
+        args = parse_args(['scrape', '--concurrency', '8', '--pool-size',
+                           '4', '--batch-size', '50', '--queue', 'q.db',
+                           '--dedup', 'd.json'])
+        self.assertEqual((args.concurrency, args.pool_size, args.batch_size,
+                          args.queue, args.dedup),
+                         (8, 4, 50, 'q.db', 'd.json'))
+        self.assertEqual(args.metrics_host, parse_args(['daemon']).host)
+
+    def test_scrape_closes_the_scraper_when_it_fails(self):
+        args = parse_args(['scrape', '--batch-size', '50',
+                           '--raw-data', self.raw_data_path])
+        config = configparser.ConfigParser()
+        config.read_dict({'RDS': {}, 'S3': {'BUCKET': 'races'}})
+        with mock.patch('web_scraper.Scraper') as scraper:
+            scr = scraper.return_value
+            scr.checkpoint_path = None
+            scr.storage = scr.pool = scr.cache = None
+            scr.scrape_dates.side_effect = RuntimeError('site down')
+            with self.assertRaises(RuntimeError):
+                cli['scrape_command'](args, config)
+        self.assertEqual(scraper.call_args.kwargs['batch_size'], 50)
+        self.assertIsNone(scr.checkpoint_path)
+        self.assertIsNone(scr.storage)
+        scr.images.close.assert_called_once()
+        scr.driver.quit.assert_called_once()
+
+    def test_status_skips_heavy_imports(self):
+        save_race(self.raw_data_path, make_race(1))
+        argv = [MAIN, 'status', '--raw-data', self.raw_data_path]
+        code = (f'import runpy, sys; sys.argv = {argv}; '
+                'runpy.run_path(sys.argv[0], run_name="__main__"); '
+                'print(sorted(x for x in ("selenium", "aiohttp", "pandas", '
+                '"boto3") if x in sys.modules))')
+        result = subprocess.run(
+            [sys.executable, '-c', code],
+            capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.splitlines(),
+                         ['Saved races: 1', 'Run state: no checkpoint', '[]'])
+
+    def test_upload_writes_saved_races(self):
+        for number in (1, 2):
+            save_race(self.raw_data_path, make_race(number))
+        db = sqlite_db(self.tmp.name)
+        config = configparser.ConfigParser()
+        config.read_dict({'STORAGE': {
+            'SINKS': 'sqlite', 'SQLITE_PATH': db['DATABASE']}})
+        path = os.path.join(self.tmp.name, 'config.ini')
+        with open(path, 'w') as f:
+            config.write(f)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            main(['upload', '--config', path,
+                  '--raw-data', self.raw_data_path])
+        self.assertIn('Uploaded 2 races', out.getvalue())
+        self.assertEqual(count(db), 2)
+
+    def test_chromedriver_resolved_locally(self):
+        driver_pool.chromedriver_path.cache_clear()
+        self.addCleanup(driver_pool.chromedriver_path.cache_clear)
+        with mock.patch.dict(os.environ, {'CHROMEDRIVER_PATH': '/a/b'}):
+            self.assertEqual(driver_pool.chromedriver_path(), '/a/b')
+        driver_pool.chromedriver_path.cache_clear()
+        driver = os.path.join(self.tmp.name, 'chromedriver')
+        with open(driver, 'w') as f:
+            f.write('#!/bin/sh\n')
+        os.chmod(driver, 0o755)
+        with mock.patch.dict(os.environ, {'CHROMEDRIVER_PATH': '',
+                                          'PATH': self.tmp.name}):
+            self.assertEqual(driver_pool.chromedriver_path(), driver)
+
+
+if __name__ == '__main__':
+    unittest.main()
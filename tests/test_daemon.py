@@ -0,0 +1,110 @@
+from sqlalchemy import select
+import urllib.request
+import urllib.error
+import unittest
+import tempfile
+import datetime
+import json
+import time
+import sys
+sys.path.append('..')
+sys.path.append('../scraper')
+from scraper.web_scraper import Scraper  # noqa: E402
+from daemon import Daemon, HKT  # noqa: E402
+from metrics import MetricsServer  # noqa: E402
+from rate_limiter import RateLimiter  # noqa: E402
+from storage import SQLSink, Storage  # noqa: E402
+from uploader import _connect_to_rds, no_event_table  # noqa: E402
+from tests.mock_server import meeting_site, RESULTS_PATH  # noqa: E402
+from tests.helpers import count, sqlite_db  # noqa: E402
+
+MEETING = datetime.date(2022, 1, 26)
+
+
+def hkt(hour: int, minute: int = 0, day: datetime.date = MEETING) -> float:
+    return datetime.datetime.combine(
+        day, datetime.time(hour, minute), tzinfo=HKT).timestamp()
+
+
+class DaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db = sqlite_db(self.tmp.name)
+        self.site = meeting_site().start()
+        self.addCleanup(self.site.stop)
+        self.scr = Scraper(backend='http',
+                           limiter=RateLimiter(backoff=0.01))
+        self.addCleanup(self.scr.images.close)
+        self.scr.base_url = self.site.url(f'{RESULTS_PATH}?RaceDate=')
+        self.scr.raw_data_path = self.tmp.name
+        self.scr.storage = Storage([SQLSink(self.db)])
+        self.scr.retries = 1
+        self.daemon = Daemon(self.scr, self.db, 'bucket', lookback=1,
+                             poll=300)
+        self.link = self.daemon.link(MEETING)
+        self.race_2 = f'{RESULTS_PATH}?RaceDate=2022/01/26&Racecourse=HV' \
+            '&RaceNo=2'
+
+    def test_schedules_after_the_last_race(self):
+        self.daemon.planner.no_events.add(MEETING - datetime.timedelta(1))
+        old = self.daemon.link(MEETING - datetime.timedelta(7))
+        self.scr.cards[old] = [old]
+        self.scr._load_index(self.db, [old])
+        self.scr.index.add_retrieved(old)
+        self.assertEqual(self.daemon.run_once(hkt(20)), [])
+        self.assertEqual(self.scr.cards, {})
+        self.assertEqual(self.scr.index.retrieved, set())
+        self.assertEqual(self.scr.index.dates, set())
+        self.assertEqual(self.daemon.pending, {self.link: hkt(23)})
+        self.assertEqual(self.site.requests, [])
+        self.assertEqual(self.daemon.schedule(hkt(23, 1)), [self.link])
+
+    def test_polls_until_final(self):
+        unpublished = self.site.routes[self.race_2]
+        self.site.add_page(self.race_2, 'no_event.html')
+        self.daemon.planner.no_events.add(MEETING - datetime.timedelta(1))
+        self.assertEqual(self.daemon.run_once(hkt(23, 5)), [self.link])
+        self.assertEqual(count(self.db), 1)
+        self.assertIn(self.link, self.scr.cards)
+        self.assertEqual(self.daemon.pending[self.link], hkt(23, 10))
+        self.site.routes[self.race_2] = unpublished
+        self.assertEqual(self.daemon.run_once(hkt(23, 6)), [])
+        self.daemon.run_once(hkt(23, 10))
+        self.assertEqual(count(self.db), 2)
+        self.assertEqual(self.daemon.pending, {})
+        self.assertEqual(self.daemon.final, {self.link})
+        self.assertEqual(self.scr.cards, {})
+        self.assertEqual(self.daemon.runs, 2)
+
+    def test_waits_for_results_to_be_published(self):
+        self.site.add_page(f'{RESULTS_PATH}?RaceDate=2022/01/26',
+                           'no_event.html')
+        self.daemon.lookback = 0
+        self.daemon.run_once(hkt(23, 5))
+        self.assertEqual(self.daemon.runs, 0)
+        self.assertIn(self.link, self.daemon.pending)
+        self.daemon.run_once(hkt(23) + self.daemon.give_up)
+        self.assertEqual(self.daemon.final, {self.link})
+        with _connect_to_rds(self.db).connect() as conn:
+            self.assertEqual(conn.execute(
+                select(no_event_table.c.url)).scalars().all(), [self.link])
+
+    def test_health(self):
+        server = MetricsServer(port=0).start()
+        self.addCleanup(server.stop)
+        server.routes['/health'] = self.daemon.health
+        url = f'http://127.0.0.1:{server.port}/health'
+        self.daemon.last_tick = time.time()
+        with urllib.request.urlopen(url) as response:
+            self.assertEqual(json.load(response)['status'], 'ok')
+        self.daemon.last_error = (time.time(), 'ValueError()')
+        with self.assertRaises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(url)
+        self.assertEqual(e.exception.code, 503)
+        self.assertEqual(json.load(e.exception)['status'], 'failing')
+
+
+if __name__ == '__main__':
+    unittest.main()
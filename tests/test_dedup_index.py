@@ -0,0 +1,82 @@
+from sqlalchemy import event
+import unittest
+import tempfile
+import sys
+import os
+sys.path.append('..')
+sys.path.append('../scraper')
+from uploader import (  # noqa: E402
+                    _connect_to_rds,
+                    no_event_insert,
+                    race_table
+                    )
+from dedup_index import DedupIndex, race_date  # noqa: E402
+from tests.helpers import RACE, sqlite_db  # noqa: E402
+
+BASE = 'https://a/LocalResults.aspx?RaceDate='
+
+
+def insert_race(db: dict, date: str, url: str) -> None:
+    race = {i: RACE[i] for i in RACE if i != 'runners'}
+    race.update({'race_id': url, 'date': date, 'url': url})
+    with _connect_to_rds(db).begin() as conn:
+        conn.execute(race_table.insert(), race)
+
+
+class DedupIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db = sqlite_db(self.tmp.name)
+        insert_race(self.db, '26/01/2022', f'{BASE}2022/01/26')
+        insert_race(self.db, '26/01/2022', f'{BASE}2022/01/26&RaceNo=2')
+        insert_race(self.db, '23/01/2022', f'{BASE}2022/01/23')
+        no_event_insert(self.db, f'{BASE}2022/01/25')
+        no_event_insert(self.db, f'{BASE}2022/01/24')
+
+    def test_race_date(self):
+        self.assertEqual(race_date(f'{BASE}2022/01/26&RaceNo=2'),
+                         '26/01/2022')
+
+    def test_loads_only_requested_dates(self):
+        index = DedupIndex(self.db)
+        index.load([f'{BASE}2022/01/26', f'{BASE}2022/01/25'])
+        self.assertEqual(index.retrieved, {f'{BASE}2022/01/26',
+                                           f'{BASE}2022/01/26&RaceNo=2'})
+        self.assertEqual(index.no_event, {f'{BASE}2022/01/25'})
+        index.load([f'{BASE}2022/01/23'])
+        self.assertIn(f'{BASE}2022/01/23', index.retrieved)
+        self.assertNotIn(f'{BASE}2022/01/24', index.no_event)
+
+    def test_persisted_dates_are_not_queried_again(self):
+        path = os.path.join(self.tmp.name, 'index', 'dedup.json')
+        index = DedupIndex(self.db, path)
+        index.load([f'{BASE}2022/01/26'])
+        index.add_retrieved(f'{BASE}2022/01/26&RaceNo=3')
+        index.save()
+        restarted = DedupIndex(self.db, path)
+        self.assertEqual(restarted.retrieved, index.retrieved)
+        statements = []
+        event.listen(_connect_to_rds(self.db), 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args:
+                     statements.append(statement))
+        restarted.load([f'{BASE}2022/01/26'])
+        self.assertFalse([x for x in statements if 'FROM race' in x])
+        self.assertEqual(restarted.dates, {'26/01/2022'})
+
+    def test_prune_keeps_the_given_dates(self):
+        index = DedupIndex(self.db)
+        index.load([f'{BASE}2022/01/26', f'{BASE}2022/01/25',
+                    f'{BASE}2022/01/23'])
+        index.prune([f'{BASE}2022/01/26'])
+        self.assertEqual(index.retrieved, {f'{BASE}2022/01/26',
+                                           f'{BASE}2022/01/26&RaceNo=2'})
+        self.assertEqual(index.no_event, set())
+        self.assertEqual(index.dates, {'26/01/2022'})
+        index.load([f'{BASE}2022/01/23'])
+        self.assertIn(f'{BASE}2022/01/23', index.retrieved)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+from unittest import mock
+import unittest
+import tempfile
+import threading
+import sys
+import os
+sys.path.append('..')
+sys.path.append('../scraper')
+from scraper.web_scraper import Scraper  # noqa: E402
+from driver_pool import DriverPool  # noqa: E402
+from tests.mock_server import meeting_site, RESULTS_PATH  # noqa: E402
+from tests.helpers import sqlite_db  # noqa: E402
+
+
+class FakeDriver(object):
+
+    def __init__(self):
+        self.crashed = False
+        self.quit_called = False
+
+    @property
+    def current_url(self):
+        if self.crashed:
+            raise ConnectionError('driver crashed')
+        return 'about:blank'
+
+    def quit(self):
+        self.quit_called = True
+
+
+class DriverPoolTest(unittest.TestCase):
+
+    def test_map_spreads_work_across_drivers(self):
+        pool = DriverPool(size=3, factory=FakeDriver).start()
+        barrier = threading.Barrier(3)
+
+        def work(driver, item):
+            barrier.wait(timeout=5)
+            return id(driver), item * 2
+
+        results = pool.map(work, [1, 2, 3])
+        self.assertEqual([x[1] for x in results], [2, 4, 6])
+        self.assertEqual(len({x[0] for x in results}), 3)
+        pool.close()
+
+    def test_recycles_crashed_driver(self):
+        pool = DriverPool(size=1, factory=FakeDriver).start()
+        with pool.driver() as driver:
+            driver.crashed = True
+        with pool.driver() as replacement:
+            self.assertIsNot(replacement, driver)
+        self.assertTrue(driver.quit_called)
+        self.assertEqual(pool.recycled, 1)
+
+    def test_recycles_driver_that_raises(self):
+        pool = DriverPool(size=1, factory=FakeDriver).start()
+        results = pool.map(lambda d, x: 1 / x, [0, 1])
+        self.assertIsInstance(results[0], ZeroDivisionError)
+        self.assertEqual(results[1], 1)
+        self.assertEqual(pool.recycled, 1)
+
+    def test_slot_kept_when_replacement_fails_to_start(self):
+        starts = iter([FakeDriver(), ConnectionError('chrome failed'),
+                       FakeDriver()])
+
+        def factory():
+            driver = next(starts)
+            if isinstance(driver, Exception):
+                raise driver
+            return driver
+
+        pool = DriverPool(size=1, factory=factory, timeout=5).start()
+        results = pool.map(lambda d, x: 1 / x, [0, 1, 2])
+        self.assertIsInstance(results[0], ZeroDivisionError)
+        self.assertEqual(results[1:], [1, 0.5])
+        pool.close()
+
+    def test_checkout_times_out(self):
+        pool = DriverPool(size=1, factory=FakeDriver, timeout=0.05).start()
+        with pool.driver():
+            with self.assertRaises(TimeoutError):
+                with pool.driver():
+                    pass
+
+    def test_recycles_after_max_uses(self):
+        pool = DriverPool(size=1, factory=FakeDriver, max_uses=2).start()
+        drivers = pool.map(lambda d, x: d, range(5))
+        self.assertEqual(len({id(x) for x in drivers[:2]}), 1)
+        self.assertIsNot(drivers[1], drivers[2])
+        self.assertEqual(pool.recycled, 2)
+        self.assertEqual(len(pool.uses), 1)
+
+
+@mock.patch('scraper.web_scraper.upload_to_bucket_by_id')
+@mock.patch('scraper.web_scraper.upload_to_rds_by_id')
+class PooledScraperTest(unittest.TestCase):
+
+    def test_scrape_dates_with_pool(self, rds, s3):
+        site = meeting_site().start()
+        with tempfile.TemporaryDirectory() as tmp:
+            scr = Scraper(backend='http', pool_size=2)
+            scr.base_url = site.url(f'{RESULTS_PATH}?RaceDate=')
+            scr.raw_data_path = tmp
+            scr.scrape_dates([f'{scr.base_url}2022/01/26'], sqlite_db(tmp),
+                             'bucket')
+            for id in ('26012022-1', '26012022-2'):
+                self.assertTrue(
+                    os.path.exists(os.path.join(tmp, id, f'{id}.json')))
+                self.assertTrue(
+                    os.path.exists(os.path.join(tmp, id, f'{id}.jpg')))
+            scr.pool.close()
+        site.stop()
+        self.assertEqual(rds.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+from sqlalchemy import select
+import unittest
+import tempfile
+import json
+import time
+import sys
+sys.path.append('..')
+sys.path.append('../scraper')
+from scraper.web_scraper import Scraper  # noqa: E402
+from bulk_loader import BulkLoader  # noqa: E402
+from horse_crawler import HorseCrawler, parse_profile  # noqa: E402
+from rate_limiter import CircuitOpenError  # noqa: E402
+from storage import SQLSink, Storage  # noqa: E402
+from uploader import _connect_to_rds, horse_table  # noqa: E402
+from tests.mock_server import MockSite, meeting_site  # noqa: E402
+from tests.mock_server import fixture, RESULTS_PATH  # noqa: E402
+from tests.helpers import make_race, sqlite_db  # noqa: E402
+
+HORSE_PATH = '/racing/information/English/Horse/Horse.aspx?HorseId='
+
+
+def horses(db: dict) -> dict:
+    with _connect_to_rds(db).connect() as conn:
+        return {x.horse_id: x for x in conn.execute(select(horse_table))}
+
+
+class HorseCrawlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db = sqlite_db(self.tmp.name)
+
+    def test_parse_profile(self):
+        name, profile = parse_profile(fixture('horse.html'))
+        self.assertEqual(name, 'LUCKY STAR')
+        self.assertEqual(profile['Country of Origin / Age'], 'NZ / 5')
+        self.assertEqual(profile['Trainer'], 'J Size')
+        self.assertEqual(len(profile), 10)
+
+    def test_fetches_each_horse_once_per_ttl(self):
+        site = MockSite().start()
+        self.addCleanup(site.stop)
+        site.add_page('/h1', 'horse.html')
+        with BulkLoader(self.db) as loader:
+            for number in (1, 2, 3):
+                race = make_race(number)
+                race['runners']['url'] = [site.url('/h1'), site.url('/h2')]
+                loader.add(race)
+        crawler = HorseCrawler(self.db, ttl=60)
+        self.assertEqual(crawler.crawl(), 1)
+        self.assertEqual(sorted(site.requests), ['/h1', '/h2'])
+        self.assertEqual(list(crawler.failed), ['B123'])
+        self.assertEqual(crawler.crawl(), 0)
+        self.assertEqual(len(site.requests), 2)
+        row = horses(self.db)['E280']
+        self.assertEqual(row.name, 'LUCKY STAR')
+        self.assertEqual(json.loads(row.profile)['Sire'], 'Savabeel')
+        self.assertCountEqual(crawler.pending(time.time() + 61),
+                              [('E280', site.url('/h1')),
+                               ('B123', site.url('/h2'))])
+        self.assertEqual(crawler.failed, {})
+
+    def test_open_circuit_skips_without_failing(self):
+        class Limiter(object):
+            def send(self, session, url, **kwargs):
+                raise CircuitOpenError(url)
+
+        crawler = HorseCrawler(self.db, limiter=Limiter())
+        self.assertIsNone(crawler.fetch(None, 'E280', 'https://a/h1'))
+        self.assertEqual(crawler.failed, {})
+
+    def test_crawls_alongside_scraper(self):
+        site = meeting_site().start()
+        self.addCleanup(site.stop)
+        ids = ('HK_2019_E280', 'HK_2019_B123', 'HK_2019_C456',
+               'HK_2019_D789', 'HK_2019_E012')
+        for id in ids:
+            site.add_page(f'{HORSE_PATH}{id}', 'horse.html')
+        scr = Scraper(backend='http')
+        scr.base_url = site.url(f'{RESULTS_PATH}?RaceDate=')
+        scr.raw_data_path = self.tmp.name
+        scr.storage = Storage([SQLSink(self.db)])
+        scr.horses = HorseCrawler(self.db, limiter=scr.limiter, interval=0.05)
+        scr.scrape_dates([f'{scr.base_url}2022/01/26'], self.db, 'bucket')
+        scr.images.close()
+        self.assertEqual(len(horses(self.db)), 5)
+        for id in ids:
+            self.assertEqual(site.requests.count(f'{HORSE_PATH}{id}'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
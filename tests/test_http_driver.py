@@ -0,0 +1,123 @@
+import unittest
+import sys
+sys.path.append('..')
+sys.path.append('../scraper')
+from scraper.web_scraper import Scraper  # noqa: E402
+from http_driver import HttpDriver, HtmlPage, PageLoadError  # noqa: E402
+from page_parser import PageParser  # noqa: E402
+from tests.mock_server import meeting_site, RESULTS_PATH  # noqa: E402
+
+
+class HttpDriverTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.site = meeting_site().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.site.stop()
+
+    def setUp(self):
+        self.scr = Scraper(backend='http')
+        self.date_link = self.site.url(f'{RESULTS_PATH}?RaceDate=2022/01/26')
+
+    def tearDown(self):
+        self.scr.driver.quit()
+
+    def test_http_backend(self):
+        self.assertIsInstance(self.scr.driver, HttpDriver)
+        self.assertTrue(self.scr._load_page(self.scr.driver, self.date_link))
+        self.assertEqual(self.scr.page_latency[0][0], self.date_link)
+        with self.assertRaises(ValueError):
+            Scraper(backend='firefox')
+
+    def test_error_pages_are_not_loaded(self):
+        link = self.site.url(f'{RESULTS_PATH}?RaceDate=2022/01/27')
+        with self.assertRaises(PageLoadError):
+            self.scr.driver.get(link)
+        self.assertFalse(self.scr._load_page(self.scr.driver, link))
+        driver = HttpDriver(retries=0)
+        self.addCleanup(driver.quit)
+        with self.assertRaises(PageLoadError):
+            driver.get('http://127.0.0.1:9/')
+
+    def test_generate_id(self):
+        self.scr.driver.get(self.date_link)
+        self.assertEqual(self.scr.parser.generate_id(), {
+            'race_id': '26012022-1',
+            'date': '26/01/2022',
+            'race_number': '1'
+            })
+
+    def test_race_dict(self):
+        self.scr.driver.get(self.date_link)
+        self.assertEqual(self.scr.parser.race_dict(), {
+            'class': 'Class 4',
+            'length': 1200,
+            'going': 'GOOD',
+            'course': 'TURF - A COURSE',
+            'prize': 875000,
+            'pace': '24.09/22.51/22.85',
+            'url': self.date_link
+            })
+
+    def test_runner_dict(self):
+        self.scr.driver.get(self.date_link)
+        runners = self.scr.parser.runner_dict()
+        self.assertEqual(len(runners['uuid']), 3)
+        self.assertEqual(runners['horse_id'], ['E280', 'B123', 'C456'])
+        self.assertEqual(runners['name'][0], 'GOLDEN SIXTY')
+        self.assertEqual(runners['number'], ['7', '3', '11'])
+        self.assertEqual(runners['running_positions'][0], '5 5 1')
+        self.assertEqual(runners['finish_time'][2], '1:09.65')
+        self.assertTrue(runners['url'][0].startswith(self.site.base))
+
+    def test_card_races_and_image(self):
+        self.scr.driver.get(self.date_link)
+        self.assertEqual(self.scr.parser.card_races(), [self.site.url(
+            f'{RESULTS_PATH}?RaceDate=2022/01/26&Racecourse=HV&RaceNo=2')])
+        self.assertEqual(
+            self.scr.parser.image_link(),
+            self.site.url('/racing/content/Images/photo/20220126/1L.jpg'))
+
+    def test_if_event(self):
+        self.scr.driver.get(self.date_link)
+        self.assertFalse(self.scr.parser.if_event(self.date_link))
+        for day in ('25', '24'):
+            link = self.site.url(f'{RESULTS_PATH}?RaceDate=2022/01/{day}')
+            self.scr.driver.get(link)
+            self.assertTrue(self.scr.parser.if_event(link))
+
+    def test_runner_rows_in_one_pass(self):
+        self.scr.driver.get(self.date_link)
+        rows = self.scr.driver.table_rows(
+            '/html/body/div/div[5]/table/tbody/tr')
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0][2][0], 'GOLDEN SIXTY(E280)')
+        self.assertTrue(rows[0][2][1].startswith(self.site.base))
+        self.assertIsNone(rows[0][0][1])
+
+    def test_ragged_runner_rows(self):
+        cells = ''.join(f'<td>{x}</td>' for x in (
+            'WV', '4', '<a href="/h?HorseId=X1">LATE</a>(X1)', 'J', 'T',
+            '120', '1100', '5'))
+        full = ''.join(f'<td>{x}</td>' for x in (
+            '1', '2', '<a href="/h?HorseId=Y2">FIRST</a>(Y2)', 'J', 'T',
+            '126', '1090', '3', '-', '1 1', '1:09.45', '2.3'))
+        page = HtmlPage('https://a/race', (
+            '<html><body><div><div></div><div></div><div></div><div></div>'
+            '<div><table><tbody>'
+            f'<tr>{full}</tr><tr>{cells}</tr><tr><td>DISQ</td></tr>'
+            '</tbody></table></div></div></body></html>'))
+        runners = PageParser(page).runners('26012022-1')
+        self.assertEqual([x.horse_id for x in runners], ['Y2', 'X1'])
+        self.assertEqual(runners[1].url, 'https://a/h?HorseId=X1')
+        self.assertEqual(runners[1].place, 'WV')
+        self.assertIsNone(runners[1].finish_time)
+        self.assertEqual(runners[1].text('finish_time'), '')
+        self.assertEqual(runners[0].race_id, '26012022-1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import tempfile
+import sys
+import os
+sys.path.append('..')
+sys.path.append('../scraper')
+from image_fetcher import ImageFetcher  # noqa: E402
+from tests.mock_server import MockSite  # noqa: E402
+
+IMAGE = '/racing/content/Images/photo/20220126/1L.jpg'
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class ImageFetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.site = MockSite().start()
+        self.addCleanup(self.site.stop)
+        self.body = b'\xff\xd8race1\xff\xd9'
+        self.site.routes[IMAGE] = (
+            200, {'Content-Type': 'image/jpeg', 'ETag': '"v1"'}, self.body)
+        self.path = os.path.join(self.tmp.name, 'id', 'id.jpg')
+
+    def fetcher(self, **kwargs) -> ImageFetcher:
+        fetcher = ImageFetcher(workers=2, retries=0, **kwargs)
+        self.addCleanup(fetcher.close)
+        return fetcher
+
+    def test_downloads_in_background(self):
+        fetcher = self.fetcher()
+        future = fetcher.submit(self.site.url(IMAGE), self.path)
+        self.assertTrue(future.result())
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), self.body)
+        self.assertFalse(os.path.exists(f'{self.path}.tmp'))
+        self.assertTrue(fetcher.fetch(self.site.url(IMAGE), self.path))
+        self.assertEqual(self.site.requests, [IMAGE])
+        self.assertEqual((fetcher.downloaded, fetcher.skipped), (1, 1))
+
+    def test_revalidates_with_etag(self):
+        index = os.path.join(self.tmp.name, 'images.db')
+        self.fetcher(index_path=index).fetch(self.site.url(IMAGE), self.path)
+        mtime = os.stat(self.path).st_mtime_ns
+        fetcher = self.fetcher(index_path=index, revalidate=True)
+        self.assertTrue(fetcher.fetch(self.site.url(IMAGE), self.path))
+        self.assertEqual(len(self.site.requests), 2)
+        self.assertEqual(fetcher.skipped, 1)
+        self.site.routes[IMAGE] = (200, {'ETag': '"v2"'}, self.body)
+        self.assertTrue(fetcher.fetch(self.site.url(IMAGE), self.path))
+        self.assertEqual(fetcher.skipped, 2)
+        self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+        self.site.routes[IMAGE] = (200, {'ETag': '"v3"'}, b'new')
+        self.assertTrue(fetcher.fetch(self.site.url(IMAGE), self.path))
+        self.assertEqual(fetcher.downloaded, 1)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'new')
+
+    def test_missing_image(self):
+        fetcher = self.fetcher()
+        self.assertFalse(fetcher.fetch(self.site.url('/none.jpg'), self.path))
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(f'{self.path}.tmp'))
+
+    @unittest.skipIf(Image is None, 'Pillow is not available')
+    def test_thumbnail(self):
+        source = os.path.join(self.tmp.name, 'source.jpg')
+        Image.new('RGB', (800, 400)).save(source)
+        with open(source, 'rb') as f:
+            self.site.routes[IMAGE] = (200, {}, f.read())
+        self.fetcher(thumbnail=200).fetch(self.site.url(IMAGE), self.path)
+        with Image.open(self.path.replace('.jpg', '_thumb.jpg')) as thumb:
+            self.assertEqual(thumb.size, (200, 100))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+from unittest import mock
+import urllib.request
+import unittest
+import tempfile
+import json
+import sys
+import os
+sys.path.append('..')
+sys.path.append('../scraper')
+from scraper.web_scraper import Scraper  # noqa: E402
+from metrics import (  # noqa: E402
+                        REGISTRY,
+                        MetricsDumper,
+                        MetricsServer,
+                        Registry
+                        )
+from tests.mock_server import meeting_site, RESULTS_PATH  # noqa: E402
+from tests.helpers import sqlite_db  # noqa: E402
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram('x_seconds', 'X.', (0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        text = self.registry.render()
+        self.assertIn('# TYPE x_seconds histogram', text)
+        self.assertIn('x_seconds_bucket{le="0.1"} 2', text)
+        self.assertIn('x_seconds_bucket{le="1"} 3', text)
+        self.assertIn('x_seconds_bucket{le="+Inf"} 4', text)
+        self.assertIn('x_seconds_count 4', text)
+        self.assertEqual(histogram.snapshot()['sum'], 3.65)
+
+    def test_time_observes_failures(self):
+        histogram = self.registry.histogram('y_seconds', 'Y.')
+        with self.assertRaises(KeyError):
+            with histogram.time():
+                raise KeyError
+        self.assertEqual(histogram.count, 1)
+
+    def test_server_and_dumper(self):
+        counter = self.registry.counter('pages_total', 'Pages.')
+        counter.inc(3)
+        server = MetricsServer(self.registry, port=0).start()
+        self.addCleanup(server.stop)
+        with urllib.request.urlopen(
+                f'http://127.0.0.1:{server.port}/metrics') as response:
+            self.assertIn(b'pages_total 3', response.read())
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'metrics.json')
+            MetricsDumper(path, 3600, self.registry).start().stop()
+            with open(path) as f:
+                self.assertEqual(json.load(f)['metrics'], {'pages_total': 3})
+
+    @mock.patch('scraper.web_scraper.upload_to_bucket_by_id')
+    @mock.patch('scraper.web_scraper.upload_to_rds_by_id')
+    def test_scrape_dates_is_instrumented(self, rds, s3):
+        REGISTRY.reset()
+        self.addCleanup(REGISTRY.reset)
+        site = meeting_site().start()
+        self.addCleanup(site.stop)
+        with tempfile.TemporaryDirectory() as tmp:
+            scr = Scraper(backend='http')
+            scr.base_url = site.url(f'{RESULTS_PATH}?RaceDate=')
+            scr.raw_data_path = tmp
+            scr.scrape_dates([f'{scr.base_url}2022/01/26',
+                              f'{scr.base_url}2022/01/25'],
+                             sqlite_db(tmp), 'bucket')
+            scr.images.close()
+        metrics = REGISTRY.snapshot()
+        self.assertEqual(metrics['scraper_pages_total'], 3)
+        self.assertEqual(metrics['scraper_races_total'], 2)
+        self.assertEqual(metrics['scraper_no_events_total'], 1)
+        self.assertEqual(metrics['scraper_fetch_seconds']['count'], 3)
+        self.assertEqual(metrics['scraper_parse_seconds']['count'], 2)
+        self.assertEqual(metrics['scraper_save_seconds']['count'], 2)
+        self.assertEqual(metrics['scraper_image_seconds']['count'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+from sqlalchemy import (
+                        create_engine,
+                        inspect,
+                        select,
+                        Column,
+                        MetaData,
+                        String,
+                        Table
+                        )
+import unittest
+import tempfile
+import sys
+sys.path.append('..')
+sys.path.append('../scraper')
+from migrate import migrate_runner_table  # noqa: E402
+from records import FIELDS  # noqa: E402
+from uploader import _connect_to_rds, runner_table  # noqa: E402
+from tests.helpers import RACE, sqlite_db  # noqa: E402
+
+
+class MigrateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db = sqlite_db(self.tmp.name)
+
+    def create_legacy_table(self) -> None:
+        '''The runner table as created before its columns were typed.'''
+        legacy = Table(
+            'runner', MetaData(),
+            *[Column(x, String, primary_key=x in ('race_id', 'horse_id'))
+              for x in FIELDS])
+        runners = dict(RACE['runners'])
+        runners['draw'] = ['4', '---']
+        engine = create_engine(f"sqlite:///{self.db['DATABASE']}")
+        with engine.begin() as conn:
+            legacy.create(conn)
+            conn.execute(legacy.insert(), [
+                dict(zip(FIELDS, x))
+                for x in zip(*[runners[x] for x in FIELDS])])
+        engine.dispose()
+
+    def test_converts_text_columns(self):
+        self.create_legacy_table()
+        self.assertEqual(migrate_runner_table(self.db), 2)
+        engine = _connect_to_rds(self.db)
+        types = {x['name']: x['type'].python_type
+                 for x in inspect(engine).get_columns('runner')}
+        self.assertEqual(types['finish_time'], int)
+        self.assertEqual(types['win_odds'], float)
+        with engine.connect() as conn:
+            rows = conn.execute(select(runner_table).order_by(
+                runner_table.c.uuid)).all()
+        self.assertEqual(rows[0].finish_time, 69450)
+        self.assertEqual(rows[0].draw, 4)
+        self.assertIsNone(rows[1].draw)
+        self.assertEqual(rows[1].running_positions, '1 1 2')
+
+    def test_typed_table_is_left_alone(self):
+        _connect_to_rds(self.db)
+        self.assertEqual(migrate_runner_table(self.db), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
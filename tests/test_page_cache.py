@@ -0,0 +1,113 @@
+from unittest import mock
+import unittest
+import tempfile
+import sys
+import os
+sys.path.append('..')
+sys.path.append('../scraper')
+from scraper.web_scraper import Scraper  # noqa: E402
+from async_crawler import AsyncCrawler  # noqa: E402
+from http_driver import HttpDriver  # noqa: E402
+from page_cache import PageCache, PageNotCached  # noqa: E402
+from page_parser import PageParser  # noqa: E402
+from tests.mock_server import meeting_site, fixture, RESULTS_PATH  # noqa
+from tests.helpers import sqlite_db  # noqa: E402
+
+DATE_PATH = f'{RESULTS_PATH}?RaceDate=2022/01/26'
+
+
+class PageCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_put_and_get(self):
+        cache = PageCache(self.tmp.name)
+        content = fixture('race_1.html')
+        cache.put('a', 'b', content, {'ETag': '"1"'})
+        page = cache.get('a')
+        self.assertEqual(page.content, content)
+        self.assertEqual((page.final_url, page.etag), ('b', '"1"'))
+        self.assertLess(cache.size(), len(content) / 3)
+        self.assertIsNone(cache.get('c'))
+        with self.assertRaises(PageNotCached):
+            cache.page('c')
+
+    def test_identical_pages_share_a_file(self):
+        cache = PageCache(self.tmp.name)
+        cache.put('a', 'a', fixture('race_1.html'))
+        size = cache.size()
+        cache.put('b', 'b', fixture('race_1.html'))
+        self.assertEqual(cache.size(), size)
+        cache.put('a', 'a', fixture('race_2.html'))
+        cache.put('b', 'b', fixture('race_2.html'))
+        files = [x for _, _, names in os.walk(
+            os.path.join(self.tmp.name, 'objects')) for x in names]
+        self.assertEqual(len(files), 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = PageCache(self.tmp.name)
+        for name in ('race_1.html', 'race_2.html', 'no_event.html'):
+            cache.put(name, name, fixture(name))
+        cache.max_bytes = cache.size()
+        cache.get('race_1.html')
+        cache.put('abandoned.html', 'abandoned.html',
+                  fixture('abandoned.html'))
+        self.assertIsNone(cache.get('race_2.html'))
+        self.assertIsNotNone(cache.get('race_1.html'))
+        self.assertLessEqual(cache.size(), cache.max_bytes)
+
+
+class CachedDriverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.site = meeting_site().start()
+        self.addCleanup(self.site.stop)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache = PageCache(self.tmp.name)
+        self.url = self.site.url(DATE_PATH)
+
+    def test_revalidates_with_conditional_request(self):
+        driver = HttpDriver(cache=self.cache)
+        driver.get(self.url)
+        with mock.patch.object(self.cache, 'touch') as touch:
+            driver.get(self.url)
+        touch.assert_called_once_with(self.url)
+        self.assertEqual(PageParser(driver).generate_id()['race_id'],
+                         '26012022-1')
+        HttpDriver(cache=self.cache, max_age=60).get(self.url)
+        self.assertEqual(self.site.requests.count(DATE_PATH), 2)
+
+    def test_parses_offline(self):
+        HttpDriver(cache=self.cache).get(self.url)
+        self.site.stop()
+        driver = HttpDriver(cache=self.cache, offline=True)
+        driver.get(self.url)
+        parser = PageParser(driver)
+        self.assertEqual(parser.race_dict()['url'], self.url)
+        self.assertEqual(len(parser.runner_dict()['horse_id']), 3)
+        self.assertEqual(PageParser(self.cache.page(self.url)).race_dict(),
+                         parser.race_dict())
+        with self.assertRaises(PageNotCached):
+            driver.get(self.site.url(f'{RESULTS_PATH}?RaceDate=2022/01/25'))
+
+    @mock.patch('async_crawler.upload_to_bucket_by_id')
+    @mock.patch('async_crawler.upload_to_rds_by_id')
+    def test_crawler_revalidates_cached_pages(self, rds, s3):
+        scr = Scraper(backend='http', cache_path=self.tmp.name)
+        scr.base_url = self.site.url(f'{RESULTS_PATH}?RaceDate=')
+        scr.raw_data_path = self.tmp.name
+        db = sqlite_db(self.tmp.name)
+        AsyncCrawler(scr).run([self.url], db, 'bucket')
+        self.assertEqual(len(scr.cache.urls()), 2)
+        scr.index = None
+        with mock.patch.object(scr.cache, 'touch') as touch:
+            AsyncCrawler(scr).run([self.url], db, 'bucket')
+        self.assertEqual(touch.call_count, 2)
+        self.assertEqual(rds.call_count, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+from unittest import mock
+import unittest
+import tempfile
+import datetime
+import sys
+import os
+sys.path.append('..')
+sys.path.append('../scraper')
+from scraper.web_scraper import Scraper  # noqa: E402
+from tests.mock_server import meeting_site, RESULTS_PATH  # noqa: E402
+from tests.helpers import make_race, sqlite_db  # noqa: E402
+try:
+    from parquet_store import ParquetStore
+except ImportError:
+    ParquetStore = None
+
+
+@unittest.skipIf(ParquetStore is None, 'pyarrow is not available')
+class ParquetStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.store = ParquetStore(self.tmp.name, batch_size=2)
+
+    def files(self, name: str) -> list:
+        return [x for _, _, names in os.walk(
+            os.path.join(self.tmp.name, name)) for x in names]
+
+    def test_writes_typed_date_partitions(self):
+        self.store.add(make_race(1, '26/01/2022', 'TURF - A COURSE'))
+        self.store.add(make_race(1, '23/01/2022', 'ALL WEATHER TRACK'))
+        self.assertEqual(sorted(os.listdir(os.path.join(
+            self.tmp.name, 'race'))),
+            ['race_date=2022-01-23', 'race_date=2022-01-26'])
+        runners = self.store.read_runners().to_pylist()
+        self.assertEqual(len(runners), 4)
+        runner = [x for x in runners if x['race_id'] == '26012022-1'][0]
+        self.assertEqual(runner['date'], datetime.date(2022, 1, 26))
+        self.assertEqual(runner['finish_time'], 69450)
+        self.assertEqual(runner['win_odds'], 2.3)
+        self.assertEqual(runner['actual_weight'], 133)
+        self.assertEqual(runner['running_positions'], [5, 5, 1])
+        race = self.store.read_races(dates=['2022-01-23']).to_pylist()
+        self.assertEqual([x['race_number'] for x in race], [1])
+
+    def test_filters_by_date_and_course(self):
+        for number in (1, 2, 3):
+            course = 'TURF - A COURSE' if number < 3 else 'TURF - C COURSE'
+            self.store.add(make_race(number, '26/01/2022', course))
+        self.store.add(make_race(1, '23/01/2022', 'TURF - A COURSE'))
+        table = self.store.read_runners(
+            dates=[datetime.date(2022, 1, 26)], courses=['TURF - A COURSE'],
+            columns=['race_id', 'horse_id'])
+        self.assertEqual(table.column_names, ['race_id', 'horse_id'])
+        self.assertEqual(sorted(set(table.column('race_id').to_pylist())),
+                         ['26012022-1', '26012022-2'])
+        self.assertEqual(
+            self.store.read_races(dates=['01/01/2020']).num_rows, 0)
+
+    def test_compact_merges_small_files(self):
+        for number in range(1, 7):
+            self.store.add(make_race(number, '26/01/2022', 'TURF'))
+        self.assertEqual(len(self.files('race')), 3)
+        self.assertEqual(self.store.compact(), 4)
+        self.assertEqual(len(self.files('race')), 1)
+        self.assertEqual(len(self.files('runner')), 1)
+        self.assertEqual(self.store.read_runners().num_rows, 12)
+        self.assertEqual(self.store.compact(), 0)
+
+    @mock.patch('scraper.web_scraper.upload_to_bucket_by_id')
+    @mock.patch('scraper.web_scraper.upload_to_rds_by_id')
+    def test_scraper_appends_races(self, rds, s3):
+        site = meeting_site().start()
+        self.addCleanup(site.stop)
+        scr = Scraper(backend='http')
+        scr.base_url = site.url(f'{RESULTS_PATH}?RaceDate=')
+        scr.raw_data_path = os.path.join(self.tmp.name, 'raw_data')
+        scr.parquet_path = os.path.join(self.tmp.name, 'parquet')
+        scr.scrape_dates([f'{scr.base_url}2022/01/26'],
+                         sqlite_db(self.tmp.name), 'bucket')
+        store = ParquetStore(scr.parquet_path)
+        self.assertEqual(store.read_races().num_rows, 2)
+        self.assertEqual(store.read_runners().num_rows, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import requests
+import unittest
+import asyncio
+import time
+import sys
+sys.path.append('..')
+sys.path.append('../scraper')
+from rate_limiter import CircuitOpenError, RateLimiter  # noqa: E402
+from tests.mock_server import MockSite  # noqa: E402
+
+URL = 'http://racing.test/page'
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_additive_increase_multiplicative_decrease(self):
+        limiter = RateLimiter(rate=2, max_rate=3, increase=0.5, slow=1)
+        for _ in range(3):
+            limiter.success(URL, 0.1)
+        self.assertEqual(limiter.host(URL).rate, 3)
+        limiter.failure(URL)
+        self.assertEqual(limiter.host(URL).rate, 1.5)
+        limiter.success(URL, 2)
+        self.assertEqual(limiter.host(URL).rate, 1.5)
+        limiter.host(URL).decreased_at = 0
+        limiter.success(URL, 2)
+        self.assertEqual(limiter.host(URL).rate, 0.75)
+
+    def test_requests_are_spaced_by_the_rate(self):
+        limiter = RateLimiter(rate=20)
+        start = time.monotonic()
+        for _ in range(5):
+            limiter.wait(URL)
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+        other = time.monotonic()
+        limiter.wait('http://images.test/a.jpg')
+        self.assertLess(time.monotonic() - other, 0.05)
+
+    def test_unthrottled_until_a_failure(self):
+        limiter = RateLimiter()
+        for _ in range(10):
+            limiter.wait(URL)
+        self.assertIsNone(limiter.host(URL).rate)
+        limiter.failure(URL)
+        self.assertIsNotNone(limiter.host(URL).rate)
+
+    def test_failures_back_off_exponentially(self):
+        limiter = RateLimiter(backoff=0.05)
+        limiter.failure(URL)
+        limiter.failure(URL)
+        start = time.monotonic()
+        limiter.wait(URL)
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_circuit_breaker(self):
+        limiter = RateLimiter(backoff=0, threshold=2, reset=0.05,
+                              max_trips=2)
+        limiter.failure(URL)
+        limiter.failure(URL)
+        self.assertIsNotNone(limiter.host(URL).open_until)
+        start = time.monotonic()
+        limiter.wait(URL)
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+        self.assertTrue(limiter.host(URL).probing)
+        limiter.success(URL, 0.01)
+        self.assertIsNone(limiter.host(URL).open_until)
+        for _ in range(2):
+            limiter.failure(URL)
+        limiter.wait(URL)
+        limiter.failure(URL)
+        self.assertEqual(limiter.host(URL).trips, 2)
+        with self.assertRaises(CircuitOpenError):
+            limiter.wait(URL)
+        with self.assertRaises(CircuitOpenError):
+            asyncio.run(limiter.wait_async(URL))
+
+    def test_released_probe_lets_the_next_request_through(self):
+        limiter = RateLimiter(backoff=0, threshold=1, reset=0.01)
+        limiter.failure(URL)
+        limiter.wait(URL)
+        self.assertTrue(limiter.host(URL).probing)
+        limiter.release(URL)
+        start = time.monotonic()
+        limiter.wait(URL)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_send_releases_the_probe_on_other_errors(self):
+        class Session(object):
+            def get(self, url, **kwargs):
+                raise KeyboardInterrupt
+
+        limiter = RateLimiter(backoff=0, threshold=1, reset=0.01)
+        limiter.failure(URL)
+        with self.assertRaises(KeyboardInterrupt):
+            limiter.send(Session(), URL)
+        self.assertFalse(limiter.host(URL).probing)
+
+    def test_send_retries_server_errors(self):
+        site = MockSite({'/down': (503, {}, b''),
+                         '/up': (200, {}, b'ok')}).start()
+        self.addCleanup(site.stop)
+        limiter = RateLimiter(backoff=0.01)
+        with requests.Session() as session:
+            response = limiter.send(session, site.url('/down'), retries=2)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(site.requests.count('/down'), 3)
+            response = limiter.send(session, site.url('/up'))
+            self.assertEqual(response.content, b'ok')
+        self.assertEqual(limiter.host(site.base).failures, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+from sqlalchemy import select
+import unittest
+import tempfile
+import copy
+import sys
+sys.path.append('..')
+sys.path.append('../scraper')
+from records import (  # noqa: E402
+                        Runner,
+                        runners_from_json,
+                        runners_to_json,
+                        finish_ms
+                        )
+from uploader import (  # noqa: E402
+                        upload_to_rds_by_id,
+                        runner_table,
+                        _connect_to_rds
+                        )
+from tests.helpers import RACE, sqlite_db, save_race  # noqa: E402
+
+
+class RecordsTest(unittest.TestCase):
+
+    def test_parses_typed_fields(self):
+        runner = runners_from_json(RACE['runners'])[0]
+        self.assertEqual(runner.actual_weight, 133)
+        self.assertEqual(runner.declared_weight, 1138)
+        self.assertEqual(runner.draw, 4)
+        self.assertEqual(runner.running_positions, (5, 5, 1))
+        self.assertEqual(runner.finish_time, 69450)
+        self.assertEqual(runner.win_odds, 2.3)
+        self.assertIsNone(runner.raw)
+        self.assertFalse(hasattr(runner, '__dict__'))
+
+    def test_round_trip_is_lossless(self):
+        runners = copy.deepcopy(RACE['runners'])
+        for name, values in (('place', 'WV'), ('number', '---'),
+                             ('draw', '07'), ('finish_time', '58.10'),
+                             ('win_odds', '10.0'),
+                             ('running_positions', '---')):
+            runners[name][1] = values
+        records = runners_from_json(runners)
+        self.assertEqual(runners_to_json(records), runners)
+        self.assertIsNone(records[1].number)
+        self.assertEqual(records[1].finish_time, 58100)
+        self.assertEqual(records[1].win_odds, 10.0)
+        self.assertEqual(records[1].raw['win_odds'], '10.0')
+
+    def test_finish_ms(self):
+        self.assertEqual(finish_ms('1:09.45'), 69450)
+        self.assertEqual(finish_ms('58.10'), 58100)
+        self.assertIsNone(finish_ms('---'))
+
+    def test_row_for_runner_table(self):
+        row = Runner.from_text(
+            {x: RACE['runners'][x][1] for x in RACE['runners']}).row()
+        self.assertEqual(row['finish_time'], 69530)
+        self.assertEqual(row['running_positions'], '1 1 2')
+
+    def test_rds_stores_typed_columns(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        db = sqlite_db(tmp.name)
+        save_race(tmp.name, RACE)
+        upload_to_rds_by_id(RACE['race_id'], db, tmp.name)
+        with _connect_to_rds(db).connect() as conn:
+            rows = conn.execute(select(
+                runner_table.c.draw, runner_table.c.finish_time,
+                runner_table.c.win_odds).order_by(
+                    runner_table.c.draw)).all()
+        self.assertEqual([tuple(x) for x in rows],
+                         [(1, 69530, 5.6), (4, 69450, 2.3)])
+
+
+if __name__ == '__main__':
+    unittest.main()
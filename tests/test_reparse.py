@@ -0,0 +1,92 @@
+from sqlalchemy import select, update
+import subprocess
+import unittest
+import tempfile
+import json
+import sys
+import os
+sys.path.append('..')
+sys.path.append('../scraper')
+from http_driver import HttpDriver  # noqa: E402
+from page_cache import PageCache  # noqa: E402
+from reparse import reparse  # noqa: E402
+from uploader import _connect_to_rds, race_table, runner_table  # noqa: E402
+from tests.mock_server import meeting_site, RESULTS_PATH  # noqa: E402
+from tests.helpers import sqlite_db  # noqa: E402
+
+SCRAPER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '../scraper')
+
+
+class ReparseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache_path = os.path.join(self.tmp.name, 'cache')
+        self.raw_data_path = os.path.join(self.tmp.name, 'raw_data')
+        site = meeting_site().start()
+        driver = HttpDriver(cache=PageCache(self.cache_path))
+        date = f'{RESULTS_PATH}?RaceDate=2022/01/'
+        for path in (f'{date}26', f'{date}26&Racecourse=HV&RaceNo=1',
+                     f'{date}26&Racecourse=HV&RaceNo=2', f'{date}25'):
+            driver.get(site.url(path))
+        site.stop()
+
+    def load(self, id: str) -> dict:
+        with open(os.path.join(self.raw_data_path, id, f'{id}.json')) as f:
+            return json.load(f)
+
+    def test_rebuilds_json_offline(self):
+        stats = reparse(self.cache_path, self.raw_data_path, workers=2)
+        self.assertEqual(sorted(os.listdir(self.raw_data_path)),
+                         ['26012022-1', '26012022-2'])
+        self.assertEqual((stats['races'], stats['runners']), (2, 5))
+        self.assertGreater(stats['records_per_second'], 0)
+        race = self.load('26012022-2')
+        self.assertEqual(race['runners']['race_id'], ['26012022-2'] * 2)
+        reparse(self.cache_path, self.raw_data_path, workers=2)
+        again = self.load('26012022-2')
+        self.assertEqual(again['uuid'], race['uuid'])
+        self.assertEqual(again['runners']['uuid'], race['runners']['uuid'])
+
+    def test_skips_missing_pages(self):
+        cache = PageCache(self.cache_path)
+        url, = [x for x in cache.urls() if x.endswith('RaceNo=2')]
+        digest, = cache.conn.execute(
+            'SELECT digest FROM pages WHERE url = ?', (url,)).fetchone()
+        os.remove(cache._blob_path(digest))
+        cache.close()
+        stats = reparse(self.cache_path, self.raw_data_path, workers=1)
+        self.assertEqual((stats['races'], stats['skipped']), (1, 1))
+        self.assertEqual(os.listdir(self.raw_data_path), ['26012022-1'])
+        self.assertEqual(os.listdir(os.path.join(
+            self.raw_data_path, '26012022-1')), ['26012022-1.json'])
+
+    def test_does_not_import_selenium(self):
+        code = (f'import sys; sys.path.append({SCRAPER!r}); '
+                'import reparse, http_driver; '
+                'print("selenium" in sys.modules)')
+        result = subprocess.run(
+            [sys.executable, '-c', code],
+            capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), 'False')
+
+    def test_reloads_rds(self):
+        db = sqlite_db(self.tmp.name)
+        reparse(self.cache_path, self.raw_data_path, db=db, workers=1)
+        engine = _connect_to_rds(db)
+        with engine.begin() as conn:
+            conn.execute(update(race_table).values(going='STALE'))
+        reparse(self.cache_path, self.raw_data_path, db=db, workers=1)
+        with engine.connect() as conn:
+            going = conn.execute(select(race_table.c.going)).scalars().all()
+            runners = conn.execute(select(runner_table.c.uuid)).all()
+        self.assertEqual(len(going), 2)
+        self.assertNotIn('STALE', going)
+        self.assertEqual(len(runners), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
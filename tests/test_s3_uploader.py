@@ -0,0 +1,109 @@
+from unittest import mock
+import unittest
+import tempfile
+import boto3
+import sys
+import os
+sys.path.append('..')
+sys.path.append('../scraper')
+from s3_uploader import S3Uploader, MB  # noqa: E402
+from uploader import upload_to_bucket_by_id  # noqa: E402
+try:
+    from moto import mock_aws
+except ImportError:
+    try:
+        from moto import mock_s3 as mock_aws
+    except ImportError:
+        mock_aws = None
+
+ID = '26012022-1'
+
+
+@unittest.skipIf(mock_aws is None, 'moto is not installed')
+class S3UploaderTest(unittest.TestCase):
+
+    def setUp(self):
+        env = mock.patch.dict(os.environ, {
+            'AWS_ACCESS_KEY_ID': 'testing',
+            'AWS_SECRET_ACCESS_KEY': 'testing',
+            'AWS_DEFAULT_REGION': 'us-east-1'
+            })
+        env.start()
+        self.addCleanup(env.stop)
+        self.s3 = mock_aws()
+        self.s3.start()
+        self.addCleanup(self.s3.stop)
+        clients = mock.patch('s3_uploader._clients', {})
+        clients.start()
+        self.addCleanup(clients.stop)
+        self.client = boto3.client('s3')
+        self.client.create_bucket(Bucket='races')
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        folder = os.path.join(self.tmp.name, ID)
+        os.makedirs(folder)
+        with open(os.path.join(folder, f'{ID}.json'), 'w') as f:
+            f.write('{"race_id": "26012022-1"}')
+        with open(os.path.join(folder, f'{ID}.jpg'), 'wb') as f:
+            f.write(os.urandom(6 * MB))
+
+    def keys(self) -> list:
+        objects = self.client.list_objects_v2(Bucket='races')
+        return sorted(x['Key'] for x in objects.get('Contents', []))
+
+    def test_uploads_every_file(self):
+        uploader = S3Uploader('races', self.tmp.name,
+                              multipart_threshold=5 * MB,
+                              multipart_chunksize=5 * MB)
+        uploader.upload_folder(ID)
+        self.assertEqual(self.keys(), [f'{ID}.jpg', f'{ID}.json'])
+        head = self.client.head_object(Bucket='races', Key=f'{ID}.jpg')
+        self.assertTrue(head['ETag'].endswith('-2"'))
+        self.assertEqual(uploader.uploaded, 2)
+
+    def test_leaves_partial_files_and_thumbnails(self):
+        folder = os.path.join(self.tmp.name, ID)
+        for name in (f'{ID}.jpg.tmp', f'{ID}_thumb.jpg'):
+            with open(os.path.join(folder, name), 'wb') as f:
+                f.write(b'partial')
+        uploader = S3Uploader('races', self.tmp.name)
+        self.assertEqual(uploader.upload_folder(ID),
+                         [f'{ID}.json', f'{ID}.jpg'])
+        self.assertEqual(self.keys(), [f'{ID}.jpg', f'{ID}.json'])
+
+    def test_new_keys_are_not_looked_up(self):
+        uploader = S3Uploader('races', self.tmp.name)
+        with mock.patch.object(uploader.client, 'head_object',
+                               wraps=uploader.client.head_object) as head:
+            uploader.upload_folder(ID)
+            self.assertEqual(head.call_count, 0)
+            uploader.upload_folder(ID)
+            self.assertEqual(head.call_count, 2)
+        self.assertEqual((uploader.uploaded, uploader.skipped), (2, 2))
+
+    def test_skips_unchanged_content(self):
+        uploader = S3Uploader('races', self.tmp.name)
+        uploader.upload_folder(ID)
+        uploader.upload_folder(ID)
+        self.assertEqual((uploader.uploaded, uploader.skipped), (2, 2))
+        with open(os.path.join(self.tmp.name, ID, f'{ID}.json'), 'w') as f:
+            f.write('{"race_id": "changed"}')
+        uploader.upload_folder(ID)
+        self.assertEqual((uploader.uploaded, uploader.skipped), (3, 3))
+
+    def test_submit_runs_in_background(self):
+        uploader = S3Uploader('races', self.tmp.name)
+        future = uploader.submit(ID)
+        uploader.wait()
+        self.assertTrue(future.done())
+        self.assertEqual(self.keys(), [f'{ID}.jpg', f'{ID}.json'])
+
+    def test_upload_to_bucket_by_id(self):
+        with mock.patch('uploader.RAW_DATA_PATH', self.tmp.name):
+            self.assertTrue(upload_to_bucket_by_id(ID, 'races'))
+            self.assertFalse(upload_to_bucket_by_id('missing', 'races'))
+        self.assertEqual(self.keys(), [f'{ID}.jpg', f'{ID}.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+from concurrent.futures import ThreadPoolExecutor
+import unittest
+import tempfile
+import time
+import sys
+sys.path.append('..')
+sys.path.append('../scraper')
+from sharding import (  # noqa: E402
+                        ShardWorker,
+                        create_shards,
+                        shard_dates
+                        )
+from uploader import shard_table  # noqa: E402
+from tests.helpers import sqlite_db  # noqa: E402
+
+BASE_URL = 'https://a/LocalResults.aspx?RaceDate='
+
+
+class FakeScraper(object):
+    '''Records the links it is asked to scrape, checking each date with
+    before_date and recording failed dates as a Scraper does.'''
+
+    def __init__(self, delay: float = 0, failing: tuple = ()):
+        self.base_url = BASE_URL
+        self.delay = delay
+        self.failing = failing
+        self.links = []
+        self.calls = 0
+        self.before_date = None
+        self.failed_dates = None
+
+    def scrape_dates(self, links, db, bucket):
+        self.calls += 1
+        for link in links:
+            if self.before_date is not None and not self.before_date(link):
+                return
+            if link in self.failing:
+                self.failed_dates.append(link)
+                continue
+            self.scrape(link)
+
+    def scrape(self, link):
+        time.sleep(self.delay)
+        self.links.append(link)
+
+
+def date_links(days: int) -> list:
+    return [f'{BASE_URL}{x}' for x in shard_dates(
+        '2022/01/31', '2022/01/01')[:days]]
+
+
+class ShardingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db = sqlite_db(self.tmp.name)
+
+    def test_create_shards_is_idempotent(self):
+        self.assertEqual(create_shards(self.db, date_links(25), 10), 3)
+        self.assertEqual(create_shards(self.db, date_links(25), 10), 0)
+        shard = ShardWorker(self.db, 'a').claim()
+        self.assertEqual(shard['shard_id'], '2022/01/31-2022/01/22')
+        self.assertEqual(shard_dates(shard['first_date'],
+                                     shard['last_date'])[-1], '2022/01/22')
+
+    def test_leases_are_exclusive_until_they_expire(self):
+        create_shards(self.db, date_links(2), 1)
+        a = ShardWorker(self.db, 'a', lease_seconds=0.2)
+        b = ShardWorker(self.db, 'b', lease_seconds=0.2)
+        first, second = a.claim(), b.claim()
+        self.assertNotEqual(first['shard_id'], second['shard_id'])
+        self.assertIsNone(b.claim())
+        self.assertFalse(b.renew(first['shard_id']))
+        time.sleep(0.3)
+        reclaimed = b.claim()
+        self.assertEqual(reclaimed['shard_id'], first['shard_id'])
+        self.assertEqual(reclaimed['attempts'], 2)
+        self.assertFalse(a.complete(first['shard_id']))
+        self.assertTrue(b.complete(first['shard_id']))
+
+    def test_workers_share_dates_without_overlap(self):
+        links = date_links(30)
+        create_shards(self.db, links, 3)
+        scrapers = [FakeScraper(delay=0.05) for x in range(4)]
+        workers = [ShardWorker(self.db, f'w{x}', poll_interval=0.01)
+                   for x in range(4)]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            done = list(executor.map(
+                lambda x, y: x.run(y, self.db, 'bucket'), workers, scrapers))
+        self.assertCountEqual(sum((x.links for x in scrapers), []), links)
+        self.assertEqual(sum(x.calls for x in scrapers), 10)
+        self.assertEqual(sum(len(x) for x in done), 10)
+        self.assertTrue(all(done))
+        self.assertEqual(workers[0].remaining(), 0)
+
+    def test_failed_shard_is_released(self):
+        create_shards(self.db, date_links(1), 1)
+        worker = ShardWorker(self.db, 'a', max_attempts=2)
+        scraper = FakeScraper()
+        scraper.scrape_dates = lambda *args: 1 / 0
+        self.assertEqual(worker.run(scraper, self.db, 'bucket'), [])
+        self.assertEqual(worker.remaining(), 0)
+        self.assertIsNone(worker.claim())
+
+    def test_failed_dates_are_skipped(self):
+        links = date_links(3)
+        create_shards(self.db, links, 3)
+        worker = ShardWorker(self.db, 'a', max_attempts=2)
+        scraper = FakeScraper(failing=links[1:2])
+        self.assertEqual(worker.run(scraper, self.db, 'bucket'), [])
+        self.assertEqual(scraper.calls, 2)
+        self.assertEqual(scraper.links, [links[0], links[2]] * 2)
+        self.assertIsNone(scraper.failed_dates)
+        self.assertEqual(worker.remaining(), 0)
+
+    def test_interrupted_shard_fails_after_max_attempts(self):
+        create_shards(self.db, date_links(2), 1)
+        worker = ShardWorker(self.db, 'a', lease_seconds=0.05,
+                             max_attempts=2)
+        scraper = FakeScraper()
+
+        def interrupt(*args):
+            raise KeyboardInterrupt
+
+        scraper.scrape_dates = interrupt
+        for x in range(2):
+            with self.assertRaises(KeyboardInterrupt):
+                worker.run(scraper, self.db, 'bucket')
+        self.assertEqual(worker.claim()['attempts'], 1)
+        time.sleep(0.1)
+        self.assertEqual(worker.claim()['attempts'], 2)
+        time.sleep(0.1)
+        self.assertIsNone(worker.claim())
+        self.assertEqual(worker.remaining(), 0)
+
+    def test_lost_lease_stops_the_shard(self):
+        create_shards(self.db, date_links(5), 5)
+        worker = ShardWorker(self.db, 'a')
+        scraper = FakeScraper()
+        scrape = scraper.scrape
+
+        def steal(link):
+            scrape(link)
+            with worker.engine.begin() as conn:
+                conn.execute(shard_table.update().values(
+                    owner='b', status='done'))
+
+        scraper.scrape = steal
+        self.assertEqual(worker.run(scraper, self.db, 'bucket'), [])
+        self.assertEqual(scraper.links, date_links(1))
+        self.assertEqual(scraper.calls, 1)
+        self.assertEqual(worker.remaining(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+from unittest import mock
+import configparser
+import unittest
+import tempfile
+import sys
+import os
+sys.path.append('..')
+sys.path.append('../scraper')
+from scraper.web_scraper import Scraper  # noqa: E402
+from checkpoint import RunState  # noqa: E402
+from storage import (  # noqa: E402
+                        LocalSink,
+                        SQLSink,
+                        Sink,
+                        Storage,
+                        storage_from_config
+                        )
+from tests.mock_server import meeting_site, RESULTS_PATH  # noqa: E402
+from tests.helpers import count, make_race  # noqa: E402
+from tests.helpers import sqlite_db, save_race  # noqa: E402
+
+
+class StorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.raw_data_path = os.path.join(self.tmp.name, 'raw_data')
+        self.db = sqlite_db(self.tmp.name)
+
+    def config(self, **storage) -> configparser.ConfigParser:
+        config = configparser.ConfigParser()
+        config.read_dict({'RDS': self.db, 'S3': {'BUCKET': 'races'},
+                          'STORAGE': storage})
+        return config
+
+    def test_sql_sink_writes_batches(self):
+        sink = SQLSink(self.db, batch_size=2)
+        sink.add(make_race(1))
+        self.assertEqual(sink.written, 0)
+        sink.add(make_race(2))
+        self.assertEqual(count(self.db), 2)
+        sink.add(make_race(3))
+        sink.close()
+        self.assertEqual((count(self.db), sink.written), (3, 3))
+
+    def test_sql_sink_counts_only_new_races(self):
+        with SQLSink(self.db, batch_size=2) as sink:
+            sink.add(make_race(1))
+        with SQLSink(self.db, batch_size=2) as sink:
+            sink.add(make_race(1))
+            sink.add(make_race(2))
+        self.assertEqual((count(self.db), sink.written), (2, 1))
+
+    def test_sinks_must_write(self):
+        with self.assertRaises(TypeError):
+            Sink()
+
+    def test_local_sink_copies_folders(self):
+        for number in (1, 2):
+            save_race(self.raw_data_path, make_race(number))
+        path = os.path.join(self.tmp.name, 'store')
+        with LocalSink(path, self.raw_data_path, batch_size=5) as sink:
+            sink.add(make_race(1))
+            sink.add(make_race(2))
+            sink.add(make_race(3))
+            self.assertEqual(os.listdir(path), [])
+        self.assertEqual(sorted(os.listdir(path)),
+                         ['26012022-1.json', '26012022-2.json'])
+        self.assertEqual(sink.written, 2)
+
+    def test_storage_from_config(self):
+        storage = storage_from_config(self.config(
+            SINKS='sqlite, local', SQLITE_PATH=self.db['DATABASE'],
+            LOCAL_PATH='', BATCH_SIZE='10'), self.raw_data_path)
+        self.assertIsInstance(storage, Storage)
+        sql, local = storage.sinks
+        self.assertEqual((sql.db['DATABASE'], sql.batch_size),
+                         (self.db['DATABASE'], 10))
+        self.assertEqual(local.path,
+                         os.path.join(self.raw_data_path, 'store'))
+        storage = storage_from_config(self.config(
+            SINKS='sqlite', BATCH_SIZE='10'), self.raw_data_path, 50)
+        self.assertEqual(storage.sinks[0].batch_size, 50)
+        default = storage_from_config(self.config())
+        self.assertEqual([x.name for x in default.sinks], ['sql', 's3'])
+        with self.assertRaises(ValueError):
+            storage_from_config(self.config(SINKS='ftp'))
+
+    @mock.patch('scraper.web_scraper.upload_to_bucket_by_id')
+    @mock.patch('scraper.web_scraper.upload_to_rds_by_id')
+    def test_scraper_writes_to_storage(self, rds, s3):
+        site = meeting_site().start()
+        self.addCleanup(site.stop)
+        scr = Scraper(backend='http')
+        scr.base_url = site.url(f'{RESULTS_PATH}?RaceDate=')
+        scr.raw_data_path = self.raw_data_path
+        scr.checkpoint_path = os.path.join(self.tmp.name, 'checkpoint.db')
+        scr.storage = storage_from_config(self.config(
+            SINKS='sqlite, local', SQLITE_PATH=self.db['DATABASE'],
+            BATCH_SIZE='5'), self.raw_data_path)
+        scr.scrape_dates([f'{scr.base_url}2022/01/26'],
+                         self.db, 'bucket')
+        rds.assert_not_called()
+        s3.assert_not_called()
+        self.assertEqual(count(self.db), 2)
+        self.assertEqual(sorted(os.listdir(scr.storage.sinks[1].path)), [
+            '26012022-1.jpg', '26012022-1.json',
+            '26012022-2.jpg', '26012022-2.json'])
+        state = RunState(scr.checkpoint_path)
+        self.addCleanup(state.close)
+        self.assertEqual(state.counts()['races'], {'uploaded': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
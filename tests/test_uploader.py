@@ -1,6 +1,9 @@
 from sqlalchemy.engine.base import Engine
+from sqlalchemy import event
+from unittest import mock
 import unittest
 import configparser
+import tempfile
 import sys
 import os
 sys.path.append('..')
@@ -8,8 +11,11 @@ sys.path.append('../scraper')
 from scraper.uploader import (  # noqa: E402
                         get_no_event_urls,
                         get_retrieved_urls,
+                        no_event_insert,
+                        upload_to_rds_by_id,
                         _connect_to_rds
                         )
+from tests.helpers import RACE, sqlite_db, save_race  # noqa: E402
 
 
 class UploaderTest(unittest.TestCase):
@@ -41,5 +47,44 @@ class UploaderTest(unittest.TestCase):
         self.assertIsInstance(con.nano)
 
 
+class SQLiteUploaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = sqlite_db(self.tmp.name)
+        patcher = mock.patch('scraper.uploader.RAW_DATA_PATH', self.tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_engine_is_shared(self):
+        engine = _connect_to_rds(self.db)
+        self.assertIs(_connect_to_rds(dict(self.db)), engine)
+        self.assertEqual(get_retrieved_urls(self.db), [])
+        self.assertIs(_connect_to_rds(self.db), engine)
+
+    def test_upload_is_one_pooled_transaction(self):
+        save_race(self.tmp.name, RACE)
+        engine = _connect_to_rds(self.db)
+        checkouts, statements = [], []
+        event.listen(engine.pool, 'checkout',
+                     lambda *args: checkouts.append(1))
+        event.listen(engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args:
+                     statements.append(statement))
+        upload_to_rds_by_id(RACE['race_id'], self.db)
+        self.assertEqual(len(checkouts), 1)
+        self.assertEqual(len(statements), 2)
+        self.assertEqual(get_retrieved_urls(self.db), ['https://a/1'])
+        with engine.connect() as con:
+            runners = con.execute('SELECT horse_id FROM runner').fetchall()
+        self.assertEqual(sorted(x[0] for x in runners), ['B123', 'E280'])
+
+    def test_no_event_insert(self):
+        no_event_insert(self.db, 'https://a/2')
+        no_event_insert(self.db, 'https://a/2')
+        self.assertEqual(get_no_event_urls(self.db), ['https://a/2'])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,11 +1,35 @@
+from unittest import mock
 import unittest
 import configparser
+import tempfile
 from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
 import sys
 import os
 sys.path.append('..')
 sys.path.append('../scraper')
 from scraper.web_scraper import Scraper  # noqa: E402
+from rate_limiter import RateLimiter  # noqa: E402
+from tests.mock_server import meeting_site, RESULTS_PATH  # noqa: E402
+from tests.helpers import sqlite_db  # noqa: E402
+
+
+class SlowDriver(object):
+    '''Stands in for a webdriver whose page renders after a few polls.'''
+
+    def __init__(self, polls_until_ready):
+        self.polls_until_ready = polls_until_ready
+        self.gets = 0
+        self.current_url = None
+
+    def get(self, url):
+        self.gets += 1
+        self.polls = 0
+        self.current_url = url
+
+    def find_elements(self, by, value):
+        self.polls += 1
+        return ['element'] if self.polls >= self.polls_until_ready else []
 
 
 class ScraperTest(unittest.TestCase):
@@ -39,5 +63,100 @@ class ScraperTest(unittest.TestCase):
             )
 
 
+class PageLoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scr = Scraper(backend='http',
+                           limiter=RateLimiter(backoff=0.01))
+        self.scr.timeout = 0.3
+
+    def test_waits_until_ready(self):
+        driver = SlowDriver(polls_until_ready=3)
+        self.assertTrue(self.scr._load_page(driver, 'https://a/'))
+        self.assertEqual(driver.gets, 1)
+        link, latency = self.scr.page_latency[0]
+        self.assertEqual(link, 'https://a/')
+        self.assertLess(latency, self.scr.timeout)
+
+    def test_retry_budget(self):
+        driver = SlowDriver(polls_until_ready=1000)
+        self.assertFalse(self.scr._load_page(driver, 'https://a/'))
+        self.assertEqual(driver.gets, self.scr.retries)
+        self.assertEqual(list(self.scr.page_latency), [])
+
+    def test_driver_error_releases_the_trial_request(self):
+        driver = SlowDriver(polls_until_ready=1)
+        driver.get = mock.Mock(side_effect=WebDriverException('crashed'))
+        self.scr.limiter = RateLimiter(backoff=0, threshold=1, reset=0.01)
+        self.scr.limiter.failure('https://a/')
+        with self.assertRaises(WebDriverException):
+            self.scr._load_page(driver, 'https://a/')
+        self.assertFalse(self.scr.limiter.host('https://a/').probing)
+
+    def test_race_without_results_is_abandoned(self):
+        driver = SlowDriver(polls_until_ready=1)
+        with mock.patch.object(self.scr, '_scrape_page') as scrape_page, \
+                mock.patch('scraper.web_scraper.PageParser.if_event',
+                           return_value=True):
+            self.scr._scrape_race(driver, 'https://a/', {}, 'bucket')
+        scrape_page.assert_not_called()
+        self.assertEqual(driver.gets, self.scr.retries)
+        self.assertEqual(self.scr.limiter.host('https://a/').failures, 0)
+
+
+@mock.patch('scraper.web_scraper.upload_to_bucket_by_id')
+@mock.patch('scraper.web_scraper.upload_to_rds_by_id')
+class CardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.site = meeting_site().start()
+        self.addCleanup(self.site.stop)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.scr = Scraper(backend='http')
+        self.scr.base_url = self.site.url(f'{RESULTS_PATH}?RaceDate=')
+        self.scr.raw_data_path = self.tmp.name
+
+    def test_images_are_awaited_at_the_end_of_the_card(self, rds, s3):
+        requested = []
+        save_image = self.scr._save_image
+
+        def wait(link, id, image):
+            requested.append(list(self.site.requests))
+            return save_image(link, id, image)
+
+        with mock.patch.object(self.scr, '_save_image', side_effect=wait):
+            self.scr.scrape_dates([f'{self.scr.base_url}2022/01/26'],
+                                  sqlite_db(self.tmp.name), 'bucket')
+        race_2 = f'{RESULTS_PATH}?RaceDate=2022/01/26&Racecourse=HV&RaceNo=2'
+        self.assertIn(race_2, requested[0])
+        self.assertEqual([x.args[0] for x in s3.call_args_list],
+                         ['26012022-1', '26012022-2'])
+        self.assertTrue(os.path.exists(
+            os.path.join(self.tmp.name, '26012022-1', '26012022-1.jpg')))
+
+    def test_failed_dates_are_skipped(self, rds, s3):
+        path = f'{RESULTS_PATH}?RaceDate=2022/01/20'
+        self.site.routes[path] = (
+            200, {}, b'<html><body><p>Maintenance</p></body></html>')
+        links = [self.site.url(path), f'{self.scr.base_url}2022/01/26']
+        db = sqlite_db(self.tmp.name)
+        with self.assertRaises(LookupError):
+            self.scr.scrape_dates(links, db, 'bucket')
+        self.scr.failed_dates = []
+        self.scr.scrape_dates(links, db, 'bucket')
+        self.assertEqual(self.scr.failed_dates, links[:1])
+        self.assertEqual([x.args[0] for x in s3.call_args_list],
+                         ['26012022-1', '26012022-2'])
+
+    def test_before_date_stops_the_run(self, rds, s3):
+        links = [f'{self.scr.base_url}2022/01/{x}' for x in (25, 26)]
+        self.scr.before_date = lambda link: link == links[0]
+        self.scr.scrape_dates(links, sqlite_db(self.tmp.name), 'bucket')
+        self.assertNotIn(f'{RESULTS_PATH}?RaceDate=2022/01/26',
+                         self.site.requests)
+        s3.assert_not_called()
+
+
 if __name__ == '__main__':
     unittest.main()
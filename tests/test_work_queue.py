@@ -0,0 +1,169 @@
+from sqlalchemy import select, func
+from unittest import mock
+import unittest
+import threading
+import tempfile
+import sys
+import os
+sys.path.append('..')
+sys.path.append('../scraper')
+from scraper.web_scraper import Scraper  # noqa: E402
+from work_queue import WorkQueue, UploadWorkers  # noqa: E402
+from uploader import _connect_to_rds, runner_table  # noqa: E402
+from tests.mock_server import meeting_site, RESULTS_PATH  # noqa: E402
+from storage import LocalSink, SQLSink, Storage  # noqa: E402
+from tests.helpers import count, make_race  # noqa: E402
+from tests.helpers import sqlite_db, save_race  # noqa: E402
+
+
+class WorkQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'queue.db')
+
+    def test_claim_and_ack(self):
+        queue = WorkQueue(self.path)
+        queue.put('a')
+        queue.put('a')
+        self.assertEqual(queue.claim(), 'a')
+        self.assertIsNone(queue.claim())
+        queue.ack('a')
+        self.assertEqual(queue.counts(), {'done': 1})
+        queue.put('a')
+        self.assertEqual(queue.counts(), {'pending': 1})
+
+    def test_nack_backs_off_then_fails(self):
+        queue = WorkQueue(self.path, max_attempts=2, backoff=0)
+        queue.put('a')
+        queue.nack(queue.claim(), 'error')
+        self.assertEqual(queue.counts(), {'pending': 1})
+        queue.nack(queue.claim(), 'error')
+        self.assertEqual(queue.counts(), {'failed': 1})
+        self.assertIsNone(queue.claim())
+        queue = WorkQueue(self.path, backoff=60)
+        queue.put('b')
+        queue.nack(queue.claim())
+        self.assertIsNone(queue.claim())
+
+    def test_claims_survive_a_crash(self):
+        queue = WorkQueue(self.path, visibility_timeout=0)
+        queue.put('a')
+        self.assertEqual(queue.claim(), 'a')
+        queue.close()
+        queue = WorkQueue(self.path, visibility_timeout=0)
+        self.assertEqual(queue.claim(), 'a')
+        queue.close()
+        queue = WorkQueue(self.path)
+        self.assertIsNone(queue.claim())
+        queue.release_claims()
+        self.assertEqual(queue.claim(), 'a')
+
+
+@mock.patch('uploader.upload_to_bucket_by_id', return_value=True)
+class UploadWorkersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db = sqlite_db(self.tmp.name)
+        self.queue = WorkQueue(os.path.join(self.tmp.name, 'queue.db'),
+                               backoff=0)
+
+    def test_drains_queue_on_stop(self, s3):
+        for x in range(1, 6):
+            save_race(self.tmp.name, make_race(x))
+            self.queue.put(f'26012022-{x}')
+        workers = UploadWorkers(self.queue, self.db, 'bucket', self.tmp.name,
+                                workers=3, poll_interval=0.01).start()
+        workers.stop()
+        self.assertEqual(self.queue.counts(), {'done': 5})
+        self.assertEqual(s3.call_count, 5)
+        s3.assert_called_with(mock.ANY, 'bucket', self.tmp.name)
+        with _connect_to_rds(self.db).connect() as conn:
+            self.assertEqual(conn.execute(
+                select(func.count()).select_from(runner_table)).scalar(), 10)
+
+    def test_failed_upload_is_retried(self, s3):
+        save_race(self.tmp.name, make_race(1))
+        self.queue.put('26012022-1')
+        s3.side_effect = [Exception('S3 unavailable'), True]
+        workers = UploadWorkers(self.queue, self.db, 'bucket', self.tmp.name,
+                                workers=1)
+        self.assertTrue(workers.run_once())
+        self.assertEqual(self.queue.counts(), {'pending': 1})
+        self.assertTrue(workers.run_once())
+        self.assertEqual(self.queue.counts(), {'done': 1})
+        self.assertFalse(workers.run_once())
+
+    def test_writes_through_the_storage(self, s3):
+        for x in (1, 2):
+            save_race(self.tmp.name, make_race(x))
+            self.queue.put(f'26012022-{x}')
+        path = os.path.join(self.tmp.name, 'store')
+        storage = Storage([SQLSink(self.db, batch_size=50),
+                           LocalSink(path, self.tmp.name, batch_size=50)])
+        workers = UploadWorkers(self.queue, {}, 'bucket', self.tmp.name,
+                                workers=1, storage=storage)
+        self.assertTrue(workers.run_once())
+        self.assertEqual(self.queue.counts(), {'done': 1, 'pending': 1})
+        self.assertEqual(count(self.db), 1)
+        self.assertEqual(sorted(os.listdir(path)),
+                         ['26012022-1.json'])
+        self.assertTrue(workers.run_once())
+        self.assertEqual(count(self.db), 2)
+        s3.assert_not_called()
+
+    def test_threads_have_their_own_loader(self, s3):
+        workers = UploadWorkers(self.queue, self.db, 'bucket', self.tmp.name)
+        loaders = []
+        thread = threading.Thread(
+            target=lambda: loaders.append(workers._loader()))
+        thread.start()
+        thread.join()
+        self.assertIs(workers._loader(), workers._loader())
+        self.assertIsNot(workers._loader(), loaders[0])
+
+
+@mock.patch('uploader.upload_to_bucket_by_id', return_value=True)
+@mock.patch('scraper.web_scraper.upload_to_bucket_by_id')
+@mock.patch('scraper.web_scraper.upload_to_rds_by_id')
+class QueuedScraperTest(unittest.TestCase):
+
+    def setUp(self):
+        self.site = meeting_site().start()
+        self.addCleanup(self.site.stop)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db = sqlite_db(self.tmp.name)
+        patcher = mock.patch('uploader.RAW_DATA_PATH', self.tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.path = os.path.join(self.tmp.name, 'queue.db')
+        self.scr = Scraper(backend='http', queue_path=self.path)
+        self.scr.base_url = self.site.url(f'{RESULTS_PATH}?RaceDate=')
+        self.scr.raw_data_path = self.tmp.name
+
+    def test_scrape_enqueues_uploads(self, rds, scraper_s3, s3):
+        self.scrape(1, rds, scraper_s3, s3)
+
+    def test_crawl_enqueues_uploads(self, rds, scraper_s3, s3):
+        with mock.patch('async_crawler.upload_to_rds_by_id') as crawl_rds:
+            self.scrape(2, crawl_rds, scraper_s3, s3)
+
+    def scrape(self, concurrency, rds, scraper_s3, s3):
+        links = [f'{self.scr.base_url}2022/01/26']
+        self.scr.scrape_dates(links, self.db, 'bucket', concurrency)
+        rds.assert_not_called()
+        scraper_s3.assert_not_called()
+        self.assertCountEqual([x.args[0] for x in s3.call_args_list],
+                              ['26012022-1', '26012022-2'])
+        self.assertEqual(WorkQueue(self.path).counts(), {'done': 2})
+        with _connect_to_rds(self.db).connect() as conn:
+            self.assertEqual(conn.execute(
+                select(func.count()).select_from(runner_table)).scalar(), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()